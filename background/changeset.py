@@ -24,9 +24,16 @@ import configuration
 from dbutils import Database
 from textutils import json_decode, json_encode
 
-if "--json-job" in sys.argv[1:]:
+if "--trim-object-cache" in sys.argv[1:]:
+    import gitcache
+
+    cached_count, evicted_count = gitcache.trim()
+
+    sys.stdout.write(json_encode({ "cached": cached_count,
+                                   "evicted": evicted_count }))
+elif "--json-job" in sys.argv[1:] or "--json-worker" in sys.argv[1:]:
     from resource import getrlimit, setrlimit, RLIMIT_RSS
-    from traceback import print_exc
+    from traceback import format_exc
 
     soft_limit, hard_limit = getrlimit(RLIMIT_RSS)
     rss_limit = configuration.services.CHANGESET["rss_limit"]
@@ -35,24 +42,39 @@ if "--json-job" in sys.argv[1:]:
 
     from changeset.create import createChangeset
 
-    request = json_decode(sys.stdin.read())
+    def handleRequest(db, request):
+        try:
+            createChangeset(db, request)
+            return json_encode(request)
+        except:
+            return "Request:\n%s\n\n%s" % (json_encode(request, indent=2), format_exc())
 
-    try:
-        db = Database()
+    if "--json-job" in sys.argv[1:]:
+        request = json_decode(sys.stdin.read())
 
-        createChangeset(db, request)
+        try:
+            db = Database()
+        except:
+            sys.stdout.write("Request:\n%s\n\n%s" % (json_encode(request, indent=2), format_exc()))
+        else:
+            sys.stdout.write(handleRequest(db, request))
+            db.close()
+    else:
+        from background.utils import run_json_worker
 
-        db.close()
+        # The database connection, and the repositories (with their git
+        # processes) cached in it, are reused for all jobs.
+        db = Database()
+
+        def cleanup():
+            db.rollback()
+            db.clearStorage()
 
-        sys.stdout.write(json_encode(request))
-    except:
-        print "Request:"
-        print json_encode(request, indent=2)
-        print
+        run_json_worker(lambda request: handleRequest(db, request), cleanup)
 
-        print_exc(file=sys.stdout)
+        db.close()
 else:
-    from background.utils import JSONJobServer
+    from background.utils import JSONJobServer, PeerServer
 
     def describeRequest(request):
         if request["changeset_type"] in ("direct", "merge", "conflicts"):
@@ -61,15 +83,30 @@ else:
             return "custom (%s..%s)" % (request["parent_sha1"][:8], request["child_sha1"][:8])
 
     class ChangesetServer(JSONJobServer):
+        class TrimObjectCache(PeerServer.ChildProcess):
+            # Trimming walks the whole on-disk cache, so it's done in a child
+            # process to not hold up the dispatching of jobs.
+            def __init__(self, server):
+                super(ChangesetServer.TrimObjectCache, self).__init__(server, [sys.executable, sys.argv[0], "--trim-object-cache"])
+                self.close()
+
+            def handle_input(self, value):
+                self.server.object_cache_trimmed(value)
+
         def __init__(self):
             service = configuration.services.CHANGESET
 
             super(ChangesetServer, self).__init__(service)
 
+            self.__trim_object_cache = None
+
             if "purge_at" in service:
                 hour, minute = service["purge_at"]
                 self.register_maintenance(hour=hour, minute=minute, callback=self.__purge)
 
+            if "trim_object_cache_at" in service:
+                self.register_maintenance(hour=None, minute=service["trim_object_cache_at"], callback=self.__trimObjectCache)
+
         def execute_command(self, client, command):
             if command["command"] == "purge":
                 purged_count = self.__purge()
@@ -80,10 +117,13 @@ else:
             else:
                 super(ChangesetServer, self).execute_command(client, command)
 
+        def request_repository(self, request):
+            return request["repository_name"]
+
         def request_started(self, job, request):
             super(ChangesetServer, self).request_started(job, request)
 
-            self.debug("started: %s in %s [pid=%d]" % (describeRequest(request), request["repository_name"], job.pid))
+            self.debug("started: %s in %s [pid=%d, priority=%s]" % (describeRequest(request), request["repository_name"], job.pid, job.priority))
 
         def request_finished(self, job, request, result):
             super(ChangesetServer, self).request_finished(job, request, result)
@@ -95,6 +135,25 @@ else:
                                  parent_sha1[:8], request["child_sha1"][:8],
                                  request["repository_name"], job.pid))
 
+        def __trimObjectCache(self):
+            if self.__trim_object_cache:
+                self.warning("git object cache trimming still running; skipping")
+                return
+
+            self.__trim_object_cache = ChangesetServer.TrimObjectCache(self)
+            self.add_peer(self.__trim_object_cache)
+
+        def object_cache_trimmed(self, value):
+            self.__trim_object_cache = None
+
+            try: result = json_decode(value)
+            except ValueError:
+                self.error("git object cache trimming failed")
+                return
+
+            if result["evicted"]:
+                self.info("trimmed git object cache: evicted %d of %d objects" % (result["evicted"], result["cached"] + result["evicted"]))
+
         def __purge(self):
             db = Database()
             cursor = db.cursor()
@@ -111,6 +170,15 @@ else:
                 cursor.execute("DELETE FROM changesets USING customchangesets WHERE id=changeset AND time < NOW() - INTERVAL '3 months'")
                 db.commit()
 
+            # Memoized chunk analyses by older versions of the analyzer are
+            # never used again.
+            from diff.analyze import ANALYZER_VERSION
+
+            cursor.execute("DELETE FROM chunkanalyses WHERE version!=%s", (ANALYZER_VERSION,))
+            if cursor.rowcount:
+                self.info("purged %d outdated chunk analyses" % cursor.rowcount)
+            db.commit()
+
             db.close()
 
             return npurged
@@ -17,26 +17,63 @@
 import sys
 import os
 import os.path
-import time
-from subprocess import Popen as process
+import shutil
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
 
 from background.utils import json_decode, json_encode
 
-if "--json-job" in sys.argv[1:]:
+if "--json-job" in sys.argv[1:] or "--json-worker" in sys.argv[1:]:
+    from dbutils import Database
+    from syntaxhighlight import parseWindows, parseChunks
     from syntaxhighlight.generate import generateHighlight
+    from syntaxhighlight.context import storeCodeContexts
 
-    request = json_decode(sys.stdin.read())
-    request["highlighted"] = generateHighlight(repository_path=request["repository_path"],
-                                               sha1=request["sha1"],
-                                               language=request["language"])
+    def handleRequest(db, request):
+        if "windows" in request: windows = parseWindows(request["windows"])
+        else: windows = None
 
-    sys.stdout.write(json_encode(request))
+        if "base_sha1" in request: base = (request["base_sha1"], parseChunks(request["base_chunks"]))
+        else: base = None
+
+        reused = []
+        contexts = []
+
+        request["highlighted"] = generateHighlight(repository_path=request["repository_path"],
+                                                   sha1=request["sha1"],
+                                                   language=request["language"],
+                                                   windows=windows,
+                                                   base=base,
+                                                   reused=reused,
+                                                   contexts=contexts)
+
+        # The code contexts are stored here, in the worker, rather than by the
+        # server, whose event loop shouldn't wait for the database.  Files
+        # highlighted in windows may have been highlighted only partially, so
+        # the contexts from other windows are kept.  Files highlighted
+        # incrementally get the contexts of the unchanged regions copied from
+        # the previous version.
+        if contexts or reused:
+            if reused: reused = (base[0], reused)
+            else: reused = None
+
+            request["contexts"] = storeCodeContexts(db, request["sha1"], contexts, partial=windows is not None, reused=reused)
+
+        return json_encode(request)
+
+    db = Database()
+
+    if "--json-job" in sys.argv[1:]:
+        sys.stdout.write(handleRequest(db, json_decode(sys.stdin.read())))
+    else:
+        from background.utils import run_json_worker
+
+        run_json_worker(lambda request: handleRequest(db, request), db.rollback)
+
+    db.close()
 else:
     from background.utils import JSONJobServer
-    from syntaxhighlight import isHighlighted
-    from syntaxhighlight.context import importCodeContexts
+    from syntaxhighlight import isHighlighted, parseWindows
 
     import configuration
     import dbutils
@@ -47,22 +84,32 @@ else:
 
             super(HighlightServer, self).__init__(service)
 
-            self.db = dbutils.Database()
-
             if "compact_at" in service:
                 hour, minute = service["compact_at"]
                 self.register_maintenance(hour=hour, minute=minute, callback=self.__compact)
 
         def request_result(self, request):
-            if isHighlighted(request["sha1"], request["language"]):
+            if "windows" in request: windows = parseWindows(request["windows"])
+            else: windows = None
+
+            if isHighlighted(request["sha1"], request["language"], windows):
                 result = request.copy()
                 result["highlighted"] = True
                 return result
 
+        def request_repository(self, request):
+            return request["repository_path"]
+
+        def request_batch_key(self, request):
+            # Files from the same repository in the same language are
+            # highlighted by the same worker, reusing its highlighter and
+            # object reader.
+            return (request["repository_path"], request["language"])
+
         def request_started(self, job, request):
             super(HighlightServer, self).request_started(job, request)
 
-            self.debug("started: %s:%s (%s) in %s [pid=%d]" % (request["path"], request["sha1"][:8], request["language"], request["repository_path"], job.pid))
+            self.debug("started: %s:%s (%s) in %s [pid=%d, priority=%s]" % (request["path"], request["sha1"][:8], request["language"], request["repository_path"], job.pid, job.priority))
 
         def request_finished(self, job, request, result):
             super(HighlightServer, self).request_finished(job, request, result)
@@ -70,96 +117,105 @@ else:
             failed = "" if "error" not in result else " (failed!)"
             self.info("finished: %s:%s (%s) in %s [pid=%d]%s" % (request["path"], request["sha1"][:8], request["language"], request["repository_path"], job.pid, failed))
 
-            ncontexts = importCodeContexts(self.db, request["sha1"], request["language"])
+            ncontexts = result.get("contexts")
 
             if ncontexts: self.debug("  added %d code contexts" % ncontexts)
             else: self.debug("  no code contexts added")
 
         def execute_command(self, client, command):
             if command["command"] == "compact":
-                uncompressed_count, compressed_count, purged_files_count, purged_contexts_count = self.__compact()
+                kept_count, purged_count, purged_contexts_count = self.__compact()
 
                 client.write(json_encode({ "status": "ok",
-                                           "uncompressed": uncompressed_count,
-                                           "compressed": compressed_count,
-                                           "purged_files": purged_files_count,
+                                           "kept": kept_count,
+                                           "purged": purged_count,
                                            "purged_contexts": purged_contexts_count }))
                 client.close()
             else:
                 super(HighlightServer, self).execute_command(client, command)
 
-        def __compact(self):
+        def __importLegacyCache(self, store, cache_dir):
+            # Move files highlighted before the store was introduced, stored as
+            # one (possibly bzip2 compressed) file per highlighted file in
+            # two-level hash directories, into the store.
+            import bz2
             import syntaxhighlight
 
+            imported_count = 0
+
+            for section in sorted(os.listdir(cache_dir)):
+                section_dir = os.path.join(cache_dir, section)
+
+                if len(section) != 2 or not os.path.isdir(section_dir):
+                    continue
+
+                for filename in os.listdir(section_dir):
+                    fullname = os.path.join(section_dir, filename)
+
+                    if len(filename) > 39 and filename[38] == ".":
+                        language = filename[39:]
+                        compressed = language.endswith(".bz2")
+                        if compressed: language = language[:-4]
+
+                        if language in syntaxhighlight.LANGUAGES:
+                            if compressed: data = bz2.BZ2File(fullname, "r").read()
+                            else: data = open(fullname).read()
+
+                            store.put(section + filename[:38], language, data, int(os.stat(fullname).st_mtime))
+                            imported_count += 1
+
+                    os.unlink(fullname)
+
+                os.rmdir(section_dir)
+
+            if imported_count:
+                self.info("imported %d files from legacy cache" % imported_count)
+
+        def __compact(self):
+            from syntaxhighlight.store import getStore
+
             cache_dir = configuration.services.HIGHLIGHT["cache_dir"]
 
             if not os.path.isdir(cache_dir):
                 # Newly installed system that hasn't highlighted anything.
-                return 0, 0, 0, 0
+                return 0, 0, 0
 
             self.info("cache compacting started")
 
-            now = time.time()
+            store = getStore()
+
+            self.__importLegacyCache(store, cache_dir)
 
-            max_age_uncompressed = 7 * 24 * 60 * 60
-            max_age_compressed = 90 * 24 * 60 * 60
+            # Code contexts used to be passed from workers to the server in
+            # files in this directory; any left there are left-overs.
+            contexts_dir = os.path.join(cache_dir, "contexts")
 
-            uncompressed_count = 0
-            compressed_count = 0
+            if os.path.isdir(contexts_dir):
+                shutil.rmtree(contexts_dir)
 
-            purged_paths = []
+            max_age = 90 * 24 * 60 * 60
 
+            kept_count, purged_count = store.compact(max_age)
+
+            self.info("cache compacting finished: kept=%d / purged=%d" % (kept_count, purged_count))
+
+            # Drop code contexts of files that are no longer in the cache.
             db = dbutils.Database()
             cursor = db.cursor()
 
-            cursor.execute("CREATE TEMPORARY TABLE purged (sha1 CHAR(40) PRIMARY KEY)")
-            cursor.execute("INSERT INTO purged (sha1) SELECT DISTINCT sha1 FROM codecontexts")
+            cursor.execute("CREATE TEMPORARY TABLE highlighted (sha1 CHAR(40) PRIMARY KEY)")
+            db.bulkInsert("highlighted", ("sha1",), ((sha1,) for sha1 in set(store.sha1s())))
+            cursor.execute("""DELETE FROM codecontexts
+                                    WHERE NOT EXISTS (SELECT 1
+                                                        FROM highlighted
+                                                       WHERE highlighted.sha1=codecontexts.sha1)""")
 
-            for section in sorted(os.listdir(cache_dir)):
-                if len(section) == 2:
-                    for filename in os.listdir("%s/%s" % (cache_dir, section)):
-                        fullname = "%s/%s/%s" % (cache_dir, section, filename)
-                        age = now - os.stat(fullname).st_mtime
-
-                        if len(filename) > 38 and filename[38] == "." and filename[39:] in syntaxhighlight.LANGUAGES:
-                            cursor.execute("DELETE FROM purged WHERE sha1=%s", (section + filename[:38],))
-                            if age > max_age_uncompressed:
-                                self.debug("compressing: %s/%s" % (section, filename))
-                                worker = process(["/bin/bzip2", fullname])
-                                worker.wait()
-                                compressed_count += 1
-                            else:
-                                uncompressed_count += 1
-                        elif len(filename) > 41 and filename[38] == "." and filename[-4] == "." and filename[39:-4] in syntaxhighlight.LANGUAGES:
-                            if filename.endswith(".bz2"):
-                                if age > max_age_compressed:
-                                    self.debug("purging: %s/%s" % (section, filename))
-                                    purged_paths.append(fullname)
-                                else:
-                                    cursor.execute("DELETE FROM purged WHERE sha1=%s", (section + filename[:38],))
-                                    compressed_count += 1
-                            elif filename.endswith(".ctx"):
-                                self.debug("deleting context file: %s/%s" % (section, filename))
-                                os.unlink(fullname)
-                        else:
-                            os.unlink(fullname)
-
-            self.info("cache compacting finished: uncompressed=%d / compressed=%d / purged=%d"
-                      % (uncompressed_count, compressed_count, len(purged_paths)))
-
-            if purged_paths:
-                for path in purged_paths: os.unlink(path)
-
-            cursor.execute("SELECT COUNT(*) FROM purged")
-
-            purged_contexts = cursor.fetchone()[0]
-
-            cursor.execute("DELETE FROM codecontexts USING purged WHERE codecontexts.sha1=purged.sha1")
+            purged_contexts = cursor.rowcount
 
             db.commit()
             db.close()
 
-            return uncompressed_count, compressed_count, len(purged_paths), purged_contexts
+            return kept_count, purged_count, purged_contexts
 
     server = HighlightServer()
     server.run()
@@ -0,0 +1,106 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import sys
+import os
+import time
+import traceback
+import StringIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
+
+import background.utils
+import dbutils
+import configuration
+
+import reviewing.utils as review_utils
+
+from textutils import indent
+
+class ReviewUpdater(background.utils.BackgroundProcess):
+    """Processes review updates queued by the git hook (see
+       reviewing.utils.queueReviewUpdate()), oldest first.  Updates of the same
+       review are processed in order, and if one fails, later updates of that
+       review are held back until the failed update's 'error' is cleared,
+       which the review's owners can do from the review front-page (see
+       operation.manipulatereview.RetryReviewUpdates.)"""
+
+    def __init__(self):
+        super(ReviewUpdater, self).__init__(service=configuration.services.REVIEWUPDATER)
+
+    def process(self, update_id, review_id):
+        output = StringIO.StringIO()
+        before = time.time()
+
+        # Code shared with the git hook prints its output.
+        sys_stdout = sys.stdout
+        sys.stdout = output
+
+        try:
+            try:
+                review_utils.processReviewUpdate(self.db, update_id, output)
+                self.db.commit()
+            finally:
+                sys.stdout = sys_stdout
+        except:
+            self.db.rollback()
+            self.exception("processing of update %d of r/%d failed:" % (update_id, review_id))
+
+            cursor = self.db.cursor()
+            cursor.execute("UPDATE reviewupdates SET error=%s WHERE id=%s",
+                           (traceback.format_exc(), update_id))
+            self.db.commit()
+        else:
+            self.info("processed update %d of r/%d in %.2f seconds" % (update_id, review_id, time.time() - before))
+
+        if output.getvalue().strip():
+            self.debug("output:\n" + indent(output.getvalue().strip()))
+
+        self.db.clearStorage()
+
+    def run(self):
+        self.db = dbutils.Database()
+
+        while not self.terminated:
+            self.interrupted = False
+
+            cursor = self.db.cursor()
+            cursor.execute("""SELECT reviewupdates.id, reviewupdates.review
+                                FROM reviewupdates
+                               WHERE reviewupdates.id IN (SELECT MIN(id)
+                                                            FROM reviewupdates
+                                                        GROUP BY review)
+                                 AND reviewupdates.error IS NULL
+                            ORDER BY reviewupdates.id""")
+            rows = cursor.fetchall()
+
+            self.db.commit()
+
+            for update_id, review_id in rows:
+                self.process(update_id, review_id)
+
+                if self.terminated: break
+
+            if not rows and not (self.terminated or self.interrupted):
+                # The git hook sends SIGHUP when it has queued an update, which
+                # interrupts the sleep.
+                self.debug("nothing to do; sleeping one hour")
+                time.sleep(3600)
+
+        self.db.close()
+
+updater = ReviewUpdater()
+updater.run()
@@ -36,6 +36,64 @@ def freeze(d):
 def thaw(f):
     return dict(f)
 
+# Priority classes of JSONJobServer requests, highest priority first.  Web
+# requests (where a user is waiting) outrank requests made while processing
+# pushes, which outrank other background work.
+PRIORITIES = ("interactive", "push", "background")
+DEFAULT_PRIORITY = "interactive"
+
+def getRSS(pid):
+    for line in open("/proc/%d/status" % pid):
+        words = line.split()
+        if words[0] == "VmRSS:":
+            if words[2].lower() == "kb": unit = 1024
+            elif words[2].lower() == "mb": unit = 1024 ** 2
+            elif words[2].lower() == "gb": unit = 1024 ** 3
+            else: raise Exception, "unknown unit: %s" % words[2]
+            return int(words[1]) * unit
+    else: raise Exception, "invalid pid"
+
+def run_json_worker(handle_request, cleanup=None):
+    """Main loop of a persistent worker process started by a JSONJobServer
+       (using the --json-worker argument.)
+
+       Requests are read from stdin and results written to stdout, each
+       prefixed by a line containing its length in bytes.  'handle_request'
+       is called with each decoded request and should return the encoded
+       result (or an error message, which is reported to the client as an
+       error.)  'cleanup', if given, is called after each result has been
+       written.  Returns when stdin is closed, which is how the server retires
+       a worker.
+
+       A batch of requests is sent as a list, and handled in order, with each
+       result written as soon as it is available."""
+
+    requests = sys.stdin
+    results = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+
+    # Make sure stray output doesn't end up in the result pipe.
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    while True:
+        header = requests.readline()
+        if not header: break
+
+        batch = json_decode(requests.read(int(header)))
+
+        if not isinstance(batch, list):
+            batch = [batch]
+
+        for request in batch:
+            try: result = handle_request(request)
+            except: result = traceback.format_exc()
+
+            if isinstance(result, unicode): result = result.encode("utf-8")
+
+            results.write("%d\n%s" % (len(result), result))
+            results.flush()
+
+            if cleanup: cleanup()
+
 class AdministratorMailHandler(logging.Handler):
     def __init__(self, logfile_path):
         super(AdministratorMailHandler, self).__init__()
@@ -121,9 +179,16 @@ class BackgroundProcess(object):
         self.__logger.error(message + "\n" + indent(traceback.format_exc()))
 
     def register_maintenance(self, hour, minute, callback):
+        """Call 'callback' daily at hour:minute, or if 'hour' is None, hourly
+           at 'minute' minutes past the hour."""
+
         now = time.localtime()
-        since_last = (now[3] * 3600 + now[4] * 60) - (hour * 3600 + minute * 60)
-        if since_last < 0: since_last += 86400
+        if hour is None:
+            since_last = (now[4] - minute) * 60
+            if since_last < 0: since_last += 3600
+        else:
+            since_last = (now[3] * 3600 + now[4] * 60) - (hour * 3600 + minute * 60)
+            if since_last < 0: since_last += 86400
         self.__maintenance_hooks.append([hour, minute, callback, time.time() - since_last])
 
     def run_maintenance(self):
@@ -447,57 +512,349 @@ class JSONJobServer(PeerServer):
             self.close()
 
         def handle_input(self, value):
-            try: result = json_decode(value)
-            except ValueError:
-                self.server.error("invalid response:\n" + indent(value))
-                result = self.request.copy()
-                result["error"] = value
-            for client in self.clients: client.add_result(result)
-            self.server.request_finished(self, self.request, result)
+            self.server.job_finished(self, value)
 
     class JobClient(PeerServer.SocketPeer):
         def handle_input(self, value):
             decoded = json_decode(value)
             if isinstance(decoded, list):
-                self.__requests = decoded
-                self.__pending_requests = map(freeze, decoded)
-                self.__results = []
-                self.server.add_requests(self)
+                self.__detached = False
+                if decoded:
+                    self.__queueRequests(decoded)
+                else:
+                    self.write(json_encode([]))
+                    self.close()
             else:
                 assert isinstance(decoded, dict)
-                self.server.execute_command(self, decoded)
-
-        def has_requests(self):
-            return bool(self.__pending_requests)
-
-        def get_request(self):
-            return self.__pending_requests.pop()
+                if decoded.get("command") == "enqueue":
+                    # The client doesn't want to wait for the results: say OK
+                    # right away, and just log failed requests.
+                    self.__detached = True
+                    self.write(json_encode({ "status": "ok" }))
+                    self.close()
+                    if decoded["requests"]:
+                        self.__queueRequests(decoded["requests"])
+                else:
+                    self.server.execute_command(self, decoded)
+
+        def __queueRequests(self, requests):
+            self.__requests = requests
+            self.__pending_requests = {}
+            self.__results = []
+            self.queued_at = time.time()
+            for request in requests:
+                priority = request.pop("priority", DEFAULT_PRIORITY)
+                if priority not in PRIORITIES: priority = DEFAULT_PRIORITY
+                self.__pending_requests.setdefault(priority, []).append(freeze(request))
+            self.server.add_requests(self)
+
+        def get_priorities(self):
+            return [priority for priority in PRIORITIES if self.__pending_requests.get(priority)]
+
+        def has_requests(self, priority):
+            return bool(self.__pending_requests.get(priority))
+
+        def count_requests(self, priority):
+            return len(self.__pending_requests.get(priority, []))
+
+        def peek_request(self, priority):
+            return self.__pending_requests[priority][-1]
+
+        def get_request(self, priority):
+            return self.__pending_requests[priority].pop()
+
+        def take_requests(self, priority, predicate, limit):
+            """Remove and return (in the order get_request() would have
+               returned them) at most 'limit' pending requests for which
+               'predicate' returns true."""
+            pending = self.__pending_requests.get(priority, [])
+            taken = []
+            for index in range(len(pending) - 1, -1, -1):
+                if len(taken) == limit: break
+                if predicate(pending[index]): taken.append(pending.pop(index))
+            return taken
 
         def add_result(self, result):
             self.__results.append(result)
-            if len(self.__results) == len(self.__requests):
+            if self.__detached:
+                if "error" in result:
+                    self.server.warning("enqueued request failed:\n" + indent(result["error"]))
+            elif len(self.__results) == len(self.__requests):
                 self.write(json_encode(self.__results))
                 self.close()
 
+    class WorkerJob(object):
+        def __init__(self, worker, client, request):
+            self.worker = worker
+            self.pid = worker.pid
+            self.clients = [client]
+            self.request = request
+
+    class Worker(object):
+        """Persistent worker process, running 'sys.argv[0] --json-worker', that
+           handles one job, or batch of jobs, at a time, for any number of
+           jobs.  See run_json_worker() for the protocol."""
+
+        def __init__(self, server):
+            self.server = server
+            self.__process = subprocess.Popen([sys.executable, sys.argv[0], "--json-worker"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self.pid = self.__process.pid
+            self.__stdin = self.__process.stdin
+            self.__stdout = self.__process.stdout
+            self.__write_data = ""
+            self.__read_data = ""
+
+            for pipe in (self.__stdin, self.__stdout):
+                fcntl.fcntl(pipe, fcntl.F_SETFL, fcntl.fcntl(pipe, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+            self.jobs = []
+            self.jobs_count = 0
+            self.retiring = False
+
+            self.server.debug("spawned worker process (pid=%d)" % self.pid)
+
+        def is_idle(self):
+            return not self.jobs and not self.retiring and self.__stdin is not None
+
+        def is_finished(self):
+            return self.__stdin is None and self.__stdout is None
+
+        def start(self, jobs):
+            assert self.is_idle()
+            self.jobs = jobs
+            if len(jobs) == 1: data = json_encode(jobs[0].request)
+            else: data = json_encode([job.request for job in jobs])
+            self.__write_data += "%d\n%s" % (len(data), data)
+
+        def retire(self):
+            """Let the process exit once it has finished its current job."""
+            self.retiring = True
+
+        def writing(self):
+            if self.__stdin and (self.__write_data or (self.retiring and not self.jobs)): return self.__stdin
+            else: return None
+
+        def do_write(self):
+            try:
+                while self.__write_data:
+                    nwritten = os.write(self.__stdin.fileno(), self.__write_data)
+                    self.__write_data = self.__write_data[nwritten:]
+            except OSError, error:
+                if error.errno != errno.EPIPE: raise
+                # The process has died; do_read() will notice.
+                self.__write_data = ""
+                self.__closeStdin()
+                return
+            if self.retiring and not self.jobs:
+                self.__closeStdin()
+
+        def reading(self):
+            return self.__stdout
+
+        def do_read(self):
+            while True:
+                read = os.read(self.__stdout.fileno(), 65536)
+                if not read:
+                    self.__stdout.close()
+                    self.__stdout = None
+                    self.__closeStdin()
+                    jobs, self.jobs = self.jobs, []
+                    for job in jobs:
+                        self.server.worker_job_finished(self, job, "worker process (pid=%d) died" % self.pid)
+                    break
+                self.__read_data += read
+                self.__processResults()
+
+        def __processResults(self):
+            while True:
+                header, separator, rest = self.__read_data.partition("\n")
+                if not separator or len(rest) < int(header): break
+                value, self.__read_data = rest[:int(header)], rest[int(header):]
+                job = self.jobs.pop(0)
+                self.jobs_count += 1
+                self.server.worker_job_finished(self, job, value)
+
+        def __closeStdin(self):
+            if self.__stdin:
+                self.__stdin.close()
+                self.__stdin = None
+
+        def destroy(self):
+            self.__closeStdin()
+            if self.__stdout:
+                self.__stdout.close()
+                self.__stdout = None
+            self.__process.wait()
+            if self.__process.returncode:
+                self.server.error("worker process exited (pid=%d, returncode=%d)" % (self.pid, self.__process.returncode))
+            else:
+                self.server.debug("worker process exited (pid=%d, jobs=%d)" % (self.pid, self.jobs_count))
+
     def __init__(self, service):
         super(JSONJobServer, self).__init__(service)
-        self.__clients_with_requests = []
+        self.__clients_with_requests = dict((priority, []) for priority in PRIORITIES)
         self.__started_requests = {}
         self.__max_jobs = service.get("max_jobs", 4)
 
+        # Requests are started in priority order, but a request's priority is
+        # raised by one class for every 'priority_aging' seconds it has been
+        # waiting, so that lower priority requests eventually get to run.  At
+        # most 'max_jobs_per_repository' jobs run concurrently for the same
+        # repository.
+        self.__priority_aging = service.get("priority_aging", 60)
+        self.__max_jobs_per_repository = service.get("max_jobs_per_repository")
+
+        # Optionally keep a pool of 'max_jobs' persistent worker processes,
+        # instead of starting a new process for each job.  Workers are
+        # replaced after handling 'worker_max_jobs' jobs, or when their RSS
+        # exceeds 'worker_max_rss' bytes.
+        self.__use_workers = service.get("worker_pool", False)
+        self.__worker_max_jobs = service.get("worker_max_jobs")
+        self.__worker_max_rss = service.get("worker_max_rss")
+        self.__workers = []
+
+        # With the worker pool, up to 'max_batch_size' requests with the same
+        # batch key (see request_batch_key()) are handed to a worker at once,
+        # so that it can share work between them.  Batched requests count as
+        # one job against the limits above, and each client still gets its
+        # results as soon as they're done.
+        self.__max_batch_size = service.get("max_batch_size", 1)
+        self.__stopped = False
+
+    def __spawnWorker(self):
+        worker = JSONJobServer.Worker(self)
+        self.__workers.append(worker)
+        self.add_peer(worker)
+        return worker
+
+    def __getIdleWorker(self):
+        for worker in self.__workers:
+            if worker.is_idle(): return worker
+        return self.__spawnWorker()
+
+    def __startJob(self, client, request, priority):
+        if self.__use_workers:
+            batch = [(client, request, priority)]
+
+            if self.__max_batch_size > 1:
+                batch_key = self.request_batch_key(request)
+                if batch_key is not None:
+                    batch.extend(self.__takeBatch(batch_key, self.__max_batch_size - 1))
+
+            worker = self.__getIdleWorker()
+            jobs = []
+
+            for client, request, priority in batch:
+                frozen = freeze(request)
+                if frozen in self.__started_requests:
+                    # Same request twice in the batch.
+                    self.__started_requests[frozen].clients.append(client)
+                    continue
+                job = JSONJobServer.WorkerJob(worker, client, request)
+                job.priority = priority
+                self.request_started(job, request)
+                jobs.append(job)
+
+            worker.start(jobs)
+        else:
+            job = JSONJobServer.Job(self, client, request)
+            job.priority = priority
+            self.add_peer(job)
+            self.request_started(job, request)
+
+    def __takeBatch(self, batch_key, limit):
+        """Remove at most 'limit' pending requests with the batch key
+           'batch_key' from the queues, and return them as a list of (client,
+           request, priority) tuples.  Requests that are already running or
+           finished are dealt with directly, and not returned."""
+
+        batch = []
+
+        def hasBatchKey(frozen):
+            return self.request_batch_key(thaw(frozen)) == batch_key
+
+        for priority in PRIORITIES:
+            clients = self.__clients_with_requests[priority]
+
+            for client in clients[:]:
+                if len(batch) >= limit: return batch
+
+                for frozen in client.take_requests(priority, hasBatchKey, limit - len(batch)):
+                    if frozen in self.__started_requests:
+                        self.__started_requests[frozen].clients.append(client)
+                        continue
+
+                    request = thaw(frozen)
+                    result = self.request_result(request)
+
+                    if result: client.add_result(result)
+                    else: batch.append((client, request, priority))
+
+                if not client.has_requests(priority):
+                    clients.remove(client)
+
+        return batch
+
+    def __countRunningProcesses(self, repository=None):
+        # Jobs in the same batch share a process.
+        pids = set()
+        for job in self.__started_requests.values():
+            if repository is None or self.request_repository(job.request) == repository:
+                pids.add(job.pid)
+        return len(pids)
+
+    def __selectClient(self):
+        """Return the client and priority class of the request to start next,
+           or (None, None) if no request can be started right now."""
+
+        now = time.time()
+        selected = None
+
+        for rank, priority in enumerate(PRIORITIES):
+            for client in self.__clients_with_requests[priority]:
+                if self.__max_jobs_per_repository:
+                    repository = self.request_repository(thaw(client.peek_request(priority)))
+                    if repository is not None and self.__countRunningProcesses(repository) >= self.__max_jobs_per_repository:
+                        # Try the next client; it might want something else.
+                        continue
+
+                effective_rank = rank
+                if self.__priority_aging:
+                    effective_rank -= int((now - client.queued_at) / self.__priority_aging)
+
+                if selected is None or effective_rank < selected[0]:
+                    selected = (effective_rank, client, priority)
+
+                # Clients in the same class are served in round-robin order,
+                # so only the first eligible one is a candidate.
+                break
+
+        if selected is None: return None, None
+        else: return selected[1:]
+
     def __startJobs(self):
+        if self.__stopped:
+            return
+
         # Repeat "start a job" while there are jobs to start and we haven't
         # reached the limit on number of concurrent jobs to run.
-        while self.__clients_with_requests and len(self.__started_requests) < self.__max_jobs:
-            # Fetch next request from first client in list of clients with
-            # pending requests.
-            client = self.__clients_with_requests.pop(0)
-            frozen = client.get_request()
+        while self.__countRunningProcesses() < self.__max_jobs:
+            # Fetch next request from the first eligible client in the list
+            # of clients with pending requests of the selected priority.
+            client, priority = self.__selectClient()
+
+            if client is None:
+                break
+
+            clients = self.__clients_with_requests[priority]
+            clients.remove(client)
 
-            if client.has_requests():
+            frozen = client.get_request(priority)
+
+            if client.has_requests(priority):
                 # Client has more pending requests, so put it back at the end of
                 # the list of clients with pending requests.
-                self.__clients_with_requests.append(client)
+                clients.append(client)
 
             if frozen in self.__started_requests:
                 # Another client has requested the same thing, piggy-back on
@@ -516,28 +873,91 @@ class JSONJobServer(PeerServer):
                 # process, just report result directly to the client.
                 client.add_result(result)
             else:
-                # Start child process.
-                job = JSONJobServer.Job(self, client, request)
-                self.add_peer(job)
-                self.request_started(job, request)
+                # Start child process (or hand the job, and possibly a batch
+                # of similar jobs, to a worker process.)
+                self.__startJob(client, request, priority)
+
+    def job_finished(self, job, value):
+        try: result = json_decode(value)
+        except ValueError:
+            self.error("invalid response:\n" + indent(value))
+            result = job.request.copy()
+            result["error"] = value
+        for client in job.clients: client.add_result(result)
+        self.request_finished(job, job.request, result)
+
+    def worker_job_finished(self, worker, job, value):
+        self.job_finished(job, value)
+
+        if not worker.retiring and worker.reading():
+            if self.restart_requested:
+                worker.retire()
+            elif self.__worker_max_jobs and worker.jobs_count >= self.__worker_max_jobs:
+                self.debug("retiring worker process (pid=%d) after %d jobs" % (worker.pid, worker.jobs_count))
+                worker.retire()
+            elif self.__worker_max_rss:
+                try: rss = getRSS(worker.pid)
+                except Exception: rss = 0
+                if rss > self.__worker_max_rss:
+                    self.debug("retiring worker process (pid=%d) with RSS %d bytes" % (worker.pid, rss))
+                    worker.retire()
+
+            if worker.retiring and not (self.restart_requested or self.__stopped):
+                # Keep the pool warm.
+                self.__spawnWorker()
+
+        self.__startJobs()
+
+    def startup(self):
+        super(JSONJobServer, self).startup()
+
+        if self.__use_workers:
+            for index in range(self.__max_jobs):
+                self.__spawnWorker()
+
+    def shutdown(self):
+        super(JSONJobServer, self).shutdown()
+        self.__stopped = True
+
+    def requestRestart(self):
+        super(JSONJobServer, self).requestRestart()
+
+        for worker in self.__workers:
+            worker.retire()
 
     def add_requests(self, client):
-        assert client.has_requests()
-        self.__clients_with_requests.append(client)
+        for priority in client.get_priorities():
+            self.__clients_with_requests[priority].append(client)
         self.__startJobs()
 
     def execute_command(self, client, command):
-        client.write(json_encode({ "status": "error", "error": "command not supported" }))
+        if command["command"] == "queue":
+            queued = dict((priority, sum(client.count_requests(priority) for client in self.__clients_with_requests[priority]))
+                          for priority in PRIORITIES)
+            running = dict((priority, 0) for priority in PRIORITIES)
+            for job in self.__started_requests.values():
+                running[job.priority] += 1
+
+            client.write(json_encode({ "status": "ok",
+                                       "queued": queued,
+                                       "running": running }))
+        else:
+            client.write(json_encode({ "status": "error", "error": "command not supported" }))
         client.close()
 
     def handle_peer(self, peersocket, peeraddress):
         return JSONJobServer.JobClient(self, peersocket)
 
     def peer_destroyed(self, peer):
-        if isinstance(peer, JSONJobServer.Job): self.__startJobs()
+        if isinstance(peer, JSONJobServer.Worker): self.__workers.remove(peer)
+        if isinstance(peer, (JSONJobServer.Job, JSONJobServer.Worker)): self.__startJobs()
 
     def request_result(self, request):
         pass
+    def request_repository(self, request):
+        pass
+    def request_batch_key(self, request):
+        pass
     def request_started(self, job, request):
         self.__started_requests[freeze(request)] = job
     def request_finished(self, job, request, result):
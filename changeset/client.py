@@ -18,11 +18,15 @@ import configuration
 import socket
 from textutils import json_encode, json_decode, indent
 
-def requestChangesets(requests):
+def requestChangesets(requests, priority="interactive"):
+    """Request changesets from the changeset background service, and wait for
+       them to be created.  'priority' is one of "interactive" (a user is
+       waiting), "push" and "background"."""
+
     try:
         connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         connection.connect(configuration.services.CHANGESET["address"])
-        connection.send(json_encode(requests))
+        connection.send(json_encode([dict(request, priority=priority) for request in requests]))
         connection.shutdown(socket.SHUT_WR)
 
         data = ""
@@ -55,3 +59,33 @@ def requestChangesets(requests):
 
     if errors:
         raise Exception, "Changeset background service failed: one or more requests failed\n%s" % "\n".join(map(indent, errors))
+
+def enqueueChangesets(requests, priority="background"):
+    """Queue creation of changesets in the changeset background service,
+       without waiting for them to be created."""
+
+    try:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(configuration.services.CHANGESET["address"])
+        connection.send(json_encode({ "command": "enqueue",
+                                      "requests": [dict(request, priority=priority) for request in requests] }))
+        connection.shutdown(socket.SHUT_WR)
+
+        data = ""
+
+        while True:
+            received = connection.recv(4096)
+            if not received: break
+            data += received
+
+        connection.close()
+    except socket.error, error:
+        raise Exception, "Changeset background service failed: %s" % error[1]
+
+    try:
+        result = json_decode(data)
+    except:
+        raise Exception, "Changeset background service failed: returned an invalid response (%r)" % data
+
+    if result.get("status") != "ok":
+        raise Exception, "Changeset background service failed: %s" % str(result)
@@ -14,11 +14,110 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import multiprocessing
+from collections import deque
+
+import configuration
 import dbutils
 import gitutils
+import diff.analyze
+import diff.cache
 import diff.merge
 import diff.parse
 
+def analyzeChunks(arguments):
+    # Called in the processes of the pool created by analyzeFiles().
+    return [diff.analyze.analyzeLines(*chunk_arguments) for chunk_arguments in arguments]
+
+def analyzeFiles(db, files, analyses):
+    """Generate the files produced by 'files', in the same order, with their
+       chunks analyzed.
+
+       Memoized analyses are looked up per file (see diff.cache), and the
+       (digest, analysis) tuples of memoizable chunks that had to be analyzed
+       are appended to the list 'analyses', for the caller to store.
+
+       Chunk analysis is CPU bound, and for large changesets it's most of the
+       work.  Files with at least CHANGESET["analysis_min_lines"] changed lines
+       to analyze are therefore handed to a pool of at most
+       CHANGESET["analysis_processes"] processes (the changeset's CPU budget),
+       and analyzed while the following files are parsed.  Smaller files are
+       analyzed directly, since sending them to another process costs more
+       than it saves."""
+
+    service = configuration.services.CHANGESET
+    max_processes = service.get("analysis_processes", 1)
+    min_lines = service.get("analysis_min_lines", 0)
+
+    pool = None
+    pending = deque()
+
+    def finishFile(file, chunks, digests, result):
+        if result is not None:
+            for chunk, analysis in zip(chunks, result.get()):
+                chunk.analysis = analysis
+        for chunk, digest in zip(chunks, digests):
+            if digest is not None:
+                analyses.append((digest, chunk.analysis))
+        return file
+
+    try:
+        for file in files:
+            chunks = []
+            arguments = []
+
+            digests = []
+
+            for index, chunk in enumerate(file.chunks):
+                if chunk.needsAnalysis():
+                    chunks.append(chunk)
+                    arguments.append(chunk.getAnalysisArguments(file, index == len(file.chunks) - 1))
+
+            for chunk_arguments in arguments:
+                if diff.cache.isMemoizable(chunk_arguments):
+                    digests.append(diff.cache.getAnalysisDigest(chunk_arguments))
+                else:
+                    digests.append(None)
+
+            memoized = diff.cache.lookupAnalyses(db, filter(None, digests))
+
+            if memoized:
+                remaining = []
+                for chunk, chunk_arguments, digest in zip(chunks, arguments, digests):
+                    if digest in memoized:
+                        chunk.analysis = memoized[digest]
+                    else:
+                        remaining.append((chunk, chunk_arguments, digest))
+                chunks = [chunk for chunk, chunk_arguments, digest in remaining]
+                arguments = [chunk_arguments for chunk, chunk_arguments, digest in remaining]
+                digests = [digest for chunk, chunk_arguments, digest in remaining]
+
+            changed_lines = sum(chunk.delete_count + chunk.insert_count for chunk in chunks)
+
+            if max_processes > 1 and changed_lines >= min_lines:
+                if pool is None:
+                    pool = multiprocessing.Pool(max_processes)
+                result = pool.apply_async(analyzeChunks, (arguments,))
+            else:
+                for chunk, analysis in zip(chunks, analyzeChunks(arguments)):
+                    chunk.analysis = analysis
+                result = None
+
+            pending.append((file, chunks, digests, result))
+
+            # Produce files in order as soon as they're analyzed, but don't let
+            # more than a couple of files per process pile up waiting for an
+            # earlier file's analysis.
+            while pending and (pending[0][3] is None or pending[0][3].ready() or len(pending) > 2 * max_processes):
+                yield finishFile(*pending.popleft())
+
+        while pending:
+            yield finishFile(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
 def createChangeset(db, request):
     repository_name = request["repository_name"]
     changeset_type = request["changeset_type"]
@@ -26,6 +125,31 @@ def createChangeset(db, request):
     repository = gitutils.Repository.fromName(db, repository_name)
 
     def insertChangeset(db, parent, child, files):
+        # 'files' may be a generator producing the files as git's output is
+        # parsed.  Each file is analyzed and reduced to the rows to insert as
+        # soon as it's produced, and then dropped, so only a few files' chunks
+        # are kept in memory.  Rows refer to files by index into 'paths' until
+        # the files' ids are known.
+        paths = []
+        fileversions_values = []
+        chunks_values = []
+        analyses = []
+
+        for file in analyzeFiles(db, files, analyses):
+            index = len(paths)
+            paths.append(file.path)
+
+            fileversions_values.append((index, file.old_sha1, file.new_sha1, file.old_mode, file.new_mode))
+
+            for chunk in file.chunks:
+                chunks_values.append((index, chunk.delete_offset, chunk.delete_count, chunk.insert_offset, chunk.insert_count, chunk.analysis, 1 if chunk.is_whitespace else 0))
+
+            file.clean()
+
+        # A clash with a concurrently created changeset storing the same
+        # analysis only discards the memoized analyses (see storeAnalyses().)
+        diff.cache.storeAnalyses(db, analyses)
+
         while True:
             # Inserting new files will often clash when creating multiple
             # related changesets in parallel.  It's a simple operation, so if it
@@ -33,44 +157,31 @@ def createChangeset(db, request):
             # fail.  (It will typically succeed the second time because then the
             # new files already exist, and it doesn't need to insert anything.)
             try:
-                dbutils.find_files(db, files)
+                file_ids = [dbutils.find_file(db, path=path) for path in paths]
                 db.commit()
                 break
             except dbutils.IntegrityError:
                 if repository_name == "chromium":
-                    raise Exception, repr((parent, child, files))
+                    raise Exception, repr((parent, child, paths))
                 db.rollback()
 
+        seen_file_ids = set()
+
+        for file_id, path in zip(file_ids, paths):
+            if file_id in seen_file_ids: raise Exception, "duplicate:%d:%s" % (file_id, path)
+            seen_file_ids.add(file_id)
+
         cursor = db.cursor()
         cursor.execute("INSERT INTO changesets (type, parent, child) VALUES (%s, %s, %s) RETURNING id",
                        (changeset_type, parent.getId(db) if parent else None, child.getId(db)))
         changeset_id = cursor.fetchone()[0]
 
-        fileversions_values = []
-        chunks_values = []
-
-        file_ids = set()
-
-        for file in files:
-            if file.id in file_ids: raise Exception, "duplicate:%d:%s" % (file.id, file.path)
-            file_ids.add(file.id)
-
-            fileversions_values.append((changeset_id, file.id, file.old_sha1, file.new_sha1, file.old_mode, file.new_mode))
-
-            for index, chunk in enumerate(file.chunks):
-                chunk.analyze(file, index == len(file.chunks) - 1)
-                chunks_values.append((changeset_id, file.id, chunk.delete_offset, chunk.delete_count, chunk.insert_offset, chunk.insert_count, chunk.analysis, 1 if chunk.is_whitespace else 0))
-
-            file.clean()
-
         if fileversions_values:
-            cursor.executemany("""INSERT INTO fileversions (changeset, file, old_sha1, new_sha1, old_mode, new_mode)
-                                       VALUES (%s, %s, %s, %s, %s, %s)""",
-                               fileversions_values)
+            db.bulkInsert("fileversions", ("changeset", "file", "old_sha1", "new_sha1", "old_mode", "new_mode"),
+                          ((changeset_id, file_ids[row[0]]) + row[1:] for row in fileversions_values))
         if chunks_values:
-            cursor.executemany("""INSERT INTO chunks (changeset, file, deleteOffset, deleteCount, insertOffset, insertCount, analysis, whitespace)
-                                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                               chunks_values)
+            db.bulkInsert("chunks", ("changeset", "file", "deleteOffset", "deleteCount", "insertOffset", "insertCount", "analysis", "whitespace"),
+                          ((changeset_id, file_ids[row[0]]) + row[1:] for row in chunks_values))
 
         return changeset_id
 
@@ -112,12 +223,14 @@ def createChangeset(db, request):
     else:
         # Parse diff and insert changeset(s) into the database.
 
+        lookup = lambda pairs: diff.cache.lookup(db, pairs)
+
         if changeset_type == "merge":
             changes = diff.merge.parseMergeDifferences(db, repository, child)
         elif changeset_type == "direct":
-            changes = diff.parse.parseDifferences(repository, commit=child)
+            changes = diff.parse.parseDifferences(repository, commit=child, stream=True, lookup=lookup)
         else:
-            changes = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=child)
+            changes = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=child, stream=True, lookup=lookup)
 
         for parent_sha1, files in changes.items():
             if parent_sha1 is None: parent = None
@@ -123,38 +123,98 @@ def compareChunks(source_file, source_chunk, target_file, target_chunk, extra_ta
 
     return None
 
-def findSourceChunk(db, changeset, source_file_ids, target_file, target_chunk, extra_target_chunks):
-    for source_file in changeset.files:
-        if source_file_ids and not source_file.id in source_file_ids: continue
+class SourceIndex:
+    """Index of the deleted lines of all potential source chunks.
 
-        for source_chunk in source_file.chunks:
-            # Shouldn't compare chunk to itself, of course.
-            if target_file == source_file and target_chunk == source_chunk:
-                continue
+       Maps each whitespace normalized deleted line to the source chunks that
+       delete it, so that the source chunks sharing lines with a target chunk
+       can be found by lookup instead of by comparing the target chunk with
+       every chunk in the changeset."""
+
+    # Lines deleted by more source chunks than this (blank lines, lone braces
+    # and the like) don't make a source chunk a candidate by themselves; they
+    # are only counted for candidates found through other lines.
+    COMMON_LINE_CHUNKS = 32
+
+    def __init__(self, changeset, source_file_ids):
+        self.sources = []
+        self.lines = {}
 
-            # Much fewer deleted lines than inserted lines in the target chunk;
-            # unlikely to be a relevant source chunk.
-            #if source_chunk.delete_count * 1.5 < target_chunk.insert_count:
-            #    continue
+        for source_file in changeset.files:
+            if source_file_ids and not source_file.id in source_file_ids: continue
 
-            if source_chunk.analysis:
-                # If more than half the deleted lines are mapped against
-                # inserted lines, most likely edited rather than moved code.
-                if source_chunk.delete_count < len(source_chunk.analysis.split(";")) * 2:
+            for source_chunk in source_file.chunks:
+                # Nothing deleted; can't be the source of moved code.
+                if not source_chunk.delete_count:
                     continue
 
-            source_file.loadOldLines()
-            source_chunk.deleted_lines = source_file.getOldLines(source_chunk)
+                if source_chunk.analysis:
+                    # If more than half the deleted lines are mapped against
+                    # inserted lines, most likely edited rather than moved code.
+                    if source_chunk.delete_count < len(source_chunk.analysis.split(";")) * 2:
+                        continue
+
+                source_file.loadOldLines()
+                source_chunk.deleted_lines = source_file.getOldLines(source_chunk)
+
+                wsnorms = set(Line(line).wsnorm for line in source_chunk.deleted_lines)
+                index = len(self.sources)
+
+                self.sources.append((source_file, source_chunk, wsnorms))
+
+                for wsnorm in wsnorms:
+                    self.lines.setdefault(wsnorm, []).append(index)
+
+    def findCandidates(self, target_chunk):
+        """Return the potential source chunks of 'target_chunk', as (file,
+           chunk) tuples in changeset order.
+
+           compareChunks() only accepts a source chunk if at least
+           SMALLEST_INSERT inserted lines are equal to deleted lines in it, so
+           source chunks sharing fewer inserted lines are left out."""
 
-            new_chunk = compareChunks(source_file, source_chunk, target_file, target_chunk, extra_target_chunks)
+        multiplicities = {}
+        for line in target_chunk.inserted_lines:
+            wsnorm = Line(line).wsnorm
+            multiplicities[wsnorm] = multiplicities.get(wsnorm, 0) + 1
 
-            if new_chunk:
-                return source_file, new_chunk
+        counts = {}
+        common = []
+
+        for wsnorm, multiplicity in multiplicities.items():
+            indices = self.lines.get(wsnorm)
+            if not indices:
+                continue
+            if len(indices) > SourceIndex.COMMON_LINE_CHUNKS:
+                common.append((wsnorm, multiplicity))
+                continue
+            for index in indices:
+                counts[index] = counts.get(index, 0) + multiplicity
+
+        for index in counts:
+            wsnorms = self.sources[index][2]
+            for wsnorm, multiplicity in common:
+                if wsnorm in wsnorms:
+                    counts[index] += multiplicity
+
+        return [self.sources[index][:2] for index in sorted(counts) if counts[index] >= SMALLEST_INSERT]
+
+def findSourceChunk(db, source_index, target_file, target_chunk, extra_target_chunks):
+    for source_file, source_chunk in source_index.findCandidates(target_chunk):
+        # Shouldn't compare chunk to itself, of course.
+        if target_file == source_file and target_chunk == source_chunk:
+            continue
+
+        new_chunk = compareChunks(source_file, source_chunk, target_file, target_chunk, extra_target_chunks)
+
+        if new_chunk:
+            return source_file, new_chunk
 
     return None, None
 
 def detectMoves(db, changeset, source_file_ids=None, target_file_ids=None):
     moves = []
+    source_index = None
 
     for target_file in changeset.files:
         if target_file_ids and not target_file.id in target_file_ids: continue
@@ -187,7 +247,10 @@ def detectMoves(db, changeset, source_file_ids=None, target_file_ids=None):
                 target_file.loadNewLines()
                 target_chunk.inserted_lines = target_file.getNewLines(target_chunk)
 
-                source_file, chunk = findSourceChunk(db, changeset, source_file_ids, target_file, target_chunk, extra_target_chunks)
+                if source_index is None:
+                    source_index = SourceIndex(changeset, source_file_ids)
+
+                source_file, chunk = findSourceChunk(db, source_index, target_file, target_chunk, extra_target_chunks)
 
                 if source_file and chunk:
                     moves.append((source_file, target_file, chunk))
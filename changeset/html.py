@@ -22,6 +22,7 @@ from bisect import bisect_right
 import dbutils
 import diff
 import diff.context
+import syntaxhighlight
 import changeset.utils as changeset_utils
 import reviewing.comment as review_comment
 import htmlutils
@@ -253,8 +254,11 @@ table.file > tbody.lines > tr > td.line {
     for index, file in enumerate(changeset.files):
         if file.hasChanges():
             if not file.wasRemoved() and not file.isBinaryChanges():
-                file.loadOldLines(True, request_highlight=True)
-                file.loadNewLines(True, request_highlight=True)
+                chains = comment_chains_per_file.get(file.path, [])
+                old_windows, new_windows = getHighlightWindows(file, chains, context_lines)
+
+                file.loadOldLines(True, request_highlight=True, windows=old_windows)
+                file.loadNewLines(True, request_highlight=True, windows=new_windows)
 
                 lines = diff.context.ContextLines(file, file.chunks, comment_chains_per_file.get(file.path, []), merge=options.get("merge", False), conflicts=changeset.conflicts)
                 file.macro_chunks = lines.getMacroChunks(context_lines, highlight=True)
@@ -267,6 +271,28 @@ table.file > tbody.lines > tr > td.line {
 
             yield target
 
+def getHighlightWindows(file, chains, context_lines):
+    """Return the windows of the old and new versions of the file that are
+       displayed: the chunks, their context lines and commented lines.  Lines
+       of commented lines in one version are displayed at roughly the same
+       offset in the other version, so they're included in both."""
+
+    old_ranges = []
+    new_ranges = []
+
+    for chunk in file.chunks:
+        old_ranges.append((chunk.delete_offset - context_lines, chunk.delete_count + 2 * context_lines))
+        new_ranges.append((chunk.insert_offset - context_lines, chunk.insert_count + 2 * context_lines))
+
+    for chain in chains:
+        for sha1 in (file.old_sha1, file.new_sha1):
+            if sha1 in chain.lines_by_sha1:
+                chain_offset, chain_count = chain.lines_by_sha1[sha1]
+                old_ranges.append((chain_offset - context_lines, chain_count + 2 * context_lines))
+                new_ranges.append((chain_offset - context_lines, chain_count + 2 * context_lines))
+
+    return syntaxhighlight.getWindows(old_ranges), syntaxhighlight.getWindows(new_ranges)
+
 def renderFile(db, target, user, review, file, first_file=False, options={}, conflicts=False, add_resources=True):
     if add_resources:
         addResources(db, user, review, options.get("compact", False), options.get("tabify"), target)
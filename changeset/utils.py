@@ -27,6 +27,7 @@ from time import strftime
 
 import diff
 import diff.analyze
+import diff.cache
 import diff.parse
 import diff.merge
 
@@ -34,22 +35,22 @@ import load
 import dbutils
 import client
 
-def createFullMergeChangeset(db, user, repository, commit, review=None):
+def createFullMergeChangeset(db, user, repository, commit, review=None, do_highlight=True, priority="interactive"):
     assert len(commit.parents) > 1
 
-    changesets = createChangeset(db, user, repository, commit, review=review)
+    changesets = createChangeset(db, user, repository, commit, review=review, do_highlight=do_highlight, priority=priority)
 
     assert len(changesets) == len(commit.parents)
 
     try:
-        replay = createChangeset(db, user, repository, commit, conflicts=True, review=review)
+        replay = createChangeset(db, user, repository, commit, conflicts=True, review=review, do_highlight=do_highlight, priority=priority)
         if replay: changesets.append(replay[0])
     except:
         pass
 
     return changesets
 
-def createChangesets(db, repository, commits):
+def createChangesets(db, repository, commits, priority="push"):
     cursor = db.cursor()
     requests = []
 
@@ -65,9 +66,9 @@ def createChangesets(db, repository, commits):
                               "child_sha1": commit.sha1 })
 
     if requests:
-        client.requestChangesets(requests)
+        client.requestChangesets(requests, priority=priority)
 
-def createChangeset(db, user, repository, commit=None, from_commit=None, to_commit=None, rescan=False, reanalyze=False, conflicts=False, filtered_file_ids=None, review=None, do_highlight=True, load_chunks=True):
+def createChangeset(db, user, repository, commit=None, from_commit=None, to_commit=None, rescan=False, reanalyze=False, conflicts=False, filtered_file_ids=None, review=None, do_highlight=True, load_chunks=True, priority="interactive"):
     cursor = db.cursor()
 
     if conflicts:
@@ -135,17 +136,35 @@ def createChangeset(db, user, repository, commit=None, from_commit=None, to_comm
 
                 if reanalyze and user.hasRole(db, "developer"):
                     analysis_values = []
+                    analyses = []
 
                     for file in changeset.files:
                         if not filtered_file_ids or file.id in filtered_file_ids:
+                            arguments = []
+
                             for index, chunk in enumerate(file.chunks):
+                                if chunk.needsAnalysis(True):
+                                    arguments.append((chunk, chunk.getAnalysisArguments(file, index == len(file.chunks) - 1)))
+
+                            digests = [diff.cache.getAnalysisDigest(chunk_arguments) if diff.cache.isMemoizable(chunk_arguments) else None
+                                       for chunk, chunk_arguments in arguments]
+                            memoized = diff.cache.lookupAnalyses(db, filter(None, digests))
+
+                            for (chunk, chunk_arguments), digest in zip(arguments, digests):
                                 old_analysis = chunk.analysis
-                                chunk.analyze(file, index == len(file.chunks) - 1, True)
+                                if digest in memoized:
+                                    chunk.analysis = memoized[digest]
+                                else:
+                                    chunk.analysis = diff.analyze.analyzeLines(*chunk_arguments)
+                                    if digest is not None:
+                                        analyses.append((digest, chunk.analysis))
                                 if old_analysis != chunk.analysis:
                                     analysis_values.append((chunk.analysis, chunk.id))
 
-                    if reanalyze == "commit" and analysis_values:
-                        cursor.executemany("UPDATE chunks SET analysis=%s WHERE id=%s", analysis_values)
+                    if reanalyze == "commit":
+                        if analysis_values:
+                            cursor.executemany("UPDATE chunks SET analysis=%s WHERE id=%s", analysis_values)
+                        diff.cache.storeAnalyses(db, analyses)
 
                 changesets.append(changeset)
 
@@ -172,7 +191,7 @@ def createChangeset(db, user, repository, commit=None, from_commit=None, to_comm
 
             request["repository_name"] = repository.name
 
-            client.requestChangesets([request])
+            client.requestChangesets([request], priority=priority)
 
             db.commit()
 
@@ -190,7 +209,7 @@ def createChangeset(db, user, repository, commit=None, from_commit=None, to_comm
 
                 changesets.append(changeset)
         else:
-            changes = diff.parse.parseDifferences(repository, from_commit=from_commit, to_commit=to_commit, filter_paths=[describe_file(db, file_id) for file_id in filtered_file_ids])[from_commit.sha1]
+            changes = diff.parse.parseDifferences(repository, from_commit=from_commit, to_commit=to_commit, filter_paths=[describe_file(db, file_id) for file_id in filtered_file_ids], lookup=lambda pairs: diff.cache.lookup(db, pairs))[from_commit.sha1]
 
             dbutils.find_files(db, changes)
 
@@ -205,19 +224,74 @@ def createChangeset(db, user, repository, commit=None, from_commit=None, to_comm
             changesets.append(changeset)
 
     if do_highlight:
-        highlights = {}
+        syntaxhighlight.request.requestHighlights(repository, getHighlights(changesets), priority=priority)
+
+    return changesets
 
-        for changeset in changesets:
-            for file in changeset.files:
-                if file.canHighlight():
-                    if file.old_sha1 and file.old_sha1 != '0' * 40:
-                        highlights[file.old_sha1] = (file.path, file.getLanguage())
-                    if file.new_sha1 and file.new_sha1 != '0' * 40:
-                        highlights[file.new_sha1] = (file.path, file.getLanguage())
+def getHighlights(changesets):
+    """Return the blobs in 'changesets' that can be highlighted, in the form
+       syntaxhighlight.request.requestHighlights() expects."""
+
+    highlights = {}
+
+    def add(sha1, path, language, windows, base=None):
+        if sha1 in highlights:
+            previous_windows, previous_base = highlights[sha1][2:]
+            if previous_windows is None or windows is None: windows = None
+            else: windows = syntaxhighlight.mergeWindows(previous_windows + windows)
+            base = base or previous_base
+        highlights[sha1] = (path, language, windows, base)
+
+    for changeset in changesets:
+        for file in changeset.files:
+            if file.canHighlight():
+                # Only the changed lines (with some context) need to be
+                # highlighted in very large files.
+                if file.chunks is None:
+                    old_windows = new_windows = None
+                else:
+                    old_windows = syntaxhighlight.getWindows([(chunk.delete_offset, chunk.delete_count) for chunk in file.chunks])
+                    new_windows = syntaxhighlight.getWindows([(chunk.insert_offset, chunk.insert_count) for chunk in file.chunks])
 
-        syntaxhighlight.request.requestHighlights(repository, highlights)
+                if file.old_sha1 and file.old_sha1 != '0' * 40:
+                    add(file.old_sha1, file.path, file.getLanguage(), old_windows)
+                if file.new_sha1 and file.new_sha1 != '0' * 40:
+                    add(file.new_sha1, file.path, file.getLanguage(), new_windows, file.getHighlightBase())
 
-    return changesets
+    return highlights
+
+def pregenerateChangesets(db, repository, ranges, highlights={}):
+    """Queue creation of a custom changeset for each (from_commit, to_commit)
+       pair in 'ranges', and highlighting of the blobs in 'highlights', at
+       background priority, without waiting for any of it to finish.
+
+       This is purely an optimization: anything that isn't ready by the time
+       it's needed is created on demand, so failures are ignored."""
+
+    cursor = db.cursor()
+    requests = []
+
+    for from_commit, to_commit in ranges:
+        if to_commit.parents == [from_commit.sha1]:
+            # That's a regular 'direct' changeset, which already exists.
+            continue
+
+        cursor.execute("SELECT 1 FROM changesets WHERE parent=%s AND child=%s AND type='custom'",
+                       (from_commit.getId(db), to_commit.getId(db)))
+
+        if not cursor.fetchone():
+            requests.append({ "repository_name": repository.name,
+                              "changeset_type": "custom",
+                              "parent_sha1": from_commit.sha1,
+                              "child_sha1": to_commit.sha1 })
+
+    if requests:
+        try: client.enqueueChangesets(requests)
+        except: pass
+
+    if highlights:
+        try: syntaxhighlight.request.enqueueHighlights(repository, highlights)
+        except: pass
 
 def getCodeContext(db, sha1, line, minimized=False):
     cursor = db.cursor()
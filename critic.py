@@ -481,8 +481,9 @@ def findreview(req, db, _user):
     cursor.execute("""SELECT reviews.id
                         FROM reviews
                         JOIN branches ON (branches.id=reviews.branch)
-                        JOIN reachable ON (reachable.branch=branches.id)
-                       WHERE reachable.commit=%s""",
+                        JOIN reachableranges ON (reachableranges.branch=branches.id)
+                       WHERE %s BETWEEN reachableranges.first_commit
+                                    AND reachableranges.last_commit""",
                    (commit.getId(db),))
 
     row = cursor.fetchone()
@@ -600,6 +601,7 @@ OPERATIONS = { "fetchlines": operation.fetchlines.FetchLines(),
                "reopenreview": operation.manipulatereview.ReopenReview(),
                "pingreview": operation.manipulatereview.PingReview(),
                "updatereview": operation.manipulatereview.UpdateReview(),
+               "retryreviewupdates": operation.manipulatereview.RetryReviewUpdates(),
                "setfullname": operation.manipulateuser.SetFullname(),
                "setemail": operation.manipulateuser.SetEmail(),
                "setgitemails": operation.manipulateuser.SetGitEmails(),
@@ -14,5 +14,5 @@
 -- License for the specific language governing permissions and limitations under
 -- the License.
 
-DELETE FROM reachable; DELETE FROM branches; DELETE FROM edges; DELETE FROM fileversions; DELETE FROM chunks; DELETE FROM changesets; DELETE FROM commits; DELETE FROM users; DELETE FROM files; DELETE FROM paths; DELETE FROM highlights;
+DELETE FROM reachableranges; DELETE FROM branches; DELETE FROM edges; DELETE FROM fileversions; DELETE FROM chunks; DELETE FROM changesets; DELETE FROM commits; DELETE FROM users; DELETE FROM files; DELETE FROM paths; DELETE FROM highlights;
 
@@ -175,7 +175,12 @@ CREATE TABLE commits
     author_gituser INTEGER NOT NULL REFERENCES gitusers,
     commit_gituser INTEGER NOT NULL REFERENCES gitusers,
     author_time TIMESTAMP NOT NULL,
-    commit_time TIMESTAMP NOT NULL );
+    commit_time TIMESTAMP NOT NULL,
+
+    -- One for commits without parents, otherwise one more than the highest
+    -- generation number of the commit's parents.  Used for quick ancestry
+    -- checks; see dbutils/commitgraph.py.
+    generation INTEGER );
 
 CREATE TABLE edges
   ( parent INTEGER NOT NULL REFERENCES commits ON DELETE CASCADE,
@@ -200,13 +205,19 @@ CREATE TABLE branches
 
 ALTER TABLE repositories ADD CONSTRAINT repositories_branch_fkey FOREIGN KEY (branch) REFERENCES branches;
 
-CREATE TABLE reachable
+-- The commits of each branch, stored as runs of consecutive commit ids: the
+-- branch contains every commit whose id is between first_commit and
+-- last_commit (inclusive.)  Ranges belonging to the same branch don't overlap.
+-- See dbutils/reachable.py.
+CREATE TABLE reachableranges
   ( branch INTEGER NOT NULL REFERENCES branches ON DELETE CASCADE,
-    commit INTEGER NOT NULL REFERENCES commits,
-
-    PRIMARY KEY (branch, commit) );
-CREATE INDEX reachable_branch ON reachable (branch);
-CREATE INDEX reachable_commit ON reachable (commit);
+    first_commit INTEGER NOT NULL,
+    last_commit INTEGER NOT NULL );
+CREATE INDEX reachableranges_branch ON reachableranges (branch);
+-- Finding the ranges that contain a commit scans either the ranges starting
+-- before it or those ending after it; the planner picks the smaller set.
+CREATE INDEX reachableranges_commits ON reachableranges (first_commit, last_commit);
+CREATE INDEX reachableranges_commits_last ON reachableranges (last_commit, first_commit);
 
 CREATE TABLE tags
   ( id SERIAL PRIMARY KEY,
@@ -255,6 +266,7 @@ CREATE TABLE fileversions
     PRIMARY KEY (changeset, file) );
 CREATE INDEX fileversions_old_sha1 ON fileversions (file, old_sha1);
 CREATE INDEX fileversions_new_sha1 ON fileversions (file, new_sha1);
+CREATE INDEX fileversions_sha1s ON fileversions (new_sha1, old_sha1);
 
 CREATE TABLE chunks
   ( id SERIAL PRIMARY KEY,
@@ -269,6 +281,14 @@ CREATE TABLE chunks
     whitespace INTEGER NOT NULL );
 CREATE INDEX chunks_changeset_file ON chunks (changeset, file);
 
+-- Memoized chunk analyses, keyed by a digest of the chunk's lines and the
+-- analyzer's version.  See diff/cache.py.
+CREATE TABLE chunkanalyses
+  ( digest CHAR(40) PRIMARY KEY,
+    version INTEGER NOT NULL,
+    analysis TEXT );
+CREATE INDEX chunkanalyses_version ON chunkanalyses (version);
+
 CREATE TABLE codecontexts
   ( sha1 CHAR(40),
     context VARCHAR(256) NOT NULL,
@@ -354,10 +374,37 @@ CREATE TABLE reviewrebases
 
     UNIQUE (review, old_head) );
 
-CREATE TABLE previousreachable
+-- The commits of a review branch before a rebase, stored like in the
+-- 'reachableranges' table.
+CREATE TABLE previousreachableranges
   ( rebase INTEGER NOT NULL REFERENCES reviewrebases,
-    commit INTEGER NOT NULL REFERENCES commits );
-CREATE INDEX previousreachable_rebase ON previousreachable (rebase);
+    first_commit INTEGER NOT NULL,
+    last_commit INTEGER NOT NULL );
+CREATE INDEX previousreachableranges_rebase ON previousreachableranges (rebase);
+
+-- Updates of review branches that have been accepted by the git hook, but not
+-- yet processed (changesets created, changes assigned, mails sent) by the
+-- review updater service.  Rows are deleted once processed.  If processing
+-- fails, 'error' is set, and no further updates of the review are processed
+-- until it has been cleared.  'uid' is NULL if the update was pushed by the
+-- system user (for instance by the branch tracker.)
+CREATE TABLE reviewupdates
+  ( id SERIAL PRIMARY KEY,
+    review INTEGER NOT NULL REFERENCES reviews ON DELETE CASCADE,
+    uid INTEGER REFERENCES users,
+    old_head INTEGER NOT NULL REFERENCES commits,
+    new_head INTEGER NOT NULL REFERENCES commits,
+    tracked_branch VARCHAR(256),
+    time TIMESTAMP NOT NULL DEFAULT NOW(),
+    error TEXT );
+CREATE INDEX reviewupdates_review ON reviewupdates (review);
+
+-- The commits added to the review by each update.
+CREATE TABLE reviewupdatecommits
+  ( reviewupdate INTEGER NOT NULL REFERENCES reviewupdates ON DELETE CASCADE,
+    commit INTEGER NOT NULL REFERENCES commits,
+
+    PRIMARY KEY (reviewupdate, commit) );
 
 CREATE TYPE reviewfilestate AS ENUM
   ( 'pending',    -- No one has said anything.
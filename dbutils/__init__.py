@@ -20,7 +20,9 @@ from dbutils.session import Session
 from dbutils.database import Database
 from dbutils.user import NoSuchUser, User
 from dbutils.review import ReviewState, Review
-from dbutils.branch import Branch
+from dbutils.branch import Branch, ReachableSet
+from dbutils.commitgraph import CommitGraph, getCommitGraph
+from dbutils import reachable
 from dbutils.paths import is_directory, find_directory, describe_directory, \
                           is_file, find_file, find_files, describe_file, \
                           find_directory_file, explode_path, contained_files
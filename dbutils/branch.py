@@ -15,6 +15,72 @@
 # the License.
 
 import gitutils
+import dbutils.reachable
+
+class ReachableSet(object):
+    """Answers whether commits are reachable from any of a set of branches,
+       according to the 'reachableranges' table, while walking new history
+       from 'head' (for instance the new head of a branch being updated.)
+
+       The commits such a walk can visit are listed up front, using a single
+       'git rev-list', as all commits reachable from 'head' but not from any
+       of 'excluded' (typically the heads of the involved branches), along
+       with their parents.  All of them are then looked up using a single
+       query, and subsequently tested in memory.  Other commits are looked up
+       one at a time, which normally happens only a few times, at the edges
+       of the walk."""
+
+    def __init__(self, db, repository, branch_ids, head, excluded=[]):
+        self.__db = db
+        self.__repository = repository
+        self.__branch_ids = list(branch_ids)
+        self.__parents = {}
+
+        for line in repository.revlist([head], excluded, "--parents"):
+            sha1s = line.split()
+            self.__parents[sha1s[0]] = sha1s[1:]
+
+        self.__queried = set(self.__parents.keys())
+        for parent_sha1s in self.__parents.values():
+            self.__queried.update(parent_sha1s)
+
+        cursor = db.cursor()
+        cursor.execute("""SELECT DISTINCT commits.sha1
+                            FROM commits
+                            JOIN reachableranges ON (commits.id BETWEEN reachableranges.first_commit
+                                                                    AND reachableranges.last_commit)
+                           WHERE reachableranges.branch=ANY (%s)
+                             AND commits.sha1=ANY (%s)""",
+                       (self.__branch_ids, list(self.__queried)))
+
+        self.__reachable = set(sha1 for (sha1,) in cursor)
+
+    def __contains__(self, sha1):
+        sha1 = str(sha1)
+
+        if sha1 not in self.__queried:
+            cursor = self.__db.cursor()
+            cursor.execute("""SELECT 1
+                                FROM commits
+                                JOIN reachableranges ON (commits.id BETWEEN reachableranges.first_commit
+                                                                        AND reachableranges.last_commit)
+                               WHERE reachableranges.branch=ANY (%s)
+                                 AND commits.sha1=%s""",
+                           (self.__branch_ids, sha1))
+
+            self.__queried.add(sha1)
+            if cursor.fetchone():
+                self.__reachable.add(sha1)
+
+        return sha1 in self.__reachable
+
+    def getParents(self, sha1):
+        """Return the parents of a commit, preferably without fetching it."""
+
+        parent_sha1s = self.__parents.get(sha1)
+        if parent_sha1s is None:
+            parent_sha1s = gitutils.Commit.fromSHA1(self.__db, self.__repository, sha1).parents
+        return parent_sha1s
 
 class Branch(object):
     def __init__(self, id, repository, name, head, base, tail, branch_type, review_id):
@@ -36,12 +102,18 @@ class Branch(object):
         return self.id != other.id
 
     def contains(self, db, commit):
-        cursor = db.cursor()
         if isinstance(commit, gitutils.Commit) and commit.id is not None:
-            cursor.execute("SELECT 1 FROM reachable WHERE branch=%s AND commit=%s", [self.id, commit.id])
+            commit_id = commit.id
         else:
-            cursor.execute("SELECT 1 FROM reachable, commits WHERE branch=%s AND commit=id AND sha1=%s", [self.id, str(commit)])
-        return cursor.fetchone() is not None
+            cursor = db.cursor()
+            cursor.execute("SELECT id FROM commits WHERE sha1=%s", [str(commit)])
+            row = cursor.fetchone()
+            if not row: return False
+            commit_id = row[0]
+        return dbutils.reachable.containsCommit(db, self.id, commit_id)
+
+    def getCommitCount(self, db):
+        return dbutils.reachable.countCommits(db, self.id)
 
     def getJSConstructor(self):
         from htmlutils import jsify
@@ -56,10 +128,16 @@ class Branch(object):
     def loadCommits(self, db):
         if self.commits is None:
             cursor = db.cursor()
-            cursor.execute("SELECT commits.id, commits.sha1 FROM reachable, commits WHERE reachable.branch=%s AND reachable.commit=commits.id", [self.id])
-            self.commits = []
-            for commit_id, sha1 in cursor:
-                self.commits.append(gitutils.Commit.fromSHA1(db, self.repository, sha1, commit_id=commit_id))
+            cursor.execute("""SELECT commits.id, commits.sha1
+                                FROM reachableranges
+                                JOIN commits ON (commits.id BETWEEN reachableranges.first_commit
+                                                                AND reachableranges.last_commit)
+                               WHERE reachableranges.branch=%s""",
+                           [self.id])
+            rows = cursor.fetchall()
+            self.commits = gitutils.Commit.fromSHA1s(db, self.repository,
+                                                     [sha1 for commit_id, sha1 in rows],
+                                                     [commit_id for commit_id, sha1 in rows])
 
     def rebase(self, db, base):
         cursor = db.cursor()
@@ -73,11 +151,16 @@ class Branch(object):
                 if branch_id is None: break
                 bases.append(branch_id)
 
-            expression = "SELECT 1 FROM reachable, commits WHERE branch IN (%s) AND commit=id AND sha1=%%s" % ", ".join(["%s"] * len(bases))
+            cursor.execute("""SELECT commits.sha1
+                                FROM branches
+                                JOIN commits ON (commits.id=branches.head)
+                               WHERE branches.id=ANY (%s)""",
+                           (bases,))
+
+            reachable = ReachableSet(db, self.repository, bases, head.sha1, [sha1 for (sha1,) in cursor])
 
             def exclude(sha1):
-                cursor.execute(expression, bases + [sha1])
-                return cursor.fetchone() is not None
+                return sha1 not in force_include and sha1 in reachable
 
             stack = [head.sha1]
             processed = set()
@@ -89,31 +172,30 @@ class Branch(object):
                 if sha1 not in processed:
                     processed.add(sha1)
 
-                    commit = gitutils.Commit.fromSHA1(db, self.repository, sha1)
+                    if not exclude(sha1):
+                        values.append(sha1)
 
-                    if sha1 in force_include or not exclude(sha1):
-                        values.append(commit.getId(db))
-
-                        for sha1 in commit.parents:
-                            if sha1 not in processed and (sha1 in force_include or not exclude(sha1)):
+                        for sha1 in reachable.getParents(sha1):
+                            if sha1 not in processed and not exclude(sha1):
                                 stack.append(sha1)
 
             return values
 
-        cursor.execute("SELECT COUNT(*) FROM reachable WHERE branch=%s", (self.id,))
-        old_count = cursor.fetchone()[0]
+        def setReachable(branch_id, sha1s):
+            commit_ids = dbutils.reachable.getCommitIdsFromSHA1s(db, sha1s)
+            dbutils.reachable.setCommits(db, branch_id, commit_ids)
+
+        old_count = self.getCommitCount(db)
 
         if base.base and base.base.id == self.id:
             self.loadCommits(db)
 
-            cursor.execute("SELECT count(*) FROM reachable WHERE branch=%s", (base.id,))
-            base_old_count = cursor.fetchone()[0]
+            base_old_count = base.getCommitCount(db)
 
             base_reachable = findReachable(base.head, self.base.id, set([commit.sha1 for commit in self.commits]))
             base_new_count = len(base_reachable)
 
-            cursor.execute("DELETE FROM reachable WHERE branch=%s", [base.id])
-            cursor.executemany("INSERT INTO reachable (branch, commit) VALUES (%s, %s)", [(base.id, commit) for commit in base_reachable])
+            setReachable(base.id, base_reachable)
             cursor.execute("UPDATE branches SET base=%s WHERE id=%s", [self.base.id, base.id])
 
             base.base = self.base
@@ -125,8 +207,7 @@ class Branch(object):
         our_reachable = findReachable(self.head, base.id)
         new_count = len(our_reachable)
 
-        cursor.execute("DELETE FROM reachable WHERE branch=%s", [self.id])
-        cursor.executemany("INSERT INTO reachable (branch, commit) VALUES (%s, %s)", [(self.id, commit) for commit in our_reachable])
+        setReachable(self.id, our_reachable)
         cursor.execute("UPDATE branches SET base=%s WHERE id=%s", [base.id, self.id])
 
         self.base = base
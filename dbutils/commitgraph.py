@@ -0,0 +1,330 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import heapq
+
+# Number of generations of ancestors to load along with each commit whose
+# parents are needed.  Loading ancestors in bulk saves a query per commit when
+# walking long linear histories.
+PREFETCH_DEPTH = 128
+
+# The loaded graph is kept between requests, since a commit's parents and
+# generation number never change.  It's simply dropped if it grows too big.
+# Commits loaded during a transaction that is rolled back are dropped, since
+# they may have been inserted by that transaction (see transactionEnded().)
+MAXIMUM_LOADED_COMMITS = 500000
+
+PARENT1 = 1
+PARENT2 = 2
+STALE = 4
+RESULT = 8
+
+class CommitGraph(object):
+    """In-process view of the commit graph stored in the 'commits' and 'edges'
+       tables, used to answer ancestry and merge-base queries without running
+       'git merge-base'.
+
+       Each commit in the 'commits' table has a generation number: one for
+       commits without parents, and otherwise one more than the highest
+       generation number of its parents.  A commit can thus only be an
+       ancestor of commits with higher generation numbers, which is used to
+       cut walks short.
+
+       Queries return None if any commit involved is not in the database (or
+       lacks a generation number), in which case the caller should fall back
+       to asking git."""
+
+    def __init__(self):
+        self.__clear()
+
+    def __clear(self):
+        self.__ids = {}
+        self.__sha1s = {}
+        self.__generations = {}
+        self.__parents = {}
+        self.__uncommitted = {}
+
+    def __loaded(self, db, commit_ids):
+        self.__uncommitted.setdefault(db, set()).update(commit_ids)
+
+    def transactionEnded(self, db, committed, verify=False):
+        """Called by dbutils.Database when 'db' commits or rolls back.  Drops
+           the commits loaded via 'db' during a rolled back transaction, or if
+           'verify' is true, those of them that no longer exist, which means
+           they were inserted by that transaction.  Returns True if 'verify'
+           was true and the database was queried."""
+
+        commit_ids = self.__uncommitted.pop(db, None)
+
+        if committed or not commit_ids:
+            return False
+
+        if verify:
+            cursor = db.cursor()
+            cursor.execute("SELECT id FROM commits WHERE id=ANY (%s)", (list(commit_ids),))
+            commit_ids.difference_update(commit_id for (commit_id,) in cursor)
+
+        for commit_id in commit_ids:
+            sha1 = self.__sha1s.pop(commit_id, None)
+            if sha1 is not None: self.__ids.pop(sha1, None)
+            self.__generations.pop(commit_id, None)
+            self.__parents.pop(commit_id, None)
+
+        return verify
+
+    def __lookup(self, db, sha1s):
+        missing = [sha1 for sha1 in sha1s if sha1 not in self.__ids]
+
+        if missing:
+            if len(self.__ids) > MAXIMUM_LOADED_COMMITS:
+                self.__clear()
+
+            cursor = db.cursor()
+            cursor.execute("SELECT id, sha1, generation FROM commits WHERE sha1=ANY (%s)", (missing,))
+
+            loaded = []
+
+            for commit_id, sha1, generation in cursor:
+                self.__ids[sha1] = commit_id
+                self.__sha1s[commit_id] = sha1
+                self.__generations[commit_id] = generation
+                loaded.append(commit_id)
+
+            self.__loaded(db, loaded)
+
+        try: ids = [self.__ids[sha1] for sha1 in sha1s]
+        except KeyError: return None
+
+        if None in [self.__generations[commit_id] for commit_id in ids]:
+            return None
+
+        return ids
+
+    def __load(self, db, commit_ids):
+        """Make sure the parents of each commit in 'commit_ids', and the
+           generation numbers of those parents, are loaded."""
+
+        pending = [commit_id for commit_id in commit_ids if commit_id not in self.__parents]
+
+        if not pending:
+            return
+
+        cursor = db.cursor()
+        cursor.execute("""WITH RECURSIVE walk (id, depth) AS (
+                              SELECT id, 0
+                                FROM commits
+                               WHERE id=ANY (%s)
+                            UNION
+                              SELECT edges.parent, walk.depth + 1
+                                FROM walk
+                                JOIN edges ON (edges.child=walk.id)
+                               WHERE walk.depth < %s
+                          )
+                          SELECT DISTINCT walk.id, edges.parent, commits.sha1, commits.generation
+                            FROM walk
+                 LEFT OUTER JOIN edges ON (edges.child=walk.id)
+                 LEFT OUTER JOIN commits ON (commits.id=edges.parent)""",
+                       (pending, PREFETCH_DEPTH))
+
+        parents = {}
+
+        for child_id, parent_id, parent_sha1, parent_generation in cursor:
+            child_parents = parents.setdefault(child_id, [])
+            if parent_id is not None:
+                child_parents.append(parent_id)
+                self.__ids[parent_sha1] = parent_id
+                self.__sha1s[parent_id] = parent_sha1
+                self.__generations[parent_id] = parent_generation
+
+        for child_id, child_parents in parents.items():
+            self.__parents[child_id] = tuple(child_parents)
+
+        self.__loaded(db, parents.keys())
+        self.__loaded(db, [parent_id for child_parents in parents.values() for parent_id in child_parents])
+
+    def __getParents(self, db, commit_id, queue_ids=()):
+        if commit_id not in self.__parents:
+            # Load everything we're likely to need next in one go.
+            self.__load(db, [commit_id] + list(queue_ids))
+        return self.__parents.get(commit_id, ())
+
+    def getGeneration(self, db, sha1):
+        ids = self.__lookup(db, [sha1])
+        if ids is None: return None
+        return self.__generations[ids[0]]
+
+    def isAncestor(self, db, ancestor_sha1, descendant_sha1):
+        """Return True if 'ancestor_sha1' is an ancestor of (or the same commit
+           as) 'descendant_sha1', False if not, or None if unknown."""
+
+        ids = self.__lookup(db, [ancestor_sha1, descendant_sha1])
+        if ids is None: return None
+
+        ancestor_id, descendant_id = ids
+        ancestor_generation = self.__generations[ancestor_id]
+
+        if ancestor_id == descendant_id: return True
+
+        queue = [descendant_id]
+        processed = set(queue)
+
+        while queue:
+            self.__load(db, queue)
+
+            next_queue = []
+
+            for commit_id in queue:
+                for parent_id in self.__parents.get(commit_id, ()):
+                    if parent_id == ancestor_id:
+                        return True
+                    if parent_id in processed:
+                        continue
+                    processed.add(parent_id)
+
+                    parent_generation = self.__generations.get(parent_id)
+                    if parent_generation is None:
+                        return None
+                    if parent_generation > ancestor_generation:
+                        next_queue.append(parent_id)
+
+            queue = next_queue
+
+        return False
+
+    def mergebase(self, db, sha1_1, sha1_2):
+        """Return the SHA-1 of a best common ancestor of two commits (like 'git
+           merge-base' without --all), or None if unknown or if the commits
+           have no common ancestor."""
+
+        ids = self.__lookup(db, [sha1_1, sha1_2])
+        if ids is None: return None
+
+        id_1, id_2 = ids
+
+        if id_1 == id_2: return sha1_1
+
+        # Paint down from both commits, processing commits in order of
+        # descending generation number, which guarantees that all of a
+        # commit's descendants are processed before it is.  A commit painted
+        # from both sides is a merge base, unless it's an ancestor of an
+        # already found merge base (in which case it will have been painted
+        # STALE.)
+
+        flags = { id_1: PARENT1, id_2: PARENT2 }
+        queue = [(-self.__generations[id_1], id_1), (-self.__generations[id_2], id_2)]
+        heapq.heapify(queue)
+        queued = set([id_1, id_2])
+        nonstale = 2
+        results = []
+
+        while nonstale:
+            generation, commit_id = heapq.heappop(queue)
+            queued.remove(commit_id)
+
+            commit_flags = flags[commit_id]
+
+            if not commit_flags & STALE:
+                nonstale -= 1
+
+            if commit_flags & (PARENT1 | PARENT2) == (PARENT1 | PARENT2):
+                if not commit_flags & RESULT:
+                    commit_flags |= RESULT
+                    if not commit_flags & STALE:
+                        results.append(commit_id)
+                commit_flags |= STALE
+                flags[commit_id] = commit_flags
+
+            for parent_id in self.__getParents(db, commit_id, queued):
+                parent_flags = flags.get(parent_id, 0)
+                if parent_flags & commit_flags == commit_flags:
+                    continue
+
+                parent_generation = self.__generations.get(parent_id)
+                if parent_generation is None:
+                    return None
+
+                if parent_id in queued:
+                    if parent_flags & STALE == 0 and commit_flags & STALE:
+                        nonstale -= 1
+                else:
+                    heapq.heappush(queue, (-parent_generation, parent_id))
+                    queued.add(parent_id)
+                    if not (parent_flags | commit_flags) & STALE:
+                        nonstale += 1
+
+                flags[parent_id] = parent_flags | commit_flags
+
+        if not results: return None
+
+        return self.__sha1s[results[0]]
+
+    def calculateGenerations(self, db, commits):
+        """Calculate generation numbers for new commits.
+
+           'commits' is a list of (sha1, parent_sha1s) tuples of commits that
+           are not in the database yet, in any order.  Parents must either be
+           in 'commits' or in the database.  Returns a dictionary mapping each
+           new commit's SHA-1 to its generation number, or to None if it can't
+           be calculated."""
+
+        parents = dict(commits)
+        existing = set()
+
+        for sha1, parent_sha1s in commits:
+            existing.update(parent_sha1 for parent_sha1 in parent_sha1s if parent_sha1 not in parents)
+
+        generations = {}
+
+        if existing:
+            cursor = db.cursor()
+            cursor.execute("SELECT sha1, generation FROM commits WHERE sha1=ANY (%s)", (list(existing),))
+            generations.update(cursor)
+
+            # Parents that aren't in the database.
+            for sha1 in existing:
+                generations.setdefault(sha1, None)
+
+        for sha1, parent_sha1s in commits:
+            stack = [sha1]
+
+            while stack:
+                current = stack[-1]
+
+                if current in generations:
+                    stack.pop()
+                    continue
+
+                pending = [parent_sha1 for parent_sha1 in parents[current] if parent_sha1 not in generations]
+
+                if pending:
+                    stack.extend(pending)
+                    continue
+
+                stack.pop()
+
+                parent_generations = [generations[parent_sha1] for parent_sha1 in parents[current]]
+
+                if None in parent_generations:
+                    generations[current] = None
+                else:
+                    generations[current] = 1 + max([0] + parent_generations)
+
+        return dict((sha1, generations[sha1]) for sha1, parent_sha1s in commits)
+
+__graph = CommitGraph()
+
+def getCommitGraph():
+    return __graph
@@ -18,10 +18,56 @@ import time
 import dbaccess
 
 from dbutils.session import Session
+from dbutils.commitgraph import getCommitGraph
 
 class InvalidCursorError(Exception):
     pass
 
+def copyValue(value):
+    """Format a value for COPY's text format."""
+
+    if value is None: return "\\N"
+    if isinstance(value, unicode): value = value.encode("utf-8")
+    else: value = str(value)
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+class CopyStream(object):
+    """File-like object producing COPY text format data from a sequence of
+       rows, formatted as it is read rather than all up front."""
+
+    def __init__(self, rows):
+        self.__rows = iter(rows)
+        self.__buffer = ""
+
+    def __fill(self, size):
+        lines = [self.__buffer]
+        length = len(self.__buffer)
+        for row in self.__rows:
+            line = "\t".join(map(copyValue, row)) + "\n"
+            lines.append(line)
+            length += len(line)
+            if length >= size: break
+        self.__buffer = "".join(lines)
+
+    def read(self, size=-1):
+        if size < 0:
+            self.__fill(float("inf"))
+        elif len(self.__buffer) < size:
+            self.__fill(size)
+        if size < 0:
+            data, self.__buffer = self.__buffer, ""
+        else:
+            data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        if "\n" not in self.__buffer:
+            self.__fill(1)
+        index = self.__buffer.find("\n") + 1
+        if index == 0: index = len(self.__buffer)
+        data, self.__buffer = self.__buffer[:index], self.__buffer[index:]
+        return data
+
 class Database(Session):
     class Cursor(object):
         class Iterator(object):
@@ -99,6 +145,16 @@ class Database(Session):
                 after = time.time()
                 self.__db.recordProfiling(query, after - before, repetitions=len(params))
 
+        @property
+        def rowcount(self):
+            return self.__cursor.rowcount
+
+        def copy_from(self, file, table, columns):
+            before = time.time()
+            self.__cursor.copy_from(file, table, columns=columns)
+            after = time.time()
+            self.__db.recordProfiling("COPY " + table, after - before, rows=self.__cursor.rowcount)
+
     def __init__(self):
         super(Database, self).__init__()
         self.__connection = dbaccess.connect()
@@ -106,18 +162,53 @@ class Database(Session):
     def cursor(self):
         return Database.Cursor(self, self.__connection.cursor(), self.profiling)
 
+    def bulkInsert(self, table, columns, rows):
+        """Insert rows into a table using a single COPY ... FROM STDIN.
+
+           'columns' is a sequence of column names and 'rows' a sequence (or
+           iterator) of tuples of values, where None means NULL.  Unlike when
+           using executemany(), this is one statement regardless of the number
+           of rows."""
+
+        self.cursor().copy_from(CopyStream(rows), table, columns=columns)
+
+    def bulkMerge(self, columns, rows, query, params=None):
+        """Merge rows into one or more tables via a temporary table.
+
+           The rows are copied (using COPY ... FROM STDIN) into a temporary
+           table named 'bulkrows', with the columns 'columns', a sequence of
+           (name, type) tuples.  Then 'query' is executed; it's expected to
+           insert or update rows in the target table(s) from 'bulkrows', for
+           instance mapping SHA-1s to ids, or skipping rows that already
+           exist.  Finally, the temporary table is dropped.  Returns the
+           number of rows affected by 'query'."""
+
+        cursor = self.cursor()
+        cursor.execute("CREATE TEMPORARY TABLE bulkrows (%s)" % ", ".join("%s %s" % column for column in columns))
+        cursor.copy_from(CopyStream(rows), "bulkrows", columns=[name for name, column_type in columns])
+        cursor.execute(query, params)
+        rowcount = cursor.rowcount
+        cursor.execute("DROP TABLE bulkrows")
+        return rowcount
+
     def commit(self):
         before = time.time()
         self.__connection.commit()
         after = time.time()
         self.recordProfiling("<commit>", after - before, 0)
+        getCommitGraph().transactionEnded(self, True)
 
     def rollback(self):
         before = time.time()
         self.__connection.rollback()
         after = time.time()
         self.recordProfiling("<rollback>", after - before, 0)
+        if getCommitGraph().transactionEnded(self, False, verify=True):
+            # End the transaction started by the commit graph's query.
+            self.__connection.rollback()
 
     def close(self):
         super(Database, self).close()
         self.__connection.close()
+        # Closing rolls back any uncommitted changes.
+        getCommitGraph().transactionEnded(self, False)
@@ -0,0 +1,165 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""Storage of the sets of commits that belong to branches.
+
+   The set of commits of a branch is stored in the 'reachableranges' table as
+   runs of consecutive commit ids; a row (branch, first_commit, last_commit)
+   means that every commit whose id is in the (inclusive) range belongs to the
+   branch.  Commits added to the database by the same push get consecutive
+   ids, so a branch typically needs a handful of rows rather than one per
+   commit.
+
+   The sets of commits review branches contained before being rebased are
+   stored the same way, in the 'previousreachableranges' table.
+
+   In SQL queries, commits are joined with the ranges using
+
+     JOIN reachableranges ON (commits.id BETWEEN reachableranges.first_commit
+                                             AND reachableranges.last_commit)
+
+   All modifications of the sets should go through the functions in this
+   module."""
+
+def toRanges(commit_ids):
+    """Convert commit ids to a sorted list of (first, last) tuples."""
+
+    ranges = []
+
+    for commit_id in sorted(set(commit_ids)):
+        if ranges and ranges[-1][1] == commit_id - 1:
+            ranges[-1][1] = commit_id
+        else:
+            ranges.append([commit_id, commit_id])
+
+    return [(first, last) for first, last in ranges]
+
+def fromRanges(ranges):
+    """Convert a list of (first, last) tuples to a list of commit ids."""
+
+    commit_ids = []
+    for first, last in ranges:
+        commit_ids.extend(xrange(first, last + 1))
+    return commit_ids
+
+def getCommitIdsFromSHA1s(db, sha1s):
+    cursor = db.cursor()
+    cursor.execute("SELECT id FROM commits WHERE sha1=ANY (%s)", (list(sha1s),))
+    return [commit_id for (commit_id,) in cursor]
+
+def getRanges(db, branch_id):
+    cursor = db.cursor()
+    cursor.execute("""SELECT first_commit, last_commit
+                        FROM reachableranges
+                       WHERE branch=%s
+                    ORDER BY first_commit""",
+                   (branch_id,))
+    return cursor.fetchall()
+
+def getCommitIds(db, branch_id):
+    return fromRanges(getRanges(db, branch_id))
+
+def countCommits(db, branch_id):
+    cursor = db.cursor()
+    cursor.execute("""SELECT SUM(last_commit - first_commit + 1)
+                        FROM reachableranges
+                       WHERE branch=%s""",
+                   (branch_id,))
+    return cursor.fetchone()[0] or 0
+
+def containsCommit(db, branch_id, commit_id):
+    cursor = db.cursor()
+    cursor.execute("""SELECT 1
+                        FROM reachableranges
+                       WHERE branch=%s
+                         AND %s BETWEEN first_commit AND last_commit""",
+                   (branch_id, commit_id))
+    return cursor.fetchone() is not None
+
+def __writeRanges(db, branch_id, ranges):
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM reachableranges WHERE branch=%s", (branch_id,))
+    db.bulkInsert("reachableranges", ("branch", "first_commit", "last_commit"),
+                  [(branch_id, first, last) for first, last in ranges])
+
+def __lockBranch(db, branch_id):
+    # Serialize read-modify-write updates of a branch's ranges.
+    db.cursor().execute("SELECT 1 FROM branches WHERE id=%s FOR UPDATE", (branch_id,))
+
+def setCommits(db, branch_id, commit_ids):
+    """Replace the set of commits of a branch."""
+
+    __writeRanges(db, branch_id, toRanges(commit_ids))
+
+def addCommits(db, branch_id, commit_ids):
+    """Add commits to the set of commits of a branch."""
+
+    commit_ids = list(commit_ids)
+    if not commit_ids: return
+
+    __lockBranch(db, branch_id)
+
+    existing = getRanges(db, branch_id)
+    ranges = toRanges(commit_ids)
+
+    # Merge the new ranges with the existing ranges; both are sorted.
+    merged = []
+    for first, last in sorted(existing + ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+
+    if len(merged) != len(existing) or any(tuple(new) != tuple(old) for new, old in zip(merged, existing)):
+        __writeRanges(db, branch_id, merged)
+
+def removeCommits(db, branch_id, commit_ids):
+    """Remove commits from the set of commits of a branch."""
+
+    commit_ids = set(commit_ids)
+    if not commit_ids: return
+
+    __lockBranch(db, branch_id)
+
+    remaining = [commit_id for commit_id in getCommitIds(db, branch_id) if commit_id not in commit_ids]
+    __writeRanges(db, branch_id, toRanges(remaining))
+
+def savePrevious(db, rebase_id, branch_id):
+    """Record the current set of commits of a branch as the set of commits it
+       had before the rebase 'rebase_id'."""
+
+    db.cursor().execute("""INSERT INTO previousreachableranges (rebase, first_commit, last_commit)
+                                SELECT %s, first_commit, last_commit
+                                  FROM reachableranges
+                                 WHERE branch=%s""",
+                        (rebase_id, branch_id))
+
+def restorePrevious(db, rebase_id, branch_id):
+    """Restore the set of commits of a branch to what it was before the rebase
+       'rebase_id'.  Returns False (and does nothing) if no set was recorded."""
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT first_commit, last_commit
+                        FROM previousreachableranges
+                       WHERE rebase=%s""",
+                   (rebase_id,))
+    ranges = cursor.fetchall()
+
+    if not ranges:
+        return False
+
+    __writeRanges(db, branch_id, ranges)
+    return True
@@ -31,6 +31,23 @@ class Session(object):
             try: fn(self)
             except: pass
 
+    def clearStorage(self):
+        """Drop cached users, commits and git objects, but keep repositories
+           (and thereby their git processes.)  Used by processes that handle
+           many unrelated requests using the same session."""
+
+        repositories = self.storage["Repository"]
+        for key in repositories.keys():
+            if isinstance(key, str) and key.startswith("object:"):
+                del repositories[key]
+
+        for name in self.storage:
+            if name != "Repository":
+                self.storage[name] = {}
+
+        if self.profiling is not None:
+            self.profiling = {}
+
     def disableProfiling(self):
         self.profiling = None
 
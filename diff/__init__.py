@@ -70,20 +70,32 @@ class Chunk:
     def isBinary(self):
         return self.delete_count == self.insert_count == 0
 
-    def analyze(self, file, last_chunk=False, reanalyze=False):
-        if (reanalyze or not self.analysis) and self.delete_count != 0 and self.insert_count != 0:
-            if not self.deleted_lines:
-                file.loadOldLines()
-                self.deleted_lines = file.getOldLines(self)
+    def needsAnalysis(self, reanalyze=False):
+        return (reanalyze or not self.analysis) and self.delete_count != 0 and self.insert_count != 0
 
-            if not self.inserted_lines:
-                file.loadNewLines()
-                self.inserted_lines = file.getNewLines(self)
+    def getAnalysisArguments(self, file, last_chunk=False):
+        """Return the arguments to pass to diff.analyze.analyzeLines() to analyze
+           this chunk.  Unlike analyze() itself, the analysis then doesn't need
+           access to the file or the repository."""
 
-            if self.is_whitespace:
-                self.analysis = diff.analyze.analyzeWhiteSpaceChanges(self.deleted_lines, self.inserted_lines, last_chunk and self.delete_offset + self.delete_count + file.oldCount())
-            else:
-                self.analysis = diff.analyze.analyzeChunk(self.deleted_lines, self.inserted_lines)
+        if not self.deleted_lines:
+            file.loadOldLines()
+            self.deleted_lines = file.getOldLines(self)
+
+        if not self.inserted_lines:
+            file.loadNewLines()
+            self.inserted_lines = file.getNewLines(self)
+
+        if self.is_whitespace:
+            at_eof = last_chunk and self.delete_offset + self.delete_count + file.oldCount()
+        else:
+            at_eof = False
+
+        return self.deleted_lines, self.inserted_lines, self.is_whitespace, at_eof
+
+    def analyze(self, file, last_chunk=False, reanalyze=False):
+        if self.needsAnalysis(reanalyze):
+            self.analysis = diff.analyze.analyzeLines(*self.getAnalysisArguments(file, last_chunk))
 
     def deleteEnd(self):
         return self.delete_offset + self.delete_count
@@ -281,10 +293,22 @@ class File:
     def wasRemoved(self):
         return self.new_sha1 == '0' * 40
 
-    def loadOldLines(self, highlighted=False, request_highlight=False):
+    def getHighlightBase(self):
+        """Return the old version of the file and the chunks, in the form
+           syntaxhighlight.request.requestHighlights() expects, or None."""
+
+        if self.chunks and self.old_sha1 and self.old_sha1 != '0' * 40:
+            return (self.old_sha1, [(chunk.delete_offset, chunk.delete_count, chunk.insert_offset, chunk.insert_count)
+                                    for chunk in self.chunks])
+        else:
+            return None
+
+    def loadOldLines(self, highlighted=False, request_highlight=False, windows=None):
         from diff.parse import splitlines
 
-        """Load the lines of the old version of the file, optionally highlighted."""
+        """Load the lines of the old version of the file, optionally highlighted.
+           If 'windows' is given, only the lines in them are required to be
+           highlighted (see syntaxhighlight.readHighlight().)"""
         if self.old_sha1 is None or self.old_sha1 == '0' * 40:
             self.old_plain = []
             self.old_highlighted = []
@@ -298,7 +322,7 @@ class File:
                 self.old_is_highlighted = True
                 language = self.getLanguage(use_content="old")
                 if language:
-                    data = syntaxhighlight.readHighlight(self.repository, self.old_sha1, self.path, language, request=request_highlight)
+                    data = syntaxhighlight.readHighlight(self.repository, self.old_sha1, self.path, language, request=request_highlight, windows=windows)
                 elif self.old_highlighted: return
                 else:
                     data = htmlutils.htmlify(self.repository.fetch(self.old_sha1).data)
@@ -311,10 +335,12 @@ class File:
                 self.old_plain = splitlines(data)
                 self.old_eof_eol = data and data[-1] in "\n\r"
 
-    def loadNewLines(self, highlighted=False, request_highlight=False):
+    def loadNewLines(self, highlighted=False, request_highlight=False, windows=None):
         from diff.parse import splitlines
 
-        """Load the lines of the new version of the file, optionally highlighted."""
+        """Load the lines of the new version of the file, optionally highlighted.
+           If 'windows' is given, only the lines in them are required to be
+           highlighted (see syntaxhighlight.readHighlight().)"""
         if self.new_sha1 is None or self.new_sha1 == '0' * 40:
             self.new_plain = []
             self.new_highlighted = []
@@ -328,7 +354,7 @@ class File:
                 self.new_is_highlighted = True
                 language = self.getLanguage(use_content="new")
                 if language:
-                    data = syntaxhighlight.readHighlight(self.repository, self.new_sha1, self.path, language, request=request_highlight)
+                    data = syntaxhighlight.readHighlight(self.repository, self.new_sha1, self.path, language, request=request_highlight, windows=windows, base=self.getHighlightBase())
                 elif self.new_highlighted: return
                 else:
                     data = htmlutils.htmlify(self.repository.fetch(self.new_sha1).data)
@@ -16,6 +16,20 @@
 
 import difflib
 import re
+import bisect
+
+# Version of the analysis algorithm.  Increase whenever the analysis of some
+# chunk changes, since analyses are memoized by this version (see diff.cache.)
+ANALYZER_VERSION = 1
+
+# Chunks with more (deleted line, inserted line) pairs than this are not
+# analyzed line by line, except for the parts between lines that are equal.
+MAXIMUM_CHUNK1_PAIRS = 160000
+
+# Maximum number of pairs of lines analyzeChunk1() compares in detail.  Most
+# pairs are ruled out cheaply, but if lines have mostly common words in common,
+# they can't be.  (Chunks with at most this many pairs are always analyzed.)
+MAXIMUM_CHUNK1_COMPARISONS = 10000
 
 re_ignore = re.compile("^\\s*(?:[{}*]|else|do|\\*/)?\\s*$")
 re_words = re.compile("([0-9]+|[A-Z][a-z]+|[A-Z]+|[a-z]+|[\\[\\]{}()]|\\s+|.)")
@@ -26,10 +40,14 @@ def analyzeChunk(deletedLines, insertedLines, moved=False):
     # Pure delete or pure insert, nothing to analyze.
     if not deletedLines or not insertedLines: return None
 
+    analysis = None
+
     # Large chunk, analysis would be expensive, so skip it.
-    if len(deletedLines) * len(insertedLines) <= 10000 and not moved:
+    if len(deletedLines) * len(insertedLines) <= MAXIMUM_CHUNK1_PAIRS and not moved:
+        # Returns None if it turned out to be too expensive after all.
         analysis = analyzeChunk1(deletedLines, insertedLines)
-    else:
+
+    if analysis is None:
         deletedLinesNoWS = [re_ws.sub(" ", line.strip()) for line in deletedLines]
         insertedLinesNoWS = [re_ws.sub(" ", line.strip()) for line in insertedLines]
 
@@ -63,20 +81,82 @@ def analyzeChunk(deletedLines, insertedLines, moved=False):
     if analysis: return analysis
     else: return None
 
+def ratio(sm, a, b, aLength, bLength):
+    matching = 0
+    for i, j, n in sm.get_matching_blocks():
+        matching += sum(map(len, map(str.strip, a[i:i+n])))
+    if aLength > 5 and len(sm.get_matching_blocks()) == 2:
+        return float(matching) / aLength
+    else:
+        return 2.0 * matching / (aLength + bLength)
+
+def countWords(words):
+    # Non-white-space words and their number of occurrences; white-space words
+    # don't count towards ratio().
+    counts = {}
+    for word in words:
+        if not word.isspace():
+            counts[word] = counts.get(word, 0) + 1
+    return counts
+
+def commonLength(countsA, countsB):
+    # An upper bound of the 'matching' value calculated by ratio(), since any
+    # words matched by the SequenceMatcher occur in both lines.
+    if len(countsA) > len(countsB): countsA, countsB = countsB, countsA
+    return sum(min(count, countsB.get(word, 0)) * len(word) for word, count in countsA.items())
+
 def analyzeChunk1(deletedLines, insertedLines, offsetA=0, offsetB=0):
+    """Match up similar deleted and inserted lines.
+
+       Every pair of lines whose ratio() is above 0.5 is a candidate, and
+       candidates are then picked greedily by ratio.  Running a SequenceMatcher
+       on every pair of lines is too slow for larger chunks, so pairs that
+       can't reach a ratio above 0.5 are ruled out first:
+
+       ratio() is at most max(common / aLength, 2 * common / (aLength +
+       bLength)), where 'common' is the total length of the words the lines
+       have in common, so for a pair to qualify, 'common' must be more than a
+       fourth of the deleted line's length.  The inserted lines are indexed by
+       word, and each deleted line is only compared to the inserted lines that
+       contain one of its rarest words (its "prefix"), chosen such that the
+       rest of its words are at most a fourth of its length.  Other inserted
+       lines can't have enough words in common with it.
+
+       This rules out no qualifying pair, so the result is the same as when
+       comparing all pairs.  If more than MAXIMUM_CHUNK1_COMPARISONS pairs
+       remain to be compared anyway, None is returned."""
+
     matches = []
     equals = []
 
-    if len(deletedLines) * len(insertedLines) > 10000: return ""
-
-    def ratio(sm, a, b, aLength, bLength):
-        matching = 0
-        for i, j, n in sm.get_matching_blocks():
-            matching += sum(map(len, map(str.strip, a[i:i+n])))
-        if aLength > 5 and len(sm.get_matching_blocks()) == 2:
-            return float(matching) / aLength
+    if len(deletedLines) * len(insertedLines) > MAXIMUM_CHUNK1_PAIRS: return ""
+
+    comparisons = 0
+
+    insertedWords = []
+    insertedCounts = []
+    insertedLengths = []
+    insertedByWord = {}
+    insertedByStripped = {}
+    ignoredByStripped = {}
+
+    for insertedIndex, inserted in enumerate(insertedLines):
+        insertedStripped = inserted.strip()
+        insertedByStripped.setdefault(insertedStripped, []).append(insertedIndex)
+
+        if not re_ignore.match(inserted):
+            words = re_words.findall(inserted)
+            counts = countWords(words)
+            for word in counts:
+                insertedByWord.setdefault(word, []).append(insertedIndex)
+            insertedWords.append(words)
+            insertedCounts.append(counts)
+            insertedLengths.append(len(re_ws.sub("", insertedStripped)))
         else:
-            return 2.0 * matching / (aLength + bLength)
+            ignoredByStripped.setdefault(insertedStripped, []).append(insertedIndex)
+            insertedWords.append(None)
+            insertedCounts.append(None)
+            insertedLengths.append(None)
 
     for deletedIndex, deleted in enumerate(deletedLines):
         deletedStripped = deleted.strip()
@@ -87,33 +167,71 @@ def analyzeChunk1(deletedLines, insertedLines, offsetA=0, offsetB=0):
 
         if not re_ignore.match(deleted):
             deletedWords = re_words.findall(deleted)
+            deletedCounts = countWords(deletedWords)
+            deletedLength = len(deletedNoWS)
+
+            # Rarest words first.
+            words = sorted(deletedCounts, key=lambda word: (len(insertedByWord.get(word, ())), word))
+            remaining = deletedLength
+            candidates = set()
 
-            for insertedIndex, inserted in enumerate(insertedLines):
-                insertedStripped = inserted.strip()
-                insertedNoWS = re_ws.sub("", insertedStripped)
-
-                if not re_ignore.match(inserted):
-                    insertedWords = re_words.findall(inserted)
-                    sm = difflib.SequenceMatcher(None, deletedWords, insertedWords)
-                    r = ratio(sm, deletedWords, insertedWords, len(deletedNoWS), len(insertedNoWS))
-                    if r > 0.5: matches.append((r, deletedIndex, insertedIndex, deletedWords, insertedWords, sm))
-                elif deletedStripped == insertedStripped:
-                    equals.append((deletedIndex, insertedIndex))
+            for word in words:
+                if remaining * 4 <= deletedLength: break
+                candidates.update(insertedByWord.get(word, ()))
+                remaining -= deletedCounts[word] * len(word)
+
+            for insertedIndex in sorted(candidates):
+                insertedLength = insertedLengths[insertedIndex]
+                common = commonLength(deletedCounts, insertedCounts[insertedIndex])
+
+                if common * 4 <= deletedLength + insertedLength and not (deletedLength > 5 and common * 2 > deletedLength):
+                    continue
+
+                comparisons += 1
+                if comparisons > MAXIMUM_CHUNK1_COMPARISONS: return None
+
+                sm = difflib.SequenceMatcher(None, deletedWords, insertedWords[insertedIndex])
+                r = ratio(sm, deletedWords, insertedWords[insertedIndex], deletedLength, insertedLength)
+                if r > 0.5: matches.append((r, deletedIndex, insertedIndex, deletedWords, insertedWords[insertedIndex], sm))
+
+            for insertedIndex in ignoredByStripped.get(deletedStripped, ()):
+                equals.append((deletedIndex, insertedIndex))
         else:
-            for insertedIndex, inserted in enumerate(insertedLines):
-                if deletedStripped == inserted.strip():
-                    equals.append((deletedIndex, insertedIndex))
+            for insertedIndex in insertedByStripped.get(deletedStripped, ()):
+                equals.append((deletedIndex, insertedIndex))
 
     if matches:
+        # Pick matches by descending ratio (and in order of appearance among
+        # matches with equal ratio), skipping those that involve an already
+        # matched line or would cross an already picked match.
         matches.sort(key=lambda x: x[0], reverse=True)
 
         final = []
+        pickedDeleted = []
+        pickedInserted = []
+        pickedInsertedSet = set()
+
+        def isConsistent(deletedIndex, insertedIndex):
+            # True if (deletedIndex < D) == (insertedIndex < I) for every
+            # picked match (D, I).  Picked matches are sorted both by D and by
+            # I, since they don't cross.
+            index = bisect.bisect_right(pickedDeleted, deletedIndex)
+            if index < len(pickedInserted) and not insertedIndex < pickedInserted[index]: return False
+            if index > 0 and insertedIndex < pickedInserted[index - 1]: return False
+            return True
+
+        for r, deletedIndex, insertedIndex, deletedWords, insertedWords, sm in matches:
+            index = bisect.bisect_left(pickedDeleted, deletedIndex)
+            if index < len(pickedDeleted) and pickedDeleted[index] == deletedIndex: continue
+            if insertedIndex in pickedInsertedSet: continue
+            if not isConsistent(deletedIndex, insertedIndex): continue
 
-        while matches:
-            r, deletedIndex, insertedIndex, deletedWords, insertedWords, sm = matches.pop(0)
             final.append((deletedIndex, insertedIndex, deletedWords, insertedWords, sm))
-            matches = filter(lambda data: data[1] != deletedIndex and data[2] != insertedIndex and (data[1] < deletedIndex) == (data[2] < insertedIndex), matches)
-            equals = filter(lambda data: (data[0] < deletedIndex) == (data[1] < insertedIndex), equals)
+            pickedDeleted.insert(index, deletedIndex)
+            pickedInserted.insert(index, insertedIndex)
+            pickedInsertedSet.add(insertedIndex)
+
+        equals = [(di, ii) for di, ii in equals if isConsistent(di, ii)]
 
         final.sort()
         equals.sort()
@@ -124,9 +242,12 @@ def analyzeChunk1(deletedLines, insertedLines, offsetA=0, offsetB=0):
 
         final.append((len(deletedLines), len(insertedLines), None, None, None))
 
+        nextEqual = 0
+
         for deletedIndex, insertedIndex, deletedWords, insertedWords, sm in final:
-            while equals and (equals[0][0] < deletedIndex or equals[0][1] < insertedIndex):
-                di, ii = equals.pop(0)
+            while nextEqual < len(equals) and (equals[nextEqual][0] < deletedIndex or equals[nextEqual][1] < insertedIndex):
+                di, ii = equals[nextEqual]
+                nextEqual += 1
                 if previousDeletedIndex < di < deletedIndex and previousInsertedIndex < ii < insertedIndex:
                     deletedLine = deletedLines[di]
                     insertedLine = insertedLines[ii]
@@ -135,7 +256,7 @@ def analyzeChunk1(deletedLines, insertedLines, offsetA=0, offsetB=0):
                     else: result.append("%d=%d" % (di + offsetA, ii + offsetB))
                     previousDeletedIndex = di
                     previousInsertedIndex = ii
-                while equals and (di == equals[0][0] or ii == equals[0][1]): equals.pop(0)
+                while nextEqual < len(equals) and (di == equals[nextEqual][0] or ii == equals[nextEqual][1]): nextEqual += 1
 
             if sm is None: break
 
@@ -203,3 +324,11 @@ def analyzeWhiteSpaceChanges(deletedLines, insertedLines, at_eof=False, offsetA=
         result.append("%d=%d" % (offsetA, offsetB))
 
     return ";".join(result)
+
+def analyzeLines(deletedLines, insertedLines, is_whitespace, at_eof):
+    """Analyze a chunk given the arguments returned by Chunk.getAnalysisArguments()."""
+
+    if is_whitespace:
+        return analyzeWhiteSpaceChanges(deletedLines, insertedLines, at_eof)
+    else:
+        return analyzeChunk(deletedLines, insertedLines)
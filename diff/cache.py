@@ -0,0 +1,155 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""Cache of the differences between pairs of blobs.
+
+   The chunks of a modified file, and their analysis, depend only on the old
+   and new versions of the file, and on the options used when running 'git
+   diff', which are the same for all changesets.  So chunks already stored
+   for a file in one changeset can be reused for any other changeset, or thin
+   diff, that changes some file from the same old blob to the same new blob.
+
+   The 'fileversions' and 'chunks' tables thus serve as the cache, keyed by
+   (old_sha1, new_sha1).  Merge changesets are excluded, since their chunks
+   are filtered (see diff.merge.)  Changesets created with the 'simple'
+   option of diff.parse.parseDifferences() are never stored, and never use
+   the cache.
+
+   Identical chunks also occur in different files, and in files whose other
+   chunks differ (after rebases, cherry-picks and merges.)  So the analysis
+   of each chunk is additionally memoized in the 'chunkanalyses' table, keyed
+   by a digest of the arguments to diff.analyze.analyzeLines() and the
+   analyzer's version, diff.analyze.ANALYZER_VERSION."""
+
+import hashlib
+
+import dbutils
+import diff.analyze
+
+# Chunks with fewer (deleted line, inserted line) pairs than this are cheap to
+# analyze, and not worth memoizing.
+MINIMUM_MEMOIZED_PAIRS = 25
+
+def lookup(db, pairs):
+    """Return a dictionary mapping those (old_sha1, new_sha1) tuples in 'pairs'
+       whose differences are cached to lists of (delete_offset, delete_count,
+       insert_offset, insert_count, analysis, is_whitespace) tuples."""
+
+    pairs = set(pairs)
+
+    if not pairs:
+        return {}
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT DISTINCT ON (fileversions.old_sha1, fileversions.new_sha1)
+                             fileversions.old_sha1, fileversions.new_sha1, fileversions.changeset, fileversions.file
+                        FROM fileversions
+                        JOIN changesets ON (changesets.id=fileversions.changeset)
+                       WHERE fileversions.new_sha1=ANY (%s)
+                         AND fileversions.old_sha1=ANY (%s)
+                         AND changesets.type!='merge'""",
+                   (list(set(new_sha1 for old_sha1, new_sha1 in pairs)),
+                    list(set(old_sha1 for old_sha1, new_sha1 in pairs))))
+
+    sources = {}
+
+    for old_sha1, new_sha1, changeset_id, file_id in cursor:
+        if (old_sha1, new_sha1) in pairs:
+            sources[changeset_id, file_id] = (old_sha1, new_sha1)
+
+    if not sources:
+        return {}
+
+    cursor.execute("""SELECT changeset, file, deleteOffset, deleteCount, insertOffset, insertCount, analysis, whitespace
+                        FROM chunks
+                       WHERE changeset=ANY (%s)
+                         AND file=ANY (%s)
+                    ORDER BY deleteOffset ASC""",
+                   (list(set(changeset_id for changeset_id, file_id in sources)),
+                    list(set(file_id for changeset_id, file_id in sources))))
+
+    cached = dict((pair, []) for pair in sources.values())
+
+    for changeset_id, file_id, delete_offset, delete_count, insert_offset, insert_count, analysis, is_whitespace in cursor:
+        pair = sources.get((changeset_id, file_id))
+        if pair:
+            cached[pair].append((delete_offset, delete_count, insert_offset, insert_count, analysis, bool(is_whitespace)))
+
+    return cached
+
+def isMemoizable(arguments):
+    deleted_lines, inserted_lines, is_whitespace, at_eof = arguments
+    return len(deleted_lines) * len(inserted_lines) >= MINIMUM_MEMOIZED_PAIRS
+
+def getAnalysisDigest(arguments):
+    """Return the key under which the analysis of a chunk is memoized, given
+       the arguments returned by diff.Chunk.getAnalysisArguments()."""
+
+    deleted_lines, inserted_lines, is_whitespace, at_eof = arguments
+
+    digest = hashlib.sha1("%d %d %d %d\n" % (diff.analyze.ANALYZER_VERSION, bool(is_whitespace), bool(at_eof), len(deleted_lines)))
+
+    for line in deleted_lines:
+        digest.update(line)
+        digest.update("\n")
+    for line in inserted_lines:
+        digest.update(line)
+        digest.update("\n")
+
+    return digest.hexdigest()
+
+def lookupAnalyses(db, digests):
+    """Return a dictionary mapping those digests in 'digests' that have a
+       memoized analysis to it.  (The analysis may be None.)"""
+
+    if not digests:
+        return {}
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT digest, analysis
+                        FROM chunkanalyses
+                       WHERE digest=ANY (%s)
+                         AND version=%s""",
+                   (list(set(digests)), diff.analyze.ANALYZER_VERSION))
+
+    return dict(cursor)
+
+def storeAnalyses(db, analyses):
+    """Memoize analyses, a list of (digest, analysis) tuples.  Doesn't commit.
+       Concurrently storing the same analysis can fail with an integrity error;
+       then nothing is stored, but the rest of the transaction is unaffected."""
+
+    if not analyses:
+        return
+
+    cursor = db.cursor()
+    cursor.execute("SAVEPOINT storeanalyses")
+
+    try:
+        db.bulkMerge([("digest", "CHAR(40)"), ("analysis", "TEXT")],
+                     analyses,
+                     """INSERT INTO chunkanalyses (digest, version, analysis)
+                             SELECT DISTINCT ON (digest) digest, %s, analysis
+                               FROM bulkrows
+                              WHERE NOT EXISTS (SELECT 1
+                                                  FROM chunkanalyses
+                                                 WHERE chunkanalyses.digest=bulkrows.digest)""",
+                     (diff.analyze.ANALYZER_VERSION,))
+    except dbutils.IntegrityError:
+        # Losing the memoized analyses is harmless.
+        cursor.execute("ROLLBACK TO SAVEPOINT storeanalyses")
+    else:
+        cursor.execute("RELEASE SAVEPOINT storeanalyses")
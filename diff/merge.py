@@ -15,6 +15,7 @@
 # the License.
 
 import diff
+import diff.cache
 import diff.parse
 import gitutils
 import bisect
@@ -73,7 +74,7 @@ def parseMergeDifferences(db, repository, commit):
         parent = gitutils.Commit.fromSHA1(db, repository, parent_sha1)
 
         if parent_sha1 == mergebase:
-            result[parent_sha1] = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=commit)[parent_sha1]
+            result[parent_sha1] = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=commit, lookup=lambda pairs: diff.cache.lookup(db, pairs))[parent_sha1]
         else:
             paths_on_branch = set(repository.run('diff', '--name-only', "%s..%s" % (mergebase, parent)).splitlines())
             paths_in_merge = set(repository.run('diff', '--name-only', "%s..%s" % (parent, commit)).splitlines())
@@ -22,6 +22,10 @@ import re
 import itertools
 import analyze
 
+# Maximum number of paths to pass to 'git diff' when only some of the modified
+# files' differences need to be produced.
+MAXIMUM_PATHSPEC_LENGTH = 1024
+
 def splitlines(source):
     if not source: return source
     elif source[-1] == "\n": return source[:-1].split("\n")
@@ -150,10 +154,22 @@ def mergeChunks(file):
         file.clean()
         file.chunks = merged
 
-def parseDifferences(repository, commit=None, from_commit=None, to_commit=None, filter_paths=None, selected_path=None, simple=False):
+def parseDifferences(repository, commit=None, from_commit=None, to_commit=None, filter_paths=None, selected_path=None, simple=False, stream=False, lookup=None):
     """parseDifferences(repository, [commit] | [from_commit, to_commit][, selected_path]) =>
          dict(parent_sha1 => [diff.File, ...] (if selected_path is None)
-         diff.File                            (if selected_path is not None)"""
+         diff.File                            (if selected_path is not None)
+
+       If 'stream' is true, the list of files is instead a generator that
+       parses git's output as it is iterated, so that only the file currently
+       being processed needs to be kept in memory.
+
+       If 'lookup' is not None, it is called with a set of (old_sha1, new_sha1)
+       tuples of modified files, and should return a dictionary mapping those
+       of them whose differences are already known to lists of (delete_offset,
+       delete_count, insert_offset, insert_count, analysis, is_whitespace)
+       tuples.  Those files are then not diffed again (see diff.cache.)  Files
+       whose differences are all white-space are then included even if
+       'filter_paths' is used."""
 
     options = []
 
@@ -173,45 +189,154 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
         command = 'diff'
         what = commit.parents[0] + '..' + commit.sha1
 
-    if filter_paths is None and selected_path is None and not simple:
-        names = repository.run(command, *(options + ["--name-only", what]))
-        paths = set(filter(None, map(str.strip, names.splitlines())))
-    else:
-        paths = set()
-
     if not simple:
         options.append('--ignore-space-change')
 
     options.append(what)
 
     if filter_paths is not None:
-        options.append('--')
-        options.extend(filter_paths)
+        pathspec = list(filter_paths)
     elif selected_path is not None:
-        options.append('--')
-        options.append(selected_path)
+        pathspec = [selected_path]
+    else:
+        pathspec = None
+
+    def runDiff(extra_options, pathspec):
+        arguments = ['--full-index', '--unified=1', '--patience'] + extra_options + options
+        if pathspec is not None:
+            arguments += ['--'] + pathspec
+        # Read git's output as it is produced, so that the whole diff is never
+        # in memory at once.
+        return repository.runLines(command, *arguments)
+
+    # With '--ignore-space-change', git outputs nothing at all for files whose
+    # differences are all white-space.  To find those, have git list all
+    # modified files first ('--raw' output precedes the patches.)
+    list_paths = filter_paths is None and selected_path is None and not simple
+
+    cached = {}
+
+    if lookup is not None and selected_path is None and not simple:
+        # List the modified files separately, and look up the differences in
+        # each (old blob, new blob) pair; git then only needs to produce the
+        # differences in files that aren't cached.
+        paths, renames = parseRawList(runDiff(['--raw', '--no-abbrev'], pathspec))
+        pairs = set((old_sha1, new_sha1) for old_mode, new_mode, old_sha1, new_sha1 in paths.values()
+                    if isCacheable(old_mode, new_mode, old_sha1, new_sha1))
+
+        if pairs:
+            cached_chunks = lookup(pairs)
+
+            for path, (old_mode, new_mode, old_sha1, new_sha1) in paths.items():
+                if (old_sha1, new_sha1) in cached_chunks:
+                    cached[path] = (old_mode, new_mode, old_sha1, new_sha1, cached_chunks[old_sha1, new_sha1])
+
+        uncached = sorted(set(paths) - set(cached))
+
+        if not cached:
+            lines = runDiff([], pathspec)
+        elif not uncached:
+            lines = iter([])
+        elif renames or len(uncached) > MAXIMUM_PATHSPEC_LENGTH:
+            # Limiting the diff to the remaining paths could change how git
+            # detects renames, and a very long list of paths isn't practical,
+            # so just have git produce all differences.  Cached files are
+            # skipped after being parsed instead.
+            lines = runDiff([], pathspec)
+        else:
+            lines = runDiff([], uncached)
 
-    stdout = repository.run(command, '--full-index', '--unified=1', '--patience', *options)
-    selected_file = None
+        # Since all modified files were listed, files whose differences are
+        # all white-space are found even if 'filter_paths' is used.  (Whether
+        # such a file is included must not depend on whether it was cached.)
+        paths = dict((path, paths[path]) for path in uncached)
+    else:
+        if list_paths:
+            lines = runDiff(['--raw', '--no-abbrev', '-p'], pathspec)
+            paths, renames = parseRawList(lines)
+        else:
+            lines = runDiff([], pathspec)
+            paths = {}
 
-    re_chunk = re.compile('^@@ -(\\d+)(?:,\\d+)? \\+(\\d+)(?:,\\d+)? @@')
-    re_binary = re.compile('^Binary files (?:a/(.+)|/dev/null) and (?:b/(.+)|/dev/null) differ')
-    re_diff = re.compile("^diff --git a/(.*) b/(.*)$")
+    files = parseFiles(repository, lines, paths, simple)
 
-    def isplitlines(text):
-        start = 0
-        length = len(text)
+    if cached:
+        files = includeCached(repository, files, cached)
 
-        while start < length:
-            try:
-                end = text.index('\n', start)
-                yield text[start:end]
-                start = end + 1
-            except ValueError:
-                yield text[start:]
-                break
+    if from_commit and to_commit and selected_path is not None:
+        for file in files:
+            if file.path == selected_path:
+                return file
+        return None
 
-    lines = isplitlines(stdout)
+    if not stream:
+        files = list(files)
+
+    if from_commit and to_commit:
+        return { from_commit.sha1: files }
+    elif not commit.parents:
+        return { None: files }
+    else:
+        return { commit.parents[0]: files }
+
+def parseRawList(lines):
+    """Parse the '--raw' listing of modified files at the beginning of 'lines'
+       and return a tuple (paths, renames), where 'paths' maps each path to a
+       tuple (old_mode, new_mode, old_sha1, new_sha1), and 'renames' is true
+       if git detected any renamed or copied files."""
+
+    paths = {}
+    renames = False
+
+    for line in lines:
+        if line.startswith(":"):
+            # :<old mode> <new mode> <old sha1> <new sha1> <status>\t<path>
+            # (with renames and copies: <status>\t<old path>\t<new path>)
+            info = line[1:].split("\t")
+            old_mode, new_mode, old_sha1, new_sha1, status = info[0].split(" ")
+            if status[0] in "RC":
+                # Doesn't have an old version at its new path.
+                old_sha1 = '0' * 40
+                renames = True
+            paths[info[-1]] = (old_mode, new_mode, old_sha1, new_sha1)
+        elif paths:
+            # An empty line separates the list from the patches.
+            break
+
+    return paths, renames
+
+def isCacheable(old_mode, new_mode, old_sha1, new_sha1):
+    return ('0' * 40 not in (old_sha1, new_sha1) and old_sha1 != new_sha1 and
+            "160000" not in (old_mode, new_mode))
+
+def includeCached(repository, files, cached):
+    """Generate the files in 'files', except those in 'cached', followed by
+       files constructed from the cached differences in 'cached'."""
+
+    for file in files:
+        if file.path not in cached:
+            yield file
+
+    for path in sorted(cached):
+        old_mode, new_mode, old_sha1, new_sha1, chunks = cached[path]
+
+        if old_mode == new_mode:
+            # The parser only records modes that changed.
+            old_mode = new_mode = None
+
+        yield diff.File(None, path, old_sha1, new_sha1, repository,
+                        old_mode=old_mode, new_mode=new_mode,
+                        chunks=[diff.Chunk(delete_offset, delete_count, insert_offset, insert_count,
+                                           analysis=analysis, is_whitespace=is_whitespace)
+                                for delete_offset, delete_count, insert_offset, insert_count, analysis, is_whitespace in chunks])
+
+def parseFiles(repository, lines, paths, simple):
+    """Generate diff.File objects from the output of 'git diff', each one as
+       soon as all of its differences have been parsed."""
+
+    re_chunk = re.compile('^@@ -(\\d+)(?:,\\d+)? \\+(\\d+)(?:,\\d+)? @@')
+    re_binary = re.compile('^Binary files (?:a/(.+)|/dev/null) and (?:b/(.+)|/dev/null) differ')
+    re_diff = re.compile("^diff --git a/(.*) b/(.*)$")
 
     included = set()
     files = []
@@ -223,6 +348,12 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
         files_by_path[new_file.path] = new_file
         included.add(new_file.path)
 
+    def finishFile(file):
+        del files_by_path[file.path]
+        if not simple:
+            mergeChunks(file)
+        return file
+
     old_mode = None
     new_mode = None
 
@@ -232,6 +363,11 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
         names = None
 
         while True:
+            # All differences in one path are output together, so all files
+            # but the last one are complete.
+            while len(files) > 1:
+                yield finishFile(files.pop(0))
+
             old_mode = None
             new_mode = None
 
@@ -265,18 +401,13 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
             except:
                 old_sha1, new_sha1 = line[6:].split(' ', 1)[0].split("..")
 
+            # If the 'index' line is the last line, or is followed directly by
+            # the next file, git output no differences for this file; it was
+            # added or removed empty, or only white-space or its mode changed.
             try: line = lines.next()
-            except:
-                if new_mode is not None:
-                    assert names[0] == names[1]
+            except StopIteration: line = None
 
-                    addFile(diff.File(None, names[0], old_sha1, new_sha1, repository,
-                                      old_mode=old_mode, new_mode=new_mode,
-                                      chunks=[diff.Chunk(0, 0, 0, 0)]))
-
-                    old_mode = new_mode = None
-
-            if re_diff.match(line):
+            if line is None or re_diff.match(line):
                 new_file = diff.File(None, names[0] or names[1], old_sha1, new_sha1, repository, old_mode=old_mode, new_mode=new_mode)
 
                 if '0' * 40 == old_sha1 or '0' * 40 == new_sha1:
@@ -290,9 +421,16 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
                                             new_file.oldLines(False), 1, new_file.oldCount() + 1, True,
                                             new_file.newLines(False), 1, new_file.newCount() + 1, True)
 
+                    # Don't keep the file's contents around while the rest of
+                    # the diff is parsed; mergeChunks() reloads them if needed.
+                    new_file.old_plain = new_file.new_plain = None
 
                 addFile(new_file)
 
+                if line is None:
+                    old_mode = new_mode = None
+                    break
+
                 old_mode = new_mode = False
 
                 continue
@@ -377,9 +515,6 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
 
                 old_mode = new_mode = None
 
-                if selected_path is not None and selected_path == path:
-                    selected_file = new_file
-
                 if path not in files_by_path: addFile(new_file)
 
                 previous_delete_offset = 1
@@ -465,51 +600,30 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
 
             addFile(diff.File(None, names[0], None, None, repository, old_mode=old_mode, new_mode=new_mode, chunks=[]))
 
-    for path in (paths - included):
-        lines = isplitlines(repository.run(command, '--full-index', '--unified=1', what, '--', path))
-
-        try:
-            line = lines.next()
-
-            while not line.startswith("index "): line = lines.next()
+    while files:
+        yield finishFile(files.pop(0))
 
-            try:
-                sha1range, mode = line[6:].split(' ')
-                if mode == "160000":
-                    continue
-                old_sha1, new_sha1 = sha1range.split("..")
-            except:
-                old_sha1, new_sha1 = line[6:].split(' ', 1)[0].split("..")
+    for path in sorted(set(paths) - included):
+        old_mode, new_mode, old_sha1, new_sha1 = paths[path]
 
-            if old_sha1 == '0' * 40 or new_sha1 == '0' * 40:
-                # Added or removed empty file.
-                continue
+        if old_mode == new_mode == "160000":
+            continue
 
-            addFile(diff.File(None, path, old_sha1, new_sha1, repository, chunks=[]))
+        if old_sha1 == '0' * 40 or new_sha1 == '0' * 40:
+            # Added or removed empty file.
+            continue
 
-            old_data = repository.fetch(old_sha1).data
-            old_lines = splitlines(old_data)
-            new_data = repository.fetch(new_sha1).data
-            new_lines = splitlines(new_data)
+        addFile(diff.File(None, path, old_sha1, new_sha1, repository, chunks=[]))
 
-            assert len(old_lines) == len(new_lines), "%s:%d != %s:%d" % (old_sha1, len(old_lines), new_sha1, len(new_lines))
+        old_data = repository.fetch(old_sha1).data
+        old_lines = splitlines(old_data)
+        new_data = repository.fetch(new_sha1).data
+        new_lines = splitlines(new_data)
 
-            def endsWithLinebreak(data): return data and data[-1] in "\n\r"
+        assert len(old_lines) == len(new_lines), "%s:%d != %s:%d" % (old_sha1, len(old_lines), new_sha1, len(new_lines))
 
-            detectWhiteSpaceChanges(files[-1], old_lines, 1, len(old_lines) + 1, endsWithLinebreak(old_data), new_lines, 1, len(new_lines) + 1, endsWithLinebreak(new_data))
-        except StopIteration:
-            pass
+        def endsWithLinebreak(data): return data and data[-1] in "\n\r"
 
-    if not simple:
-        for file in files:
-            mergeChunks(file)
+        detectWhiteSpaceChanges(files[-1], old_lines, 1, len(old_lines) + 1, endsWithLinebreak(old_data), new_lines, 1, len(new_lines) + 1, endsWithLinebreak(new_data))
 
-    if from_commit and to_commit:
-        if selected_path is not None:
-            return selected_file
-        else:
-            return { from_commit.sha1: files }
-    elif not commit.parents:
-        return { None: files }
-    else:
-        return { commit.parents[0]: files }
+        yield finishFile(files.pop())
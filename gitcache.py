@@ -0,0 +1,289 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""Shared cache of git objects.
+
+   Git objects are immutable and identified by their SHA-1, so they can be
+   cached indefinitely without any need for invalidation, and shared between
+   repositories.  The cache has two levels:
+
+   1) a per-process in-memory LRU cache, which survives between requests in
+      WSGI processes and between jobs in background services, and
+
+   2) an on-disk cache in configuration.paths.OBJECT_CACHE_DIR, shared by all
+      processes on the host.  Each object is stored zlib compressed in a file
+      of its own, named by its SHA-1.  A file's modification time is used as
+      its last access time, and is updated (at most once per hour) when the
+      object is read.
+
+   The on-disk cache is trimmed to its budget by trim(), which the changeset
+   service runs hourly in a child process.  trim() records the cache's size in
+   the file 'usage' in the cache directory; until the next trim, each process
+   stops writing to the cache once that size plus what it has written itself
+   reaches the budget (see DiskUsage.)"""
+
+import os
+import os.path
+import time
+import zlib
+import errno
+import tempfile
+
+from collections import OrderedDict
+
+import configuration
+
+# Don't bother updating a cache file's modification time if it was updated
+# more recently than this.
+TOUCH_INTERVAL = 60 * 60
+
+# How often each process re-reads the size recorded by trim().
+USAGE_CHECK_INTERVAL = 60
+
+class MemoryCache(object):
+    def __init__(self, budget):
+        self.__budget = budget
+        self.__size = 0
+        self.__objects = OrderedDict()
+
+    def get(self, sha1):
+        git_object = self.__objects.pop(sha1, None)
+        if git_object is not None:
+            # Re-insert to mark as most recently used.
+            self.__objects[sha1] = git_object
+        return git_object
+
+    def put(self, git_object):
+        if git_object.sha1 in self.__objects or git_object.size > self.__budget:
+            return
+
+        self.__objects[git_object.sha1] = git_object
+        self.__size += git_object.size
+
+        while self.__size > self.__budget:
+            sha1, evicted = self.__objects.popitem(last=False)
+            self.__size -= evicted.size
+
+    def clear(self):
+        self.__objects.clear()
+        self.__size = 0
+
+memory = MemoryCache(configuration.limits.OBJECT_CACHE_MEMORY_BUDGET)
+
+class DiskUsage(object):
+    """Estimated size of the on-disk cache: the size recorded by the last
+       trim(), plus what this process has written since.  Other processes'
+       writes aren't counted, so the budget can be overshot by at most the
+       room left after a trim times the number of writing processes."""
+
+    def __init__(self, budget):
+        self.__budget = budget
+        self.__recorded = 0
+        self.__recorded_mtime = None
+        self.__written = 0
+        self.__checked = 0
+
+    def __refresh(self):
+        now = time.time()
+        if now - self.__checked < USAGE_CHECK_INTERVAL:
+            return
+        self.__checked = now
+
+        path = generateUsagePath()
+
+        try:
+            mtime = os.stat(path).st_mtime
+            if mtime != self.__recorded_mtime:
+                self.__recorded = int(open(path).read())
+                self.__recorded_mtime = mtime
+                self.__written = 0
+        except (IOError, OSError, ValueError):
+            pass
+
+    def hasRoom(self, size):
+        self.__refresh()
+        return self.__recorded + self.__written + size <= self.__budget
+
+    def add(self, size):
+        self.__written += size
+
+usage = DiskUsage(configuration.limits.OBJECT_CACHE_DISK_BUDGET)
+
+def isEnabled():
+    """Return False if both budgets are zero, in which case get() and put()
+       are pointless."""
+
+    return (configuration.limits.OBJECT_CACHE_MEMORY_BUDGET > 0 or
+            configuration.limits.OBJECT_CACHE_DISK_BUDGET > 0)
+
+def isCacheable(git_object):
+    return (git_object.data is not None and
+            git_object.size <= configuration.limits.OBJECT_CACHE_MAXIMUM_OBJECT_SIZE)
+
+def generateObjectPath(sha1):
+    return os.path.join(configuration.paths.OBJECT_CACHE_DIR, sha1[:2], sha1[2:])
+
+def generateUsagePath():
+    return os.path.join(configuration.paths.OBJECT_CACHE_DIR, "usage")
+
+def __writeAtomically(directory, path, data):
+    # Write to a temporary file and rename it into place, so that concurrent
+    # readers never see partially written files.
+    fd, temporary_path = tempfile.mkstemp(dir=directory)
+    try:
+        os.write(fd, data)
+        os.close(fd)
+        os.chmod(temporary_path, 0660)
+        os.rename(temporary_path, path)
+    except:
+        try: os.unlink(temporary_path)
+        except OSError: pass
+        raise
+
+def __readFromDisk(sha1):
+    from gitutils import GitObject
+
+    path = generateObjectPath(sha1)
+
+    try:
+        with open(path, "rb") as cached:
+            compressed = cached.read()
+            mtime = os.fstat(cached.fileno()).st_mtime
+    except IOError, error:
+        if error.errno == errno.ENOENT: return None
+        else: raise
+
+    try:
+        header, data = zlib.decompress(compressed).split("\n", 1)
+        object_type, object_size = header.split(" ")
+        object_size = int(object_size)
+    except (zlib.error, ValueError):
+        # Truncated or otherwise corrupt file; shouldn't happen since files
+        # are written atomically, but just drop it if it does.
+        try: os.unlink(path)
+        except OSError: pass
+        return None
+
+    if len(data) != object_size:
+        return None
+
+    if time.time() - mtime > TOUCH_INTERVAL:
+        try: os.utime(path, None)
+        except OSError: pass
+
+    return GitObject(sha1, object_type, object_size, data)
+
+def __writeToDisk(git_object):
+    path = generateObjectPath(git_object.sha1)
+
+    if os.path.exists(path):
+        return
+
+    directory = os.path.dirname(path)
+
+    try: os.makedirs(directory)
+    except OSError, error:
+        if error.errno != errno.EEXIST: raise
+
+    data = zlib.compress("%s %d\n%s" % (git_object.type, git_object.size, git_object.data), 1)
+
+    # The cache is full until the next trim().
+    if not usage.hasRoom(len(data)):
+        return
+
+    __writeAtomically(directory, path, data)
+
+    usage.add(len(data))
+
+def get(sha1):
+    """Return a cached GitObject, or None if the object isn't cached."""
+
+    git_object = memory.get(sha1)
+
+    if git_object is None and configuration.limits.OBJECT_CACHE_DISK_BUDGET > 0:
+        git_object = __readFromDisk(sha1)
+
+        if git_object is not None:
+            memory.put(git_object)
+
+    return git_object
+
+def put(git_object):
+    """Add a GitObject to the cache (if it is cacheable.)"""
+
+    if not isCacheable(git_object):
+        return
+
+    memory.put(git_object)
+
+    if configuration.limits.OBJECT_CACHE_DISK_BUDGET > 0:
+        try: __writeToDisk(git_object)
+        except (IOError, OSError):
+            # Failing to cache is not a fatal error.
+            pass
+
+def trim():
+    """Evict least recently used objects from the on-disk cache.
+
+       Objects are evicted until the total size of the cache is below 90 % of
+       the configured budget, and the remaining size is recorded for
+       DiskUsage.  Walks the whole cache, so shouldn't be called by processes
+       that have anything better to do.  Returns a tuple (number of cached
+       objects, number of evicted objects.)"""
+
+    cache_dir = configuration.paths.OBJECT_CACHE_DIR
+    budget = configuration.limits.OBJECT_CACHE_DISK_BUDGET
+
+    if not os.path.isdir(cache_dir):
+        return 0, 0
+
+    files = []
+    total_size = 0
+
+    for section in os.listdir(cache_dir):
+        section_dir = os.path.join(cache_dir, section)
+        if len(section) != 2 or not os.path.isdir(section_dir):
+            continue
+        for filename in os.listdir(section_dir):
+            path = os.path.join(section_dir, filename)
+            try: status = os.stat(path)
+            except OSError: continue
+            if len(filename) != 38:
+                # Left-over temporary file from a crashed writer.
+                if time.time() - status.st_mtime > TOUCH_INTERVAL:
+                    try: os.unlink(path)
+                    except OSError: pass
+                continue
+            files.append((status.st_mtime, status.st_size, path))
+            total_size += status.st_size
+
+    evicted = 0
+
+    if total_size > budget:
+        target_size = budget * 0.9
+
+        files.sort()
+
+        for mtime, size, path in files:
+            if total_size <= target_size: break
+            try: os.unlink(path)
+            except OSError: continue
+            total_size -= size
+            evicted += 1
+
+    __writeAtomically(cache_dir, generateUsagePath(), str(total_size))
+
+    return len(files) - evicted, evicted
@@ -0,0 +1,434 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""In-process reader of git objects.
+
+   Reads objects directly from a repository's pack files (version 2 pack
+   indexes) and loose objects, instead of asking a 'git cat-file' process for
+   them.  Anything not supported (other index versions, missing objects,
+   corrupt data) is reported by returning None, in which case the caller is
+   expected to fall back to 'git cat-file'."""
+
+import os
+import os.path
+import mmap
+import zlib
+import struct
+import binascii
+
+from collections import OrderedDict
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = { OBJ_COMMIT: "commit",
+               OBJ_TREE: "tree",
+               OBJ_BLOB: "blob",
+               OBJ_TAG: "tag" }
+
+# Maximum number of delta bases to keep in the delta base cache, and the
+# maximum size of an individual cached delta base.
+DELTA_BASE_CACHE_ENTRIES = 256
+DELTA_BASE_CACHE_MAXIMUM_SIZE = 1024 ** 2
+
+# Maximum length of delta chain to follow.  Git's default maximum depth when
+# packing is 50, so this should never be hit in practice.
+MAXIMUM_DELTA_DEPTH = 1000
+
+class Unsupported(Exception):
+    pass
+
+def readVarint(data, offset):
+    """Read a little-endian base-128 integer as used in delta headers."""
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[offset])
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+def applyDelta(base, delta):
+    source_size, offset = readVarint(delta, 0)
+    target_size, offset = readVarint(delta, offset)
+
+    if source_size != len(base):
+        raise Unsupported("delta source size mismatch")
+
+    chunks = []
+    delta_length = len(delta)
+
+    while offset < delta_length:
+        command = ord(delta[offset])
+        offset += 1
+
+        if command & 0x80:
+            copy_offset = 0
+            copy_size = 0
+            for bit in range(4):
+                if command & (1 << bit):
+                    copy_offset |= ord(delta[offset]) << (8 * bit)
+                    offset += 1
+            for bit in range(3):
+                if command & (0x10 << bit):
+                    copy_size |= ord(delta[offset]) << (8 * bit)
+                    offset += 1
+            if copy_size == 0:
+                copy_size = 0x10000
+            chunks.append(base[copy_offset:copy_offset + copy_size])
+        elif command:
+            chunks.append(delta[offset:offset + command])
+            offset += command
+        else:
+            raise Unsupported("invalid delta opcode")
+
+    target = "".join(chunks)
+
+    if len(target) != target_size:
+        raise Unsupported("delta target size mismatch")
+
+    return target
+
+def inflate(data, offset, size, max_length=0):
+    """Inflate zlib data starting at 'offset' in 'data' (a string or mmap.)
+
+       Returns 'size' bytes of inflated data, or at most 'max_length' bytes if
+       it is non-zero."""
+
+    decompressor = zlib.decompressobj()
+    wanted = min(size, max_length) if max_length else size
+    output = []
+    length = 0
+    chunk_size = max(4096, min(wanted + 64, 1024 ** 2))
+
+    while length < wanted:
+        if decompressor.unconsumed_tail:
+            chunk = decompressor.unconsumed_tail
+        else:
+            chunk = data[offset:offset + chunk_size]
+            if not chunk:
+                raise Unsupported("truncated object data")
+            offset += chunk_size
+        if max_length:
+            inflated = decompressor.decompress(chunk, wanted - length)
+        else:
+            inflated = decompressor.decompress(chunk)
+        output.append(inflated)
+        length += len(inflated)
+        if decompressor.unused_data:
+            # End of the zlib stream.
+            break
+
+    result = "".join(output)
+
+    if not max_length and len(result) != size:
+        raise Unsupported("inflated size mismatch")
+
+    return result[:wanted]
+
+class Pack(object):
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.pack_path = index_path[:-4] + ".pack"
+
+        with open(self.index_path, "rb") as index_file:
+            self.__index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.pack_path, "rb") as pack_file:
+            self.__pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.__index[:8] != "\377tOc\0\0\0\2":
+            raise Unsupported("unsupported pack index version: %s" % self.index_path)
+        if self.__pack[:4] != "PACK":
+            raise Unsupported("invalid pack file: %s" % self.pack_path)
+
+        self.__fanout = struct.unpack_from(">256I", self.__index, 8)
+        self.__count = self.__fanout[255]
+        self.__sha1s_offset = 8 + 256 * 4
+        self.__offsets_offset = self.__sha1s_offset + self.__count * 24
+        self.__large_offsets_offset = self.__offsets_offset + self.__count * 4
+
+    def close(self):
+        self.__index.close()
+        self.__pack.close()
+
+    def findOffset(self, binary_sha1):
+        """Return the offset in the pack file of an object, or None."""
+
+        first_byte = ord(binary_sha1[0])
+        low = self.__fanout[first_byte - 1] if first_byte else 0
+        high = self.__fanout[first_byte]
+        index = self.__index
+        sha1s_offset = self.__sha1s_offset
+
+        while low < high:
+            middle = (low + high) // 2
+            position = sha1s_offset + middle * 20
+            candidate = index[position:position + 20]
+            if candidate < binary_sha1: low = middle + 1
+            elif candidate > binary_sha1: high = middle
+            else:
+                offset, = struct.unpack_from(">I", index, self.__offsets_offset + middle * 4)
+                if offset & 0x80000000:
+                    offset, = struct.unpack_from(">Q", index, self.__large_offsets_offset + (offset & 0x7fffffff) * 8)
+                return offset
+
+        return None
+
+    def readEntryHeader(self, offset):
+        """Return (type, size, data offset, delta base) for the entry at
+           'offset'.  The delta base is a pack offset for OFS_DELTA entries, a
+           binary SHA-1 for REF_DELTA entries and None otherwise."""
+
+        pack = self.__pack
+        start = offset
+        byte = ord(pack[offset])
+        offset += 1
+        entry_type = (byte >> 4) & 7
+        size = byte & 0x0f
+        shift = 4
+        while byte & 0x80:
+            byte = ord(pack[offset])
+            offset += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+
+        if entry_type == OBJ_OFS_DELTA:
+            byte = ord(pack[offset])
+            offset += 1
+            base_distance = byte & 0x7f
+            while byte & 0x80:
+                byte = ord(pack[offset])
+                offset += 1
+                base_distance = ((base_distance + 1) << 7) | (byte & 0x7f)
+            return entry_type, size, offset, start - base_distance
+        elif entry_type == OBJ_REF_DELTA:
+            return entry_type, size, offset + 20, pack[offset:offset + 20]
+        else:
+            return entry_type, size, offset, None
+
+    def inflate(self, offset, size, max_length=0):
+        return inflate(self.__pack, offset, size, max_length)
+
+class ObjectReader(object):
+    """Reader of objects in a single repository."""
+
+    def __init__(self, repository_path):
+        if os.path.isdir(os.path.join(repository_path, "objects")):
+            objects_dir = os.path.join(repository_path, "objects")
+        else:
+            objects_dir = os.path.join(repository_path, ".git", "objects")
+
+        self.__objects_dirs = [objects_dir]
+
+        alternates_path = os.path.join(objects_dir, "info", "alternates")
+        if os.path.isfile(alternates_path):
+            for line in open(alternates_path):
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    self.__objects_dirs.append(os.path.normpath(os.path.join(objects_dir, line)))
+
+        self.__packs = {}
+        self.__packs_mtimes = {}
+        self.__delta_bases = OrderedDict()
+        self.__scanPacks()
+
+    def close(self):
+        for pack in self.__packs.values():
+            if pack: pack.close()
+        self.__packs = {}
+        self.__delta_bases.clear()
+
+    def __scanPacks(self):
+        """Open any pack files added since last scan, and close any removed
+           since (typically by 'git gc'.)  Returns True if the set of packs
+           changed."""
+
+        changed = False
+
+        for objects_dir in self.__objects_dirs:
+            pack_dir = os.path.join(objects_dir, "pack")
+            try: mtime = os.stat(pack_dir).st_mtime
+            except OSError: continue
+
+            if self.__packs_mtimes.get(pack_dir) == mtime:
+                continue
+
+            self.__packs_mtimes[pack_dir] = mtime
+
+            index_paths = set(os.path.join(pack_dir, filename)
+                              for filename in os.listdir(pack_dir)
+                              if filename.endswith(".idx"))
+
+            for index_path in index_paths:
+                if index_path not in self.__packs:
+                    try: self.__packs[index_path] = Pack(index_path)
+                    except (Unsupported, EnvironmentError, struct.error):
+                        # Remember that this pack is unusable.
+                        self.__packs[index_path] = None
+                    changed = True
+
+            for index_path, pack in self.__packs.items():
+                if os.path.dirname(index_path) == pack_dir and index_path not in index_paths:
+                    if pack: pack.close()
+                    del self.__packs[index_path]
+                    for key in [key for key in self.__delta_bases if key[0] == index_path]:
+                        del self.__delta_bases[key]
+                    changed = True
+
+        return changed
+
+    def __findInPacks(self, binary_sha1):
+        for pack in self.__packs.values():
+            if pack:
+                offset = pack.findOffset(binary_sha1)
+                if offset is not None:
+                    return pack, offset
+        return None, None
+
+    def __readLoose(self, sha1, header_only):
+        for objects_dir in self.__objects_dirs:
+            path = os.path.join(objects_dir, sha1[:2], sha1[2:])
+            try: compressed = open(path, "rb").read()
+            except IOError: continue
+
+            if header_only:
+                inflated = zlib.decompressobj().decompress(compressed, 64)
+            else:
+                inflated = zlib.decompress(compressed)
+
+            null = inflated.index("\0")
+            object_type, size = inflated[:null].split(" ")
+            size = int(size)
+
+            if header_only:
+                return object_type, size, None
+            else:
+                data = inflated[null + 1:]
+                if len(data) != size:
+                    raise Unsupported("loose object size mismatch")
+                return object_type, size, data
+
+        return None
+
+    def __readPacked(self, pack, offset, depth=0):
+        """Return (type, data) of the object at 'offset' in 'pack'."""
+
+        key = (pack.index_path, offset)
+        cached = self.__delta_bases.get(key)
+        if cached:
+            return cached
+
+        if depth > MAXIMUM_DELTA_DEPTH:
+            raise Unsupported("delta chain too long")
+
+        entry_type, size, data_offset, base = pack.readEntryHeader(offset)
+
+        if entry_type in TYPE_NAMES:
+            result = TYPE_NAMES[entry_type], pack.inflate(data_offset, size)
+        else:
+            if entry_type == OBJ_OFS_DELTA:
+                base_type, base_data = self.__readPacked(pack, base, depth + 1)
+            elif entry_type == OBJ_REF_DELTA:
+                base_pack, base_offset = self.__findInPacks(base)
+                if base_pack is None:
+                    raise Unsupported("REF_DELTA base not found")
+                base_type, base_data = self.__readPacked(base_pack, base_offset, depth + 1)
+            else:
+                raise Unsupported("unknown pack entry type: %d" % entry_type)
+
+            result = base_type, applyDelta(base_data, pack.inflate(data_offset, size))
+
+        if depth > 0 and len(result[1]) <= DELTA_BASE_CACHE_MAXIMUM_SIZE:
+            # Only cache objects that were used as delta bases.
+            self.__delta_bases[key] = result
+            while len(self.__delta_bases) > DELTA_BASE_CACHE_ENTRIES:
+                self.__delta_bases.popitem(last=False)
+
+        return result
+
+    def __readPackedHeader(self, pack, offset):
+        """Return (type, size) of the object at 'offset' in 'pack', without
+           inflating more than the start of any delta."""
+
+        entry_type, size, data_offset, base = pack.readEntryHeader(offset)
+
+        if entry_type in TYPE_NAMES:
+            return TYPE_NAMES[entry_type], size
+
+        # The size of the result is in the delta's header; the type is that of
+        # the object at the end of the delta chain.
+        delta_header = pack.inflate(data_offset, size, max_length=32)
+        source_size, header_offset = readVarint(delta_header, 0)
+        target_size, header_offset = readVarint(delta_header, header_offset)
+
+        depth = 0
+        while entry_type not in TYPE_NAMES:
+            depth += 1
+            if depth > MAXIMUM_DELTA_DEPTH:
+                raise Unsupported("delta chain too long")
+            if entry_type == OBJ_OFS_DELTA:
+                offset = base
+            elif entry_type == OBJ_REF_DELTA:
+                pack, offset = self.__findInPacks(base)
+                if pack is None:
+                    raise Unsupported("REF_DELTA base not found")
+            else:
+                raise Unsupported("unknown pack entry type: %d" % entry_type)
+            entry_type, size, data_offset, base = pack.readEntryHeader(offset)
+
+        return TYPE_NAMES[entry_type], target_size
+
+    def read(self, sha1, fetchData=True):
+        """Return (type, size, data) for an object, or None if the object could
+           not be read.  If 'fetchData' is False, data is None."""
+
+        try:
+            binary_sha1 = binascii.unhexlify(sha1)
+        except TypeError:
+            return None
+
+        if len(binary_sha1) != 20:
+            return None
+
+        try:
+            pack, offset = self.__findInPacks(binary_sha1)
+
+            if pack is None:
+                loose = self.__readLoose(sha1, not fetchData)
+                if loose:
+                    return loose
+
+                # Might have been repacked since we last looked.
+                if self.__scanPacks():
+                    pack, offset = self.__findInPacks(binary_sha1)
+
+                if pack is None:
+                    return None
+
+            if fetchData:
+                object_type, data = self.__readPacked(pack, offset)
+                return object_type, len(data), data
+            else:
+                object_type, size = self.__readPackedHeader(pack, offset)
+                return object_type, size, None
+        except (Unsupported, EnvironmentError, zlib.error, ValueError, IndexError, struct.error):
+            return None
@@ -24,6 +24,8 @@ import threading
 
 import base
 import configuration
+import gitcache
+import gitreader
 from utf8utils import convertUTF8
 import htmlutils
 import os.path
@@ -31,10 +33,16 @@ import shutil
 import os
 import atexit
 import stat
+import tempfile
 
 re_author_committer = re.compile("(.*) <(.*)> ([0-9]+ [-+][0-9]+)")
 re_sha1 = re.compile("^[A-Za-z0-9]{40}$")
 
+# Number of SHA-1s written to 'git cat-file --batch' at a time by
+# Repository.fetchMany().  Each request line is 41 bytes, so this needs to stay
+# well below 4096 / 41 to be certain that writing never blocks.
+FETCH_MANY_WINDOW = 64
+
 REPOSITORY_REPLAY_PATH_FORMAT = os.path.join(configuration.paths.DATA_DIR,
                                              "temporary",
                                              "%(repository.name)s",
@@ -83,6 +91,7 @@ class Repository:
         self.__main_branch_id = main_branch_id
         self.__batch = None
         self.__batchCheck = None
+        self.__reader = None
         self.__cacheBlobs = False
         self.__cacheDisabled = False
 
@@ -95,7 +104,10 @@ class Repository:
             self.__db = None
             atexit.register(self.__terminate)
 
-        self.__startBatch()
+        if configuration.base.READ_GIT_OBJECTS_DIRECTLY:
+            self.__reader = gitreader.ObjectReader(self.path)
+        else:
+            self.__startBatch()
 
     def __str__(self):
         return "%s:%s" % (configuration.base.HOSTNAME, self.path)
@@ -157,6 +169,9 @@ class Repository:
             if repository.iscommit(sha1): return repository
 
     def __terminate(self, db=None):
+        if self.__reader:
+            self.__reader.close()
+            self.__reader = None
         if self.__batch:
             try: kill(self.__batch.pid, 9)
             except: pass
@@ -210,28 +225,53 @@ class Repository:
         else:
             return None
 
-    def fetch(self, sha1, fetchData=True):
+    def __getCached(self, sha1, fetchData=True):
         if self.__db:
-            cache = self.__db.storage["Repository"]
-            cached_object = cache.get("object:" + sha1)
-            if cached_object:
+            cached_object = self.__db.storage["Repository"].get("object:" + sha1)
+            if cached_object and (cached_object.data is not None or not fetchData):
                 self.__db.recordProfiling("fetch: " + cached_object.type + " (cached)", 0)
                 return cached_object
 
-        before = time.time()
+        if not self.__cacheDisabled and gitcache.isEnabled():
+            cached_object = gitcache.get(sha1)
+            if cached_object:
+                if self.__db:
+                    self.__db.recordProfiling("fetch: " + cached_object.type + " (shared cache)", 0)
+                    if cached_object.type != "blob" or self.__cacheBlobs:
+                        self.__db.storage["Repository"]["object:" + sha1] = cached_object
+                return cached_object
 
+    def __setCached(self, git_object):
+        if not self.__cacheDisabled:
+            if self.__db and (git_object.type != "blob" or self.__cacheBlobs):
+                self.__db.storage["Repository"]["object:" + git_object.sha1] = git_object
+            if gitcache.isEnabled():
+                gitcache.put(git_object)
+
+    def __getBatch(self, fetchData):
         if fetchData:
             self.__startBatch()
-            stdin, stdout = self.__batch.stdin, self.__batch.stdout
+            return self.__batch.stdin, self.__batch.stdout
         else:
             self.__startBatchCheck()
-            stdin, stdout = self.__batchCheck.stdin, self.__batchCheck.stdout
+            return self.__batchCheck.stdin, self.__batchCheck.stdout
+
+    def __readDirectly(self, sha1, fetchData):
+        if self.__reader:
+            result = self.__reader.read(sha1, fetchData)
+            if result:
+                object_type, size, data = result
+                return GitObject(sha1, object_type, size, data)
+
+    def __readObject(self, stdout, sha1, fetchData):
+        """Read one object (or 'missing' line) from a 'git cat-file' process.
+
+           Returns None if the object is missing from the repository."""
 
-        stdin.write(sha1 + '\n')
         line = stdout.readline()
 
         if line == ("%s missing\n" % sha1):
-            raise GitError("%s missing from %s" % (sha1[:8], self.path), sha1=sha1, repository=self)
+            return None
 
         try: sha1, type, size = line.split()
         except: raise GitError("unexpected output from 'git cat-file --batch': %s" % line)
@@ -244,21 +284,140 @@ class Repository:
         else:
             data = None
 
-        git_object = GitObject(sha1, type, size, data)
+        return GitObject(sha1, type, size, data)
+
+    def fetch(self, sha1, fetchData=True):
+        cached_object = self.__getCached(sha1, fetchData)
+        if cached_object:
+            return cached_object
+
+        before = time.time()
+
+        git_object = self.__readDirectly(sha1, fetchData)
+
+        if git_object is None:
+            stdin, stdout = self.__getBatch(fetchData)
+
+            stdin.write(sha1 + '\n')
+
+            git_object = self.__readObject(stdout, sha1, fetchData)
+
+            if git_object is None:
+                raise GitError("%s missing from %s" % (sha1[:8], self.path), sha1=sha1, repository=self)
 
         after = time.time()
 
-        if not self.__cacheDisabled and (type != "blob" or self.__cacheBlobs):
-            cache["object:" + sha1] = git_object
+        self.__setCached(git_object)
 
         if self.__db:
-            self.__db.recordProfiling("fetch: " + type, after - before)
+            self.__db.recordProfiling("fetch: " + git_object.type, after - before)
 
         return git_object
 
+    def fetchMany(self, sha1s, fetchData=True):
+        """Fetch several objects, pipelining the requests.
+
+           Returns a list of GitObject objects in the same order as 'sha1s'.
+           Instead of one write/read round trip per object, as fetch() does,
+           SHA-1s are written to the 'git cat-file --batch' process in groups
+           of FETCH_MANY_WINDOW, and the objects are then read back in order.
+           The group size is kept small enough that the requests always fit
+           in the pipe's buffer, so writing can't dead-lock against 'git
+           cat-file' blocking on a full output pipe."""
+
+        objects = {}
+        requested = []
+
+        for sha1 in sha1s:
+            if sha1 not in objects:
+                cached_object = self.__getCached(sha1, fetchData)
+                objects[sha1] = cached_object
+                if not cached_object:
+                    requested.append(sha1)
+
+        if requested and self.__reader:
+            before = time.time()
+
+            remaining = []
+
+            for sha1 in requested:
+                git_object = self.__readDirectly(sha1, fetchData)
+                if git_object is None:
+                    remaining.append(sha1)
+                else:
+                    objects[sha1] = git_object
+                    self.__setCached(git_object)
+
+            after = time.time()
+
+            if self.__db:
+                self.__db.recordProfiling("fetchMany (direct)", after - before, repetitions=len(requested) - len(remaining))
+
+            requested = remaining
+
+        if requested:
+            before = time.time()
+
+            stdin, stdout = self.__getBatch(fetchData)
+            missing = []
+
+            for offset in range(0, len(requested), FETCH_MANY_WINDOW):
+                group = requested[offset:offset + FETCH_MANY_WINDOW]
+
+                stdin.write("".join([sha1 + "\n" for sha1 in group]))
+
+                # Always read the whole group, even if some object is missing,
+                # so that the 'git cat-file' process is left in a sane state.
+                for sha1 in group:
+                    git_object = self.__readObject(stdout, sha1, fetchData)
+                    if git_object is None:
+                        missing.append(sha1)
+                    else:
+                        objects[sha1] = git_object
+                        self.__setCached(git_object)
+
+            if missing:
+                raise GitError("%s missing from %s" % (missing[0][:8], self.path), sha1=missing[0], repository=self)
+
+            after = time.time()
+
+            if self.__db:
+                self.__db.recordProfiling("fetchMany", after - before, repetitions=len(requested))
+
+        return [objects[sha1] for sha1 in sha1s]
+
     def run(self, command, *arguments, **kwargs):
         return self.runCustom(self.path, command, *arguments, **kwargs)
 
+    def runLines(self, command, *arguments):
+        """Like run(), but return a generator yielding the lines (without line
+           breaks) of git's output as they are produced, instead of returning
+           all of it at once.  Raises an exception after the last line if git
+           failed."""
+
+        argv = [configuration.executables.GIT, command]
+        argv.extend(arguments)
+        env = {}
+        env.update(environ)
+        if "GIT_DIR" in env: del env["GIT_DIR"]
+        # Not a pipe, since it's only read once stdout has been read to the end.
+        stderr = tempfile.TemporaryFile()
+        git = process(argv, stdout=PIPE, stderr=stderr, cwd=self.path, env=env)
+        try:
+            for line in git.stdout:
+                if line[-1] == "\n": yield line[:-1]
+                else: yield line
+            git.stdout.close()
+            if git.wait() != 0:
+                stderr.seek(0)
+                raise Exception, "'%s' failed: %s (in %s)" % (" ".join(argv), stderr.read().strip(), self.path)
+        finally:
+            if git.returncode is None:
+                # The caller stopped reading early.
+                git.kill()
+                git.wait()
+            stderr.close()
+
     def runRelay(self, command, *arguments, **kwargs):
         if not os.path.isdir(self.relay):
             try: os.makedirs(os.path.dirname(self.relay))
@@ -312,12 +471,37 @@ class Repository:
 
         assert len(sha1s) >= 2
 
+        if len(sha1s) == 2:
+            commit_graph = self.__getCommitGraph()
+            if commit_graph:
+                result = commit_graph.mergebase(self.__db, sha1s[0], sha1s[1])
+                if result is not None: return result
+
         git = process([configuration.executables.GIT, 'merge-base'] + sha1s,
                       stdout=PIPE, stderr=PIPE, cwd=self.path)
         stdout, stderr = git.communicate()
         if git.returncode == 0: return stdout.strip()
         else: raise Exception, "'git merge-base' failed: %s" % stderr.strip()
 
+    def isAncestor(self, ancestor, descendant):
+        """Return True if 'ancestor' is an ancestor of (or the same commit as)
+           'descendant'."""
+
+        ancestor_sha1 = str(ancestor)
+        descendant_sha1 = str(descendant)
+
+        commit_graph = self.__getCommitGraph()
+        if commit_graph:
+            result = commit_graph.isAncestor(self.__db, ancestor_sha1, descendant_sha1)
+            if result is not None: return result
+
+        return self.mergebase([ancestor_sha1, descendant_sha1]) == ancestor_sha1
+
+    def __getCommitGraph(self):
+        if self.__db:
+            import dbutils
+            return dbutils.getCommitGraph()
+
     def getCommonAncestor(self, commit_or_commits):
         try: sha1s = commit_or_commits.parents
         except: sha1s = list(commit_or_commits)
@@ -503,6 +687,35 @@ class CommitUserTime:
 
         return user_id, gituser_id
 
+    @staticmethod
+    def resolveIds(db, users):
+        """Look up the ids of many users with few queries.
+
+           The result is recorded in the same cache as is used by getUserId()
+           and getGitUserId(), so subsequent calls to them, for any of the
+           users, will be cheap.  Git users not already in the database are
+           added."""
+
+        cache = db.storage["CommitUserTime"]
+        pending = set((user.name, user.email) for user in users if (user.name, user.email) not in cache)
+
+        if pending:
+            cursor = db.cursor()
+            cursor.execute("""SELECT gitusers.fullname, gitusers.email, gitusers.id, usergitemails.uid
+                                FROM gitusers
+                     LEFT OUTER JOIN usergitemails USING (email)
+                               WHERE gitusers.email=ANY (%s)""",
+                           (list(set(email for name, email in pending)),))
+
+            for fullname, email, gituser_id, user_id in cursor:
+                key = (fullname, email)
+                if key in pending and key not in cache:
+                    cache[key] = user_id, gituser_id
+
+            # Add any users that weren't found.
+            for user in users:
+                user.__getIds(db)
+
     def getUserId(self, db):
         return self.__getIds(db)[0]
 
@@ -565,6 +778,19 @@ class Commit:
     def fromSHA1(db, repository, sha1, commit_id=None):
         return Commit.fromGitObject(db, repository, repository.fetch(sha1), commit_id)
 
+    @staticmethod
+    def fromSHA1s(db, repository, sha1s, commit_ids=None):
+        """Return a list of Commit objects, one for each SHA-1 in 'sha1s'.
+
+           The commit objects are fetched using Repository.fetchMany().  If
+           'commit_ids' is not None, it should be a list of commit ids with the
+           same length as 'sha1s'."""
+
+        if commit_ids is None: commit_ids = [None] * len(sha1s)
+        gitobjects = repository.fetchMany(sha1s)
+        return [Commit.fromGitObject(db, repository, gitobject, commit_id)
+                for gitobject, commit_id in zip(gitobjects, commit_ids)]
+
     @staticmethod
     def fromId(db, repository, commit_id):
         commit = db.storage["Commit"].get(commit_id)
@@ -627,7 +853,7 @@ class Commit:
         else:
             other_sha1 = str(other)
 
-        return self.repository.mergebase([self.sha1, other_sha1]) == self.sha1
+        return self.repository.isAncestor(self.sha1, other_sha1)
 
     def getFileEntry(self, path):
         try:
@@ -720,7 +946,7 @@ class Tree:
     @staticmethod
     def fromSHA1(repository, sha1):
         data = repository.fetch(sha1).data
-        entries = []
+        items = []
 
         while len(data):
             space = data.index(" ")
@@ -732,12 +958,16 @@ class Tree:
             sha1_binary = data[null + 1:null + 21]
             sha1 = "".join([("%02x" % ord(c)) for c in sha1_binary])
 
-            entry_object = repository.fetch(sha1, fetchData=False)
-
-            entries.append(Tree.Entry(name, mode, entry_object.type, sha1, entry_object.size))
+            items.append((name, mode, sha1))
 
             data = data[null + 21:]
 
+        entry_objects = repository.fetchMany([sha1 for name, mode, sha1 in items], fetchData=False)
+        entries = []
+
+        for (name, mode, sha1), entry_object in zip(items, entry_objects):
+            entries.append(Tree.Entry(name, mode, entry_object.type, sha1, entry_object.size))
+
         return Tree(entries)
 
 def getTaggedCommit(repository, sha1):
@@ -49,6 +49,7 @@ def getUser(db, user_name):
     except dbutils.NoSuchUser: return user_name
 
 db = None
+queued_review_updates = False
 
 class IndexException(Exception): pass
 
@@ -57,13 +58,7 @@ def processCommits(repository_name, sha1):
 
     if not repository: raise IndexException, "No such repository: %r" % repository_name
 
-    stack = []
-    edges_values = []
-
     cursor = db.cursor()
-    cursor.execute("SELECT 1 FROM commits LIMIT 1")
-    emptydb = cursor.fetchone() is None
-
     cursor.execute("""SELECT commits.sha1
                         FROM commits
                         JOIN branches ON (branches.head=commits.id)
@@ -84,63 +79,87 @@ def processCommits(repository_name, sha1):
 You're trying to add %d new commits to this repository.  Are you
 perhaps pushing to the wrong repository?""" % count
 
-    commit_count = 0
+    # All commits reachable from the heads of existing branches are already in
+    # the database, so list everything else reachable from the new commit, in
+    # one go, with raw commit headers.
+    cursor.execute("""SELECT DISTINCT commits.sha1
+                        FROM commits
+                        JOIN branches ON (branches.head=commits.id)
+                       WHERE branches.repository=%s""",
+                   (repository.id,))
 
-    commits_values = []
-    commits = set()
+    revisions = [sha1] + ["^" + head_sha1 for (head_sha1,) in cursor]
+    output = repository.run("rev-list", "--parents", "--header", "--stdin", input="\n".join(revisions) + "\n")
 
-    while True:
-        if sha1 not in commits:
-            commit = gitutils.Commit.fromSHA1(db, repository, sha1)
+    listed = []
 
-            if commit.author.email: author_id = commit.author.getGitUserId(db)
-            else: author_id = 0
+    for record in output.split("\0"):
+        if not record.strip("\n"): continue
 
-            if commit.committer.email: committer_id = commit.committer.getGitUserId(db)
-            else: committer_id = 0
+        lines = iter(record.lstrip("\n").split("\n"))
+        sha1s = lines.next().split()
+        author = committer = None
 
-            if emptydb: row = None
-            else:
-                cursor.execute("SELECT id FROM commits WHERE sha1=%s", (commit.sha1,))
-                row = cursor.fetchone()
-                new_commit = False
+        for line in lines:
+            if not line: break
+            key, value = line.split(" ", 1)
+            if key == "author": author = gitutils.CommitUserTime.fromValue(value)
+            elif key == "committer": committer = gitutils.CommitUserTime.fromValue(value)
 
-            if not row:
-                commit_count += 1
-                commits_values.append((commit.sha1, author_id, committer_id, timestamp(commit.author.time), timestamp(commit.committer.time)))
-                new_commit = True
+        listed.append((sha1s[0], sha1s[1:], author, committer))
 
-            commits.add(sha1)
+    if not listed:
+        return
+
+    # Filter out commits that the database already knows about, for instance
+    # because they have been pushed to another repository.
+    cursor.execute("SELECT sha1 FROM commits WHERE sha1=ANY (%s)",
+                   ([commit_sha1 for commit_sha1, parents, author, committer in listed],))
+
+    known = set(commit_sha1 for (commit_sha1,) in cursor)
+    new_commits = [commit for commit in listed if commit[0] not in known]
 
-            if new_commit:
-                edges_values.extend([(parent_sha1, commit.sha1) for parent_sha1 in set(commit.parents)])
-                stack.extend(set(commit.parents))
+    if not new_commits:
+        return
 
-        if not stack: break
+    users = []
+    for commit_sha1, parents, author, committer in new_commits:
+        if author.email: users.append(author)
+        if committer.email: users.append(committer)
 
-        sha1 = stack.pop(0)
+    gitutils.CommitUserTime.resolveIds(db, users)
 
-    if commit_count % 10000 > 1000:
-        stdout.write("\n")
-        stdout.flush()
+    generations = dbutils.getCommitGraph().calculateGenerations(
+        db, [(commit_sha1, list(set(parents))) for commit_sha1, parents, author, committer in new_commits])
+
+    commits_values = []
+    edges_values = []
 
-    cursor.executemany("""INSERT INTO commits (sha1, author_gituser, commit_gituser, author_time, commit_time)
-                               VALUES (%s, %s, %s, %s, %s)""",
-                       commits_values)
+    for commit_sha1, parents, author, committer in new_commits:
+        if author.email: author_id = author.getGitUserId(db)
+        else: author_id = 0
 
-    cursor.executemany("""INSERT INTO edges (parent, child)
-                               SELECT parents.id, children.id
-                                 FROM commits AS parents,
-                                      commits AS children
-                                WHERE parents.sha1=%s AND children.sha1=%s""",
-                       edges_values)
+        if committer.email: committer_id = committer.getGitUserId(db)
+        else: committer_id = 0
+
+        commits_values.append((commit_sha1, author_id, committer_id, timestamp(author.time), timestamp(committer.time), generations[commit_sha1]))
+        edges_values.extend([(parent_sha1, commit_sha1) for parent_sha1 in set(parents)])
+
+    db.bulkInsert("commits", ("sha1", "author_gituser", "commit_gituser", "author_time", "commit_time", "generation"), commits_values)
+    db.bulkMerge((("parent", "CHAR(40)"), ("child", "CHAR(40)")), edges_values,
+                 """INSERT INTO edges (parent, child)
+                         SELECT parents.id, children.id
+                           FROM bulkrows
+                           JOIN commits AS parents ON (parents.sha1=bulkrows.parent)
+                           JOIN commits AS children ON (children.sha1=bulkrows.child)""")
 
     db.commit()
 
 def init():
-    global db
+    global db, queued_review_updates
 
     db = Database()
+    queued_review_updates = False
 
 def finish():
     global db
@@ -150,6 +169,9 @@ def finish():
         db.close()
         db = None
 
+        if queued_review_updates:
+            review_utils.wakeReviewUpdater()
+
 def abort():
     global db
 
@@ -279,10 +301,9 @@ def createBranch(user, repository, name, head):
     tail = None
 
     cursor.execute("""SELECT 1
-                        FROM reachable
-                        JOIN branches ON (branches.id=reachable.branch)
-                        JOIN repositories ON (repositories.id=branches.repository)
-                       WHERE repositories.id=%s
+                        FROM reachableranges
+                        JOIN branches ON (branches.id=reachableranges.branch)
+                       WHERE branches.repository=%s
                        LIMIT 1""",
                    (repository.id,))
 
@@ -290,12 +311,13 @@ def createBranch(user, repository, name, head):
         def reachable(sha1):
             cursor.execute("""SELECT branches.id
                                 FROM branches
-                                JOIN reachable ON (reachable.branch=branches.id)
-                                JOIN commits ON (commits.id=reachable.commit)
+                                JOIN reachableranges ON (reachableranges.branch=branches.id)
+                                JOIN commits ON (commits.id BETWEEN reachableranges.first_commit
+                                                                AND reachableranges.last_commit)
                                WHERE branches.repository=%s
                                  AND branches.type='normal'
                                  AND commits.sha1=%s
-                            ORDER BY reachable.branch ASC
+                            ORDER BY reachableranges.branch ASC
                                LIMIT 1""",
                            (repository.id, sha1))
             return cursor.fetchone()
@@ -343,9 +365,10 @@ def createBranch(user, repository, name, head):
 
                             def reachable(sha1):
                                 cursor.execute("""SELECT 1
-                                                    FROM reachable
-                                                    JOIN commits ON (commits.id=reachable.commit)
-                                                   WHERE reachable.branch=ANY (%s)
+                                                    FROM reachableranges
+                                                    JOIN commits ON (commits.id BETWEEN reachableranges.first_commit
+                                                                                    AND reachableranges.last_commit)
+                                                   WHERE reachableranges.branch=ANY (%s)
                                                      AND commits.sha1=%s""",
                                                (base_chain, sha1))
                                 return cursor.fetchone()
@@ -374,8 +397,7 @@ def createBranch(user, repository, name, head):
             print "To create a review of the commit:"
         print "  %s/createreview?repository=%d&branch=%s" % (dbutils.getURLPrefix(db), repository.id, name)
 
-    reachable_values = [(branch_id, commit.sha1) for commit in commit_list]
-    cursor.executemany("INSERT INTO reachable (branch, commit) SELECT %s, id FROM commits WHERE sha1=%s", reachable_values)
+    dbutils.reachable.setCommits(db, branch_id, dbutils.reachable.getCommitIdsFromSHA1s(db, [commit.sha1 for commit in commit_list]))
 
     if isinstance(user, str): user_name = user
     else: user_name = user.name
@@ -384,6 +406,8 @@ def createBranch(user, repository, name, head):
         cursor.execute("UPDATE repositories SET branch=%s WHERE id=%s", (branch_id, repository.id))
 
 def updateBranch(user_name, repository_name, name, old, new, multiple):
+    global queued_review_updates
+
     repository = gitutils.Repository.fromName(db, repository_name)
 
     processCommits(repository_name, new)
@@ -435,12 +459,7 @@ Please don't push it manually to this repository.""" % (name, remote_name, remot
             if conflicting:
                 if forced:
                     if branch.base is None:
-                        cursor.executemany("""DELETE FROM reachable
-                                                    USING commits
-                                                    WHERE reachable.branch=%s
-                                                      AND reachable.commit=commits.id
-                                                      AND commits.sha1=%s""",
-                                           [(branch.id, sha1) for sha1 in conflicting])
+                        dbutils.reachable.removeCommits(db, branch.id, dbutils.reachable.getCommitIdsFromSHA1s(db, conflicting))
                     else:
                         output = "Non-fast-forward update detected; deleting and recreating branch."
 
@@ -455,11 +474,7 @@ can delete the branch using
   git push critic :%s
 first, and then repeat this push.""" % name
 
-            cursor.executemany("""INSERT INTO reachable (branch, commit)
-                                       SELECT %s, commits.id
-                                         FROM commits
-                                        WHERE sha1=%s""",
-                               [(branch.id, sha1) for sha1 in added])
+            dbutils.reachable.addCommits(db, branch.id, dbutils.reachable.getCommitIdsFromSHA1s(db, added))
 
             new_head = gitutils.Commit.fromSHA1(db, repository, new)
 
@@ -510,6 +525,12 @@ review branch at a time."""
             rebase_id, old_head_id, old_upstream_id, new_upstream_id, rebaser_id, onto_branch = row
 
             review = dbutils.Review.fromId(db, review_id)
+
+            if review_utils.hasQueuedReviewUpdates(db, review):
+                raise IndexException, """\
+Commits previously pushed to the review are still being processed.
+Please wait a moment and try again."""
+
             rebaser = dbutils.User.fromId(db, rebaser_id)
 
             if isinstance(user, dbutils.User):
@@ -593,11 +614,12 @@ onto the %s.""" % (merged_thing, review.branch.name, old_upstream_name, old_head
                 merge = gitutils.Commit.fromSHA1(db, repository, merge_sha1)
 
                 gituser_id = merge.author.getGitUserId(db)
+                generation = dbutils.getCommitGraph().calculateGenerations(db, [(merge_sha1, [old_head.sha1, new_upstream.sha1])])[merge_sha1]
 
-                cursor.execute("""INSERT INTO commits (sha1, author_gituser, commit_gituser, author_time, commit_time)
-                                       VALUES (%s, %s, %s, %s, %s)
+                cursor.execute("""INSERT INTO commits (sha1, author_gituser, commit_gituser, author_time, commit_time, generation)
+                                       VALUES (%s, %s, %s, %s, %s, %s)
                                     RETURNING id""",
-                               (merge_sha1, gituser_id, gituser_id, timestamp(merge.author.time), timestamp(merge.committer.time)))
+                               (merge_sha1, gituser_id, gituser_id, timestamp(merge.author.time), timestamp(merge.committer.time), generation))
                 merge.id = cursor.fetchone()[0]
 
                 cursor.executemany("INSERT INTO edges (parent, child) VALUES (%s, %s)",
@@ -616,11 +638,9 @@ onto the %s.""" % (merged_thing, review.branch.name, old_upstream_name, old_head
 
                 new_sha1s = repository.revlist([new], [new_upstream.sha1], '--topo-order')
                 rebased_commits = [gitutils.Commit.fromSHA1(db, repository, sha1) for sha1 in new_sha1s]
-                reachable_values = [(review.branch.id, sha1) for sha1 in new_sha1s]
 
-                cursor.execute("INSERT INTO previousreachable (rebase, commit) SELECT %s, commit FROM reachable WHERE branch=%s", (rebase_id, review.branch.id))
-                cursor.execute("DELETE FROM reachable WHERE branch=%s", (review.branch.id,))
-                cursor.executemany("INSERT INTO reachable (branch, commit) SELECT %s, commits.id FROM commits WHERE commits.sha1=%s", reachable_values)
+                dbutils.reachable.savePrevious(db, rebase_id, review.branch.id)
+                dbutils.reachable.setCommits(db, review.branch.id, dbutils.reachable.getCommitIdsFromSHA1s(db, new_sha1s))
                 cursor.execute("UPDATE branches SET head=%s WHERE id=%s", (gitutils.Commit.fromSHA1(db, repository, new).getId(db), review.branch.id))
 
                 pending_mails = []
@@ -659,11 +679,9 @@ the same tree as the old head of the branch."""
 
                 rebased_commits = [gitutils.Commit.fromSHA1(db, repository, sha1) for sha1 in repository.revlist([new_head], old_commitset.getTails(), '--topo-order')]
                 new_commits = [gitutils.Commit.fromSHA1(db, repository, sha1) for sha1 in repository.revlist([new], [new_head], '--topo-order')]
-                reachable_values = [(review.branch.id, sha1) for sha1 in new_sha1s]
 
-                cursor.execute("INSERT INTO previousreachable (rebase, commit) SELECT %s, commit FROM reachable WHERE branch=%s", (rebase_id, review.branch.id))
-                cursor.execute("DELETE FROM reachable WHERE branch=%s", (review.branch.id,))
-                cursor.executemany("INSERT INTO reachable (branch, commit) SELECT %s, commits.id FROM commits WHERE commits.sha1=%s", reachable_values)
+                dbutils.reachable.savePrevious(db, rebase_id, review.branch.id)
+                dbutils.reachable.setCommits(db, review.branch.id, dbutils.reachable.getCommitIdsFromSHA1s(db, new_sha1s))
                 cursor.execute("UPDATE branches SET head=%s WHERE id=%s", (gitutils.Commit.fromSHA1(db, repository, new).getId(db), review.branch.id))
 
                 pending_mails = []
@@ -694,13 +712,13 @@ first, and then repeat this push.""" % name
     cursor.execute("SELECT id FROM branches WHERE repository=%s AND base IS NULL ORDER BY id ASC LIMIT 1", (repository.id,))
     root_branch_id = cursor.fetchone()[0]
 
+    if base_branch_id: reachable = dbutils.ReachableSet(db, repository, [branch.id, base_branch_id, root_branch_id], new, [old])
+    else: reachable = dbutils.ReachableSet(db, repository, [branch.id, root_branch_id], new, [old])
+
     def isreachable(sha1):
         #if rescan: return False
-        #if is_review: cursor.execute("SELECT 1 FROM commits, reachable, branches WHERE commits.sha1=%s AND commits.id=reachable.commit AND reachable.branch=branches.id AND branches.repository=%s", [sha1, repository.id])
         if is_review and sha1 == branch.tail: return True
-        if base_branch_id: cursor.execute("SELECT 1 FROM commits, reachable WHERE commits.sha1=%s AND commits.id=reachable.commit AND reachable.branch IN (%s, %s, %s)", [sha1, branch.id, base_branch_id, root_branch_id])
-        else: cursor.execute("SELECT 1 FROM commits, reachable WHERE commits.sha1=%s AND commits.id=reachable.commit AND reachable.branch IN (%s, %s)", [sha1, branch.id, root_branch_id])
-        return cursor.fetchone() is not None
+        return sha1 in reachable
 
     stack = [new]
     commits = set()
@@ -725,7 +743,7 @@ first, and then repeat this push.""" % name
             #if is_review:
             #    stack.append(gitutils.Commit.fromSHA1(repository, sha1).parents[0])
             #else:
-            stack.extend([parent_sha1 for parent_sha1 in gitutils.Commit.fromSHA1(db, repository, sha1).parents if parent_sha1 not in processed])
+            stack.extend([parent_sha1 for parent_sha1 in reachable.getParents(sha1) if parent_sha1 not in processed])
 
         processed.add(sha1)
 
@@ -753,18 +771,24 @@ included in the review are too.
 
 Perhaps you should request a new review of the follow-up commits?"""
 
-        review_utils.addCommitsToReview(db, user, review, all_commits, commitset=commits, tracked_branch=tracked_branch)
+        # Check that the commits can be added, so that the push is rejected if
+        # they can't, but leave the actual adding (creating changesets,
+        # assigning changes, sending e-mails and running extensions) to the
+        # review updater service, so that the push needn't wait for it.
+        added_commits = review_utils.checkCommitsForReview(db, user, review, all_commits, set(commits), tracked_branch)[0]
+
+        review_utils.queueReviewUpdate(db, review, user, gitutils.Commit.fromSHA1(db, repository, old), gitutils.Commit.fromSHA1(db, repository, new), added_commits, tracked_branch)
 
-    reachable_values = [(branch.id, sha1) for sha1 in reversed(commit_list) if sha1 in commits]
+        queued_review_updates = True
 
-    cursor.executemany("INSERT INTO reachable (branch, commit) SELECT %s, commits.id FROM commits WHERE commits.sha1=%s", reachable_values)
+        print "Adding %d commit%s to the review at:\n  %s" % (len(added_commits), "s" if len(added_commits) > 1 else "", review.getURL(db))
+        print "(Changes will be assigned and notifications sent in the background.)"
+
+    dbutils.reachable.addCommits(db, branch.id, dbutils.reachable.getCommitIdsFromSHA1s(db, commit_list))
     cursor.execute("UPDATE branches SET head=%s WHERE id=%s", (gitutils.Commit.fromSHA1(db, repository, new).getId(db), branch.id))
 
     db.commit()
 
-    if configuration.extensions.ENABLED and review:
-        extensions.executeProcessCommits(db, user, review, all_commits, gitutils.Commit.fromSHA1(db, repository, old), gitutils.Commit.fromSHA1(db, repository, new), stdout)
-
 def deleteBranch(repository_name, name):
     repository = gitutils.Repository.fromName(db, repository_name)
 
@@ -777,9 +801,7 @@ def deleteBranch(repository_name, name):
             raise IndexException, "This is Critic refusing to delete a branch that belongs to a review."
 
         cursor = db.cursor()
-        cursor.execute("SELECT COUNT(*) FROM reachable WHERE branch=%s", (branch.id,))
-
-        ncommits = cursor.fetchone()[0]
+        ncommits = branch.getCommitCount(db)
 
         if branch.base:
             cursor.execute("UPDATE branches SET base=%s WHERE base=%s", (branch.base.id, branch.id))
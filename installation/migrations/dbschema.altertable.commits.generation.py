@@ -0,0 +1,93 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import sys
+import psycopg2
+import json
+import argparse
+import os
+import cStringIO
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--uid", type=int)
+parser.add_argument("--gid", type=int)
+
+arguments = parser.parse_args()
+
+os.setgid(arguments.gid)
+os.setuid(arguments.uid)
+
+data = json.load(sys.stdin)
+
+db = psycopg2.connect(database="critic")
+cursor = db.cursor()
+
+try:
+    # Make sure the column doesn't already exist.
+    cursor.execute("SELECT generation FROM commits")
+
+    # Above statement should have thrown a psycopg2.ProgrammingError, but it
+    # didn't, so just exit.
+    sys.exit(0)
+except psycopg2.ProgrammingError:
+    db.rollback()
+except:
+    raise
+
+cursor.execute("ALTER TABLE commits ADD generation INTEGER")
+
+# Calculate generation numbers for all existing commits, processing commits in
+# topological order (parents before children.)
+
+cursor.execute("SELECT id FROM commits")
+
+parent_count = dict((commit_id, 0) for (commit_id,) in cursor)
+children = {}
+
+cursor.execute("SELECT DISTINCT parent, child FROM edges")
+
+for parent_id, child_id in cursor:
+    parent_count[child_id] += 1
+    children.setdefault(parent_id, []).append(child_id)
+
+generations = {}
+queue = [commit_id for commit_id, count in parent_count.items() if count == 0]
+
+for commit_id in queue:
+    generations[commit_id] = 1
+
+while queue:
+    commit_id = queue.pop()
+    generation = generations[commit_id] + 1
+
+    for child_id in children.get(commit_id, ()):
+        generations[child_id] = max(generations.get(child_id, 0), generation)
+        parent_count[child_id] -= 1
+        if parent_count[child_id] == 0:
+            queue.append(child_id)
+
+cursor.execute("CREATE TEMPORARY TABLE commitgenerations (commit INTEGER, generation INTEGER)")
+
+rows = cStringIO.StringIO("".join("%d\t%d\n" % item for item in generations.items()))
+cursor.copy_from(rows, "commitgenerations", columns=("commit", "generation"))
+
+cursor.execute("""UPDATE commits
+                     SET generation=commitgenerations.generation
+                    FROM commitgenerations
+                   WHERE commits.id=commitgenerations.commit""")
+
+db.commit()
+db.close()
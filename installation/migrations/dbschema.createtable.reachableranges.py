@@ -0,0 +1,85 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import sys
+import psycopg2
+import json
+import argparse
+import os
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--uid", type=int)
+parser.add_argument("--gid", type=int)
+
+arguments = parser.parse_args()
+
+os.setgid(arguments.gid)
+os.setuid(arguments.uid)
+
+data = json.load(sys.stdin)
+
+db = psycopg2.connect(database="critic")
+cursor = db.cursor()
+
+try:
+    # Make sure the table doesn't already exist.
+    cursor.execute("SELECT 1 FROM reachableranges")
+
+    # Above statement should have thrown a psycopg2.ProgrammingError, but it
+    # didn't, so just exit.
+    sys.exit(0)
+except psycopg2.ProgrammingError: db.rollback()
+except: raise
+
+cursor.execute("""CREATE TABLE reachableranges
+                    ( branch INTEGER NOT NULL REFERENCES branches ON DELETE CASCADE,
+                      first_commit INTEGER NOT NULL,
+                      last_commit INTEGER NOT NULL )""")
+
+cursor.execute("""CREATE TABLE previousreachableranges
+                    ( rebase INTEGER NOT NULL REFERENCES reviewrebases,
+                      first_commit INTEGER NOT NULL,
+                      last_commit INTEGER NOT NULL )""")
+
+# Convert the old one-row-per-commit tables into ranges of consecutive commit
+# ids.  Subtracting a commit's rank within its set from its id gives the same
+# value for all commits in a run of consecutive ids.
+
+cursor.execute("""INSERT INTO reachableranges (branch, first_commit, last_commit)
+                       SELECT branch, MIN(commit), MAX(commit)
+                         FROM (SELECT branch, commit,
+                                      commit - ROW_NUMBER() OVER (PARTITION BY branch ORDER BY commit) AS run
+                                 FROM reachable) AS numbered
+                     GROUP BY branch, run""")
+
+cursor.execute("""INSERT INTO previousreachableranges (rebase, first_commit, last_commit)
+                       SELECT rebase, MIN(commit), MAX(commit)
+                         FROM (SELECT rebase, commit,
+                                      commit - ROW_NUMBER() OVER (PARTITION BY rebase ORDER BY commit) AS run
+                                 FROM (SELECT DISTINCT rebase, commit
+                                         FROM previousreachable) AS distinct_rows) AS numbered
+                     GROUP BY rebase, run""")
+
+cursor.execute("CREATE INDEX reachableranges_branch ON reachableranges (branch)")
+cursor.execute("CREATE INDEX reachableranges_commits ON reachableranges (first_commit, last_commit)")
+cursor.execute("CREATE INDEX reachableranges_commits_last ON reachableranges (last_commit, first_commit)")
+cursor.execute("CREATE INDEX previousreachableranges_rebase ON previousreachableranges (rebase)")
+
+cursor.execute("DROP TABLE reachable")
+cursor.execute("DROP TABLE previousreachable")
+
+db.commit()
+db.close()
@@ -0,0 +1,68 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import sys
+import psycopg2
+import json
+import argparse
+import os
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--uid", type=int)
+parser.add_argument("--gid", type=int)
+
+arguments = parser.parse_args()
+
+os.setgid(arguments.gid)
+os.setuid(arguments.uid)
+
+data = json.load(sys.stdin)
+
+db = psycopg2.connect(database="critic")
+cursor = db.cursor()
+
+try:
+    # Make sure the table doesn't already exist.
+    cursor.execute("SELECT 1 FROM reviewupdates")
+
+    # Above statement should have thrown a psycopg2.ProgrammingError, but it
+    # didn't.  An earlier version of this migration made 'uid' NOT NULL, but
+    # updates pushed by the system user store NULL there.
+    cursor.execute("ALTER TABLE reviewupdates ALTER uid DROP NOT NULL")
+    db.commit()
+    sys.exit(0)
+except psycopg2.ProgrammingError: db.rollback()
+except: raise
+
+cursor.execute("""CREATE TABLE reviewupdates
+                    ( id SERIAL PRIMARY KEY,
+                      review INTEGER NOT NULL REFERENCES reviews ON DELETE CASCADE,
+                      uid INTEGER REFERENCES users,
+                      old_head INTEGER NOT NULL REFERENCES commits,
+                      new_head INTEGER NOT NULL REFERENCES commits,
+                      tracked_branch VARCHAR(256),
+                      time TIMESTAMP NOT NULL DEFAULT NOW(),
+                      error TEXT )""")
+cursor.execute("CREATE INDEX reviewupdates_review ON reviewupdates (review)")
+
+cursor.execute("""CREATE TABLE reviewupdatecommits
+                    ( reviewupdate INTEGER NOT NULL REFERENCES reviewupdates ON DELETE CASCADE,
+                      commit INTEGER NOT NULL REFERENCES commits,
+
+                      PRIMARY KEY (reviewupdate, commit) )""")
+
+db.commit()
+db.close()
@@ -181,6 +181,7 @@ def install(data):
     mkdir(os.path.join(data_dir, "relay"))
     mkdir(os.path.join(data_dir, "outbox", "sent"), mode=0700)
     mkdir(os.path.join(cache_dir, "main", "highlight"))
+    mkdir(os.path.join(cache_dir, "main", "objects"))
     mkdir(git_dir)
     mkdir(os.path.join(log_dir, "main"))
     mkdir(os.path.join(run_dir, "main", "sockets"))
@@ -56,3 +56,8 @@ SESSION_MAX_AGE = 0
 # Allow (restricted) anonymous access to the system.  Only supported if
 # AUTHENTICATION_MODE="critic" and SESSION_TYPE="cookie".
 ALLOW_ANONYMOUS_USER = %(installation.config.allow_anonymous_user)r
+
+# Read git objects directly from repositories' pack files and loose objects,
+# instead of via 'git cat-file' child processes.  Objects that can't be read
+# directly are still read via 'git cat-file'.
+READ_GIT_OBJECTS_DIRECTLY = True
@@ -31,3 +31,14 @@ PUSH_COMMIT_LIMIT = 10000
 # For branches containing more commits than this, fall back to simpler
 # branch log rendering for performance reasons.
 MAXIMUM_REACHABLE_COMMITS = 4000
+
+# Budgets, in bytes, for the shared git object cache.  The memory budget
+# applies to each WSGI process and background service separately; the disk
+# budget applies to the cache directory (paths.OBJECT_CACHE_DIR) shared by all
+# of them; the changeset service trims the cache hourly, and processes stop
+# adding to it when it's full in between.  Objects larger than
+# OBJECT_CACHE_MAXIMUM_OBJECT_SIZE are never cached.  Set a budget to zero to
+# disable that part of the cache.
+OBJECT_CACHE_MEMORY_BUDGET = 64 * 1024 ** 2
+OBJECT_CACHE_DISK_BUDGET = 4 * 1024 ** 3
+OBJECT_CACHE_MAXIMUM_OBJECT_SIZE = 8 * 1024 ** 2
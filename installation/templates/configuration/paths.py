@@ -31,6 +31,9 @@ DATA_DIR = "%(installation.paths.data_dir)s"
 # are stored.
 CACHE_DIR = os.path.join("%(installation.paths.cache_dir)s", configuration.base.SYSTEM_IDENTITY)
 
+# Directory in which the shared git object cache is stored.
+OBJECT_CACHE_DIR = os.path.join(CACHE_DIR, "objects")
+
 # Directory in which log files are stored.
 LOG_DIR = os.path.join("%(installation.paths.log_dir)s", configuration.base.SYSTEM_IDENTITY)
 
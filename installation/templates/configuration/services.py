@@ -38,6 +38,7 @@ GITHOOK           = service(name="githook")
 BRANCHTRACKER     = service(name="branchtracker",     address=None)
 BRANCHTRACKERHOOK = service(name="branchtrackerhook", address=(configuration.base.HOSTNAME, 9999))
 MAILDELIVERY      = service(name="maildelivery",      address=None)
+REVIEWUPDATER     = service(name="reviewupdater",     address=None)
 WATCHDOG          = service(name="watchdog",          address=None)
 SERVICEMANAGER    = service(name="servicemanager")
 
@@ -46,10 +47,28 @@ HIGHLIGHT["min_context_length"] = 5
 HIGHLIGHT["max_context_length"] = 256
 HIGHLIGHT["max_workers"] = 4
 HIGHLIGHT["compact_at"] = (3, 15)
+HIGHLIGHT["worker_pool"] = True
+HIGHLIGHT["worker_max_jobs"] = 1000
+HIGHLIGHT["worker_max_rss"] = 256 * 1024 ** 2
+HIGHLIGHT["max_batch_size"] = 32
+# Files with at least this many lines are only highlighted around the lines
+# being displayed (with this many lines of context), on demand.
+HIGHLIGHT["window_min_lines"] = 20000
+HIGHLIGHT["window_context"] = 100
+HIGHLIGHT["priority_aging"] = 60
+HIGHLIGHT["max_jobs_per_repository"] = 3
 
 CHANGESET["max_workers"] = 4
 CHANGESET["rss_limit"] = 1024 ** 3
 CHANGESET["purge_at"] = (2, 15)
+CHANGESET["trim_object_cache_at"] = 45
+CHANGESET["worker_pool"] = True
+CHANGESET["worker_max_jobs"] = 100
+CHANGESET["worker_max_rss"] = 512 * 1024 ** 2
+CHANGESET["priority_aging"] = 60
+CHANGESET["max_jobs_per_repository"] = 3
+CHANGESET["analysis_processes"] = 8
+CHANGESET["analysis_min_lines"] = 200
 
 WATCHDOG["rss_soft_limit"] = 1024 ** 3
 WATCHDOG["rss_hard_limit"] = 2 * WATCHDOG["rss_soft_limit"]
@@ -60,4 +79,5 @@ SERVICEMANAGER["services"] = [HIGHLIGHT,
                               BRANCHTRACKER,
                               BRANCHTRACKERHOOK,
                               MAILDELIVERY,
+                              REVIEWUPDATER,
                               WATCHDOG]
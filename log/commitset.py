@@ -88,12 +88,11 @@ the latest one."""
 
             eliminated = set()
             for other in candidates:
-                base = repository.mergebase([tail, other])
-                if base == tail:
+                if repository.isAncestor(tail, other):
                     # Tail is an ancestor of other: tail should not be included
                     # in the returned set.
                     break
-                elif base == other:
+                elif repository.isAncestor(other, tail):
                     # Other is an ancestor of tail: other should not be included
                     # in the returned set.
                     eliminated.add(other)
@@ -251,6 +250,13 @@ have no common ancestor within this set."""
         if from_commit == to_commit:
             return CommitSet([to_commit])
 
+        if not commits:
+            # Prefetch all commit objects in the range in one go, so that the
+            # walk below finds them all in the repository's object cache.
+            # Using --ancestry-path keeps this from listing lots of unrelated
+            # commits if 'from_commit' turns out not to be an ancestor.
+            repository.fetchMany(repository.revlist([to_commit], [from_commit], "--ancestry-path"))
+
         try:
             process(to_commit)
             return CommitSet(commits)
@@ -0,0 +1,209 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Benchmark diff.analyze.analyzeChunk1() against the previous implementation,
+# which compared every deleted line with every inserted line, and check that
+# they produce the same results.
+#
+# Chunks are made from runs of lines in the given source files (by default the
+# Python files in the diff/ directory) by editing, dropping and adding lines at
+# random.
+#
+# Usage: python maintenance/benchmark-analyze.py [SOURCE-FILE ...]
+
+import sys
+import os
+import os.path
+import time
+import random
+import difflib
+import glob
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
+
+import diff.analyze
+
+from diff.analyze import re_ignore, re_words, re_ws, re_conflict, analyzeWhiteSpaceLine, offsetInLine
+
+def referenceAnalyzeChunk1(deletedLines, insertedLines, offsetA=0, offsetB=0):
+    # The previous implementation of diff.analyze.analyzeChunk1(), without the
+    # size limit.
+    matches = []
+    equals = []
+
+    def ratio(sm, a, b, aLength, bLength):
+        matching = 0
+        for i, j, n in sm.get_matching_blocks():
+            matching += sum(map(len, map(str.strip, a[i:i+n])))
+        if aLength > 5 and len(sm.get_matching_blocks()) == 2:
+            return float(matching) / aLength
+        else:
+            return 2.0 * matching / (aLength + bLength)
+
+    for deletedIndex, deleted in enumerate(deletedLines):
+        deletedStripped = deleted.strip()
+        deletedNoWS = re_ws.sub("", deletedStripped)
+
+        if re_conflict.match(deleted): continue
+
+        if not re_ignore.match(deleted):
+            deletedWords = re_words.findall(deleted)
+
+            for insertedIndex, inserted in enumerate(insertedLines):
+                insertedStripped = inserted.strip()
+                insertedNoWS = re_ws.sub("", insertedStripped)
+
+                if not re_ignore.match(inserted):
+                    insertedWords = re_words.findall(inserted)
+                    sm = difflib.SequenceMatcher(None, deletedWords, insertedWords)
+                    r = ratio(sm, deletedWords, insertedWords, len(deletedNoWS), len(insertedNoWS))
+                    if r > 0.5: matches.append((r, deletedIndex, insertedIndex, deletedWords, insertedWords, sm))
+                elif deletedStripped == insertedStripped:
+                    equals.append((deletedIndex, insertedIndex))
+        else:
+            for insertedIndex, inserted in enumerate(insertedLines):
+                if deletedStripped == inserted.strip():
+                    equals.append((deletedIndex, insertedIndex))
+
+    if matches:
+        matches.sort(key=lambda x: x[0], reverse=True)
+
+        final = []
+
+        while matches:
+            r, deletedIndex, insertedIndex, deletedWords, insertedWords, sm = matches.pop(0)
+            final.append((deletedIndex, insertedIndex, deletedWords, insertedWords, sm))
+            matches = filter(lambda data: data[1] != deletedIndex and data[2] != insertedIndex and (data[1] < deletedIndex) == (data[2] < insertedIndex), matches)
+            equals = filter(lambda data: (data[0] < deletedIndex) == (data[1] < insertedIndex), equals)
+
+        final.sort()
+        equals.sort()
+        result = []
+
+        previousDeletedIndex = -1
+        previousInsertedIndex = -1
+
+        final.append((len(deletedLines), len(insertedLines), None, None, None))
+
+        for deletedIndex, insertedIndex, deletedWords, insertedWords, sm in final:
+            while equals and (equals[0][0] < deletedIndex or equals[0][1] < insertedIndex):
+                di, ii = equals.pop(0)
+                if previousDeletedIndex < di < deletedIndex and previousInsertedIndex < ii < insertedIndex:
+                    deletedLine = deletedLines[di]
+                    insertedLine = insertedLines[ii]
+                    lineDiff = analyzeWhiteSpaceLine(deletedLine, insertedLine)
+                    if lineDiff: result.append("%d=%d:ws,%s" % (di + offsetA, ii + offsetB, lineDiff))
+                    else: result.append("%d=%d" % (di + offsetA, ii + offsetB))
+                    previousDeletedIndex = di
+                    previousInsertedIndex = ii
+                while equals and (di == equals[0][0] or ii == equals[0][1]): equals.pop(0)
+
+            if sm is None: break
+
+            lineDiff = []
+            deletedLine = deletedLines[deletedIndex]
+            insertedLine = insertedLines[insertedIndex]
+            if deletedLine != insertedLine and deletedLine.strip() == insertedLine.strip():
+                lineDiff.append("ws")
+                lineDiff.append(analyzeWhiteSpaceLine(deletedLine, insertedLine))
+            else:
+                for tag, i1, i2, j1, j2 in sm.get_opcodes():
+                    if tag == 'replace': lineDiff.append("r%d-%d=%d-%d" % (offsetInLine(deletedWords, i1), offsetInLine(deletedWords, i2), offsetInLine(insertedWords, j1), offsetInLine(insertedWords, j2)))
+                    elif tag == 'delete': lineDiff.append("d%d-%d" % (offsetInLine(deletedWords, i1), offsetInLine(deletedWords, i2)))
+                    elif tag == 'insert': lineDiff.append("i%d-%d" % (offsetInLine(insertedWords, j1), offsetInLine(insertedWords, j2)))
+            if lineDiff:
+                result.append("%d=%d:%s" % (deletedIndex + offsetA, insertedIndex + offsetB, ",".join(lineDiff)))
+            else:
+                result.append("%d=%d" % (deletedIndex + offsetA, insertedIndex + offsetB))
+
+            previousDeletedIndex = deletedIndex
+            previousInsertedIndex = insertedIndex
+
+        return ";".join(result)
+    elif deletedLines[-1] == insertedLines[-1]:
+        ndeleted = len(deletedLines)
+        ninserted = len(insertedLines)
+        result = []
+        index = 1
+
+        while index <= ndeleted and index <= ninserted and deletedLines[-index] == insertedLines[-index]:
+            result.append("%d=%d" % (ndeleted - index + offsetA, ninserted - index + offsetB))
+            index += 1
+
+        return ";".join(reversed(result))
+    else:
+        return ""
+
+def editLine(line):
+    words = re_words.findall(line)
+    if len(words) < 2: return line + " x"
+    for count in range(random.randint(1, 3)):
+        index = random.randrange(len(words))
+        if words[index].isspace(): continue
+        words[index] = random.choice(["value", "index", "(", ")", ".", "x", "result", "self"])
+    return "".join(words)
+
+def makeChunk(source, size):
+    start = random.randrange(max(1, len(source) - size))
+    deleted = source[start:start + size]
+    inserted = []
+
+    for line in deleted:
+        choice = random.random()
+        if choice < 0.4: inserted.append(editLine(line))
+        elif choice < 0.5: inserted.append("    " + line)
+        elif choice < 0.6: pass
+        elif choice < 0.7: inserted.extend([line, random.choice(source)])
+        else: inserted.append(line)
+
+    return deleted, inserted or ["x"]
+
+def measure(fn, chunks):
+    before = time.time()
+    results = [fn(deleted, inserted) for deleted, inserted in chunks]
+    return time.time() - before, results
+
+paths = sys.argv[1:] or glob.glob(os.path.join(os.path.dirname(sys.argv[0]), "..", "diff", "*.py"))
+source = []
+
+for path in paths:
+    source.extend(line.rstrip("\r\n") for line in open(path))
+
+random.seed(0)
+
+# Analyze chunks of all sizes, but within the usual number of comparisons.
+diff.analyze.MAXIMUM_CHUNK1_PAIRS = sys.maxint
+
+print "%8s %8s %12s %12s %9s  %s" % ("lines", "chunks", "previous", "current", "speed-up", "results")
+
+for size, count in [(10, 200), (25, 100), (50, 40), (100, 20), (200, 8), (400, 4), (800, 2)]:
+    chunks = [makeChunk(source, size) for index in range(count)]
+
+    current, current_results = measure(diff.analyze.analyzeChunk1, chunks)
+
+    # analyzeChunk1() returns None if it would need too many comparisons.
+    skipped = current_results.count(None)
+    if skipped: skipped = " (%d too expensive)" % skipped
+    else: skipped = ""
+
+    if size <= 400:
+        previous, previous_results = measure(referenceAnalyzeChunk1, chunks)
+        identical = all(current_result is None or current_result == previous_result
+                        for current_result, previous_result in zip(current_results, previous_results))
+        identical = "identical" if identical else "DIFFERENT"
+        print "%8d %8d %11.3fs %11.3fs %8.1fx  %s%s" % (size, count, previous, current, previous / current, identical, skipped)
+    else:
+        print "%8d %8d %12s %11.3fs %9s  %s" % (size, count, "-", current, "-", skipped.strip())
@@ -0,0 +1,213 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Benchmark syntaxhighlight.cpp.HighlightCPP against the previous
+# implementation, which tokenized the source into Token objects and found code
+# contexts in a separate grouping pass, and check that they produce the same
+# highlighted output and the same code contexts (line ranges included.)
+#
+# The source is one large translation unit made by concatenating the given
+# files (by default the C and C++ headers in /usr/include.)  Each file is also
+# checked on its own, since unbalanced brackets in one file affect the code
+# contexts found in the rest of a concatenation.
+#
+# Usage: python maintenance/benchmark-cpp.py [SOURCE-FILE ...]
+
+import sys
+import os
+import os.path
+import time
+import glob
+import cStringIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
+
+import htmlutils
+import configuration
+import syntaxhighlight.cpp
+import syntaxhighlight.clexer as clexer
+
+MIN_CONTEXT_LENGTH = configuration.services.HIGHLIGHT["min_context_length"]
+
+class ReferenceHighlightCPP:
+    def highlightToken(self, token):
+        if token.iskeyword():
+            self.output.write("<b class='kw'>" + str(token) + "</b>")
+        elif token.isidentifier():
+            self.output.write("<b class='id'>" + str(token) + "</b>")
+        elif token.iscomment():
+            if str(token)[0:2] == "/*":
+                lines = str(token).splitlines()
+                self.output.write("\n".join(["<b class='com'>" + htmlutils.htmlify(line) + "</b>" for line in lines]))
+            else:
+                self.output.write("<b class='com'>" + htmlutils.htmlify(token) + "</b>")
+        elif token.isppdirective():
+            lines = str(token).split("\n")
+            self.output.write("\n".join(["<b class='pp'>" + htmlutils.htmlify(line) + "</b>" for line in lines]))
+        elif token.isspace():
+            self.output.write(str(token))
+        elif token.isconflictmarker():
+            self.output.write(htmlutils.htmlify(token))
+        else:
+            if str(token)[0] == '"':
+                self.output.write("<b class='str'>" + htmlutils.htmlify(token) + "</b>")
+            elif str(token)[0] == "'":
+                self.output.write("<b class='ch'>" + htmlutils.htmlify(token) + "</b>")
+            elif token.isfloat():
+                self.output.write("<b class='fp'>" + str(token) + "</b>")
+            elif token.isint():
+                self.output.write("<b class='int'>" + str(token) + "</b>")
+            else:
+                self.output.write("<b class='op'>" + htmlutils.htmlify(token) + "</b>")
+
+    def outputContext(self, tokens, terminator):
+        if self.contexts is None: return
+
+        def spaceBetween(first, second):
+            # Never insert spaces around the :: operator.
+            if first == '::' or second == '::':
+                return False
+
+            # Always a space after a comma.
+            if first == ',':
+                return True
+
+            # Always a space before a keyword or identifier, unless preceded by *, & or (.
+            if second.iskeyword() or second.isidentifier():
+                return str(first) not in ('*', '&', '(')
+
+            # Always a space before a * or &, unless preceded by (another) *.
+            if (second == '*' or second == '&') and first != '*':
+                return True
+
+            # Always spaces around equal signs.
+            if first == '=' or second == '=':
+                return True
+
+            # No spaces between by default.
+            return False
+
+        first_line = tokens[-1].line() + 1
+        last_line = terminator.line()
+
+        if last_line - first_line >= MIN_CONTEXT_LENGTH:
+            previous = tokens[0]
+            context = str(previous)
+
+            for token in tokens[1:]:
+                if token.isspace() or token.iscomment(): continue
+                if spaceBetween(previous, token): context += " "
+                context += str(token)
+                previous = token
+
+            self.contexts.append((first_line, last_line, context))
+
+    def processTokens(self, tokens):
+        currentContexts = []
+        nextContext = []
+        nextContextClosed = False
+        level = 0
+
+        for token in tokens:
+            self.highlightToken(token)
+
+            if token.isspace() or token.iscomment() or token.isppdirective() or token.isconflictmarker():
+                pass
+            elif token.iskeyword():
+                if str(token) in ("if", "else", "for", "while", "do", "switch", "return", "break", "continue"):
+                    nextContext = None
+                    nextContextClosed = True
+                elif not nextContextClosed:
+                    nextContext.append(token)
+            elif token.isidentifier():
+                if not nextContextClosed:
+                    nextContext.append(token)
+            elif token == '{':
+                if nextContext:
+                    currentContexts.append([nextContext, level])
+                    nextContext = []
+                    nextContextClosed = False
+                level += 1
+            elif token == '}':
+                level -= 1
+                if currentContexts and currentContexts[-1][1] == level:
+                    thisContext = currentContexts.pop()
+                    self.outputContext(thisContext[0], token)
+                nextContext = []
+                nextContextClosed = False
+            elif nextContext:
+                if token == ',' and not nextContextClosed:
+                    nextContext = None
+                    nextContextClosed = True
+                elif token == ':':
+                    nextContextClosed = True
+                elif token == ';':
+                    nextContext = []
+                    nextContextClosed = False
+                elif token == '(':
+                    if not nextContextClosed:
+                        nextContext.append(token)
+                        try:
+                            group, token = clexer.group1(tokens, ')')
+                            group = list(clexer.flatten(group)) + [token]
+                            nextContext.extend(group)
+                            for token in group: self.highlightToken(token)
+                        except clexer.CLexerGroupingException, error:
+                            for token in error.tokens(): self.highlightToken(token)
+                            nextContext = []
+                            nextContextClosed = False
+                elif not nextContextClosed:
+                    nextContext.append(token)
+
+    def __call__(self, source, output, contexts):
+        self.output = output
+        self.contexts = contexts
+        self.processTokens(clexer.tokenize(clexer.split(source)))
+
+def highlight(highlighter, source):
+    output = cStringIO.StringIO()
+    contexts = []
+    before = time.time()
+    highlighter(source, output, contexts)
+    elapsed = time.time() - before
+    return elapsed, output.getvalue(), contexts
+
+paths = sys.argv[1:] or sorted(glob.glob("/usr/include/*.h") +
+                               glob.glob("/usr/include/*/*.h") +
+                               glob.glob("/usr/include/c++/*/bits/*"))
+sources = [open(path).read() for path in paths if os.path.isfile(path)]
+
+different = 0
+
+for path, source in zip(paths, sources):
+    if highlight(ReferenceHighlightCPP(), source)[1:] != highlight(syntaxhighlight.cpp.HighlightCPP(), source)[1:]:
+        print "DIFFERENT: %s" % path
+        different += 1
+
+print "%d files checked individually, %d different" % (len(sources), different)
+
+source = "".join(sources)
+
+previous, previous_output, previous_contexts = highlight(ReferenceHighlightCPP(), source)
+current, current_output, current_contexts = highlight(syntaxhighlight.cpp.HighlightCPP(), source)
+
+print "%8s %8s %10s %12s %12s %9s  %s" % ("size", "lines", "contexts", "previous", "current", "speed-up", "results")
+
+identical = previous_output == current_output and previous_contexts == current_contexts
+identical = "identical" if identical else "DIFFERENT"
+
+print "%7.2fM %8d %10d %11.3fs %11.3fs %8.1fx  %s" % (len(source) / 1024.0 ** 2, source.count("\n"), len(current_contexts),
+                                                     previous, current, previous / current, identical)
@@ -0,0 +1,86 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Benchmark reading git objects via 'git cat-file --batch' (the
+# Repository.fetch() path) against reading them directly from pack files and
+# loose objects using gitreader.ObjectReader.
+#
+# Usage: python maintenance/benchmark-fetch.py REPOSITORY-PATH [MAX-OBJECTS]
+
+import sys
+import os
+import os.path
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
+
+import configuration
+import gitutils
+import gitreader
+
+if len(sys.argv) < 2:
+    print "Usage: %s REPOSITORY-PATH [MAX-OBJECTS]" % sys.argv[0]
+    sys.exit(1)
+
+repository_path = sys.argv[1]
+max_objects = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+def listObjects():
+    repository = gitutils.Repository(path=repository_path)
+    output = repository.run("rev-list", "--objects", "--all")
+    return [line[:40] for line in output.splitlines()][:max_objects]
+
+def benchmark(label, fn, sha1s):
+    before = time.time()
+    nbytes = fn(sha1s)
+    duration = time.time() - before
+    print "%-24s %8d objects %10.3f s %10.1f objects/s %8.1f MB/s" % (label, len(sha1s), duration, len(sha1s) / duration, nbytes / duration / 1024 ** 2)
+    return duration
+
+def fetchViaCatFile(sha1s):
+    configuration.base.READ_GIT_OBJECTS_DIRECTLY = False
+    repository = gitutils.Repository(path=repository_path)
+    repository.disableCache()
+    return sum(len(repository.fetch(sha1).data) for sha1 in sha1s)
+
+def fetchManyViaCatFile(sha1s):
+    configuration.base.READ_GIT_OBJECTS_DIRECTLY = False
+    repository = gitutils.Repository(path=repository_path)
+    repository.disableCache()
+    return sum(len(git_object.data) for git_object in repository.fetchMany(sha1s))
+
+def readDirectly(sha1s):
+    reader = gitreader.ObjectReader(repository_path)
+    nbytes = 0
+    for sha1 in sha1s:
+        result = reader.read(sha1)
+        if result is None:
+            raise Exception, "%s: not read directly" % sha1
+        nbytes += result[1]
+    reader.close()
+    return nbytes
+
+sha1s = listObjects()
+
+print "Benchmarking %d objects from %s" % (len(sha1s), repository_path)
+print
+
+baseline = benchmark("fetch() via cat-file", fetchViaCatFile, sha1s)
+benchmark("fetchMany() via cat-file", fetchManyViaCatFile, sha1s)
+direct = benchmark("ObjectReader.read()", readDirectly, sha1s)
+
+print
+print "Speed-up of direct reading: %.2fx" % (baseline / direct)
@@ -0,0 +1,87 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Measure the throughput of the syntax highlighters, in MB/s of source per
+# language, so that changes to the highlighters and lexers can be compared.
+#
+# Each language is highlighted from the given files, or by default from files
+# in this source tree (and, for C++, headers in /usr/include.)  The files are
+# highlighted one at a time, as the highlight service does, and the best of
+# several rounds is reported.
+#
+# Usage: python maintenance/benchmark-highlight.py [LANGUAGE=FILE[,FILE...] ...]
+
+import sys
+import os
+import os.path
+import time
+import glob
+import cStringIO
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), ".."))
+
+sys.path.insert(0, root_dir)
+
+import syntaxhighlight.generate
+
+ROUNDS = 3
+
+def defaultFiles():
+    return { "python": glob.glob(os.path.join(root_dir, "*", "*.py")),
+             "javascript": glob.glob(os.path.join(root_dir, "resources", "*.js")),
+             "sql": glob.glob(os.path.join(root_dir, "*.sql")),
+             "c++": sorted(glob.glob("/usr/include/*.h"))[:200] }
+
+def measure(highlighter, sources):
+    best = None
+
+    for index in range(ROUNDS):
+        before = time.time()
+        for source in sources:
+            highlighter(source, cStringIO.StringIO(), None)
+        elapsed = time.time() - before
+
+        if best is None or elapsed < best: best = elapsed
+
+    return best
+
+if sys.argv[1:]:
+    files = {}
+    for argument in sys.argv[1:]:
+        language, _, paths = argument.partition("=")
+        files.setdefault(language, []).extend(paths.split(","))
+else:
+    files = defaultFiles()
+
+print "%-12s %8s %10s %10s %10s" % ("language", "files", "size", "time", "MB/s")
+
+for language in sorted(files):
+    highlighter = syntaxhighlight.generate.createHighlighter(language)
+
+    if not highlighter:
+        print "%-12s unsupported language" % language
+        continue
+
+    sources = [open(path).read() for path in files[language]]
+    size = sum(map(len, sources))
+
+    if not size:
+        print "%-12s no input" % language
+        continue
+
+    elapsed = measure(highlighter, sources)
+
+    print "%-12s %8d %9.2fM %9.3fs %10.2f" % (language, len(sources), size / 1024.0 ** 2, elapsed, size / 1024.0 ** 2 / elapsed)
@@ -49,7 +49,12 @@ cursor = db.cursor()
 
 def getBranchCommits(repository, branch_id):
     cursor = db.cursor()
-    cursor.execute("SELECT sha1 FROM commits JOIN reachable ON (commit=id) WHERE branch=%s", (branch_id,))
+    cursor.execute("""SELECT sha1
+                        FROM commits
+                        JOIN reachableranges ON (commits.id BETWEEN reachableranges.first_commit
+                                                                AND reachableranges.last_commit)
+                       WHERE branch=%s""",
+                   (branch_id,))
 
     return log.commitset.CommitSet(gitutils.Commit.fromSHA1(db, repository, sha1) for (sha1,) in cursor)
 
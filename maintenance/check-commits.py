@@ -82,8 +82,10 @@ for repository_id in repositories:
     repository = gitutils.Repository.fromId(db, repository_id)
     repository.disableCache()
 
-    cursor.execute("SELECT commit FROM reachable JOIN branches ON (branch=id) WHERE repository=%s", (repository.id,))
-    process_commits = set(commit_id for (commit_id,) in cursor if commit_id in pending_commits)
+    cursor.execute("SELECT id FROM branches WHERE repository=%s", (repository.id,))
+    process_commits = set()
+    for branch_id in [branch_id for (branch_id,) in cursor]:
+        process_commits.update(commit_id for commit_id in dbutils.reachable.getCommitIds(db, branch_id) if commit_id in pending_commits)
 
     progress.start(len(process_commits), "Scanning repository: %-*s" % (repository_name_length, repository.name))
 
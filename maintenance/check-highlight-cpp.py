@@ -0,0 +1,140 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Check syntaxhighlight.cpp.HighlightCPP against fixed expected output: the
+# highlighted HTML and the code contexts found, for a few small sources that
+# cover each kind of token and the ways declarations preceding blocks are
+# recognized (or not.)
+#
+# Usage: python maintenance/check-highlight-cpp.py
+
+import sys
+import os
+import os.path
+import cStringIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
+
+import configuration
+import syntaxhighlight.cpp
+
+# The expected contexts assume the default minimum context length.
+configuration.services.HIGHLIGHT["min_context_length"] = 5
+
+FIXTURES = []
+
+FIXTURES.append(("""\
+#include <vector>
+// A comment with <html> & stuff
+namespace ns {
+struct Foo : Bar
+{
+    int get(const char *name, int &count) const
+    {
+        if (count > 0)
+        {
+            return name[0] == 'x';
+        }
+        /* multi
+           line */
+        return ::strlen("a<b");
+    }
+};
+}
+""",
+"""\
+<b class='pp'>#include &lt;vector&gt;</b>
+<b class='com'>// A comment with &lt;html&gt; &amp; stuff</b>
+<b class='kw'>namespace</b> <b class='id'>ns</b> <b class='op'>{</b>
+<b class='kw'>struct</b> <b class='id'>Foo</b> <b class='op'>:</b> <b class='id'>Bar</b>
+<b class='op'>{</b>
+    <b class='kw'>int</b> <b class='id'>get</b><b class='op'>(</b><b class='kw'>const</b> <b class='kw'>char</b> <b class='op'>*</b><b class='id'>name</b><b class='op'>,</b> <b class='kw'>int</b> <b class='op'>&amp;</b><b class='id'>count</b><b class='op'>)</b> <b class='kw'>const</b>
+    <b class='op'>{</b>
+        <b class='kw'>if</b> <b class='op'>(</b><b class='id'>count</b> <b class='op'>&gt;</b> <b class='int'>0</b><b class='op'>)</b>
+        <b class='op'>{</b>
+            <b class='kw'>return</b> <b class='id'>name</b><b class='op'>[</b><b class='int'>0</b><b class='op'>]</b> <b class='op'>==</b> <b class='ch'>'x'</b><b class='op'>;</b>
+        <b class='op'>}</b>
+        <b class='com'>/* multi</b>
+<b class='com'>           line */</b>
+        <b class='kw'>return</b> <b class='op'>::</b><b class='id'>strlen</b><b class='op'>(</b><b class='str'>"a&lt;b"</b><b class='op'>)</b><b class='op'>;</b>
+    <b class='op'>}</b>
+<b class='op'>}</b><b class='op'>;</b>
+<b class='op'>}</b>
+""",
+[(7, 15, 'int get(const char *name, int &count) const'),
+  (5, 16, 'struct Foo'),
+  (4, 17, 'namespace ns')]))
+
+FIXTURES.append(("""\
+<<<<<<< HEAD
+static int x = 08;
+=======
+void f() { g(); }
+>>>>>>> other
+template <typename T>
+std::vector<T> copy(const std::vector<T> &v,
+                    int n)
+{
+    std::vector<T> result(v);
+    result.resize(n);
+    puts("unterminated);
+    return result;
+}
+""",
+"""\
+&lt;&lt;&lt;&lt;&lt;&lt;&lt; HEAD
+<b class='kw'>static</b> <b class='kw'>int</b> <b class='id'>x</b> <b class='op'>=</b> <b class='int'>0</b><b class='int'>8</b><b class='op'>;</b>
+=======
+<b class='kw'>void</b> <b class='id'>f</b><b class='op'>(</b><b class='op'>)</b> <b class='op'>{</b> <b class='id'>g</b><b class='op'>(</b><b class='op'>)</b><b class='op'>;</b> <b class='op'>}</b>
+&gt;&gt;&gt;&gt;&gt;&gt;&gt; other
+<b class='kw'>template</b> <b class='op'>&lt;</b><b class='kw'>typename</b> <b class='id'>T</b><b class='op'>&gt;</b>
+<b class='id'>std</b><b class='op'>::</b><b class='id'>vector</b><b class='op'>&lt;</b><b class='id'>T</b><b class='op'>&gt;</b> <b class='id'>copy</b><b class='op'>(</b><b class='kw'>const</b> <b class='id'>std</b><b class='op'>::</b><b class='id'>vector</b><b class='op'>&lt;</b><b class='id'>T</b><b class='op'>&gt;</b> <b class='op'>&amp;</b><b class='id'>v</b><b class='op'>,</b>
+                    <b class='kw'>int</b> <b class='id'>n</b><b class='op'>)</b>
+<b class='op'>{</b>
+    <b class='id'>std</b><b class='op'>::</b><b class='id'>vector</b><b class='op'>&lt;</b><b class='id'>T</b><b class='op'>&gt;</b> <b class='id'>result</b><b class='op'>(</b><b class='id'>v</b><b class='op'>)</b><b class='op'>;</b>
+    <b class='id'>result</b><b class='op'>.</b><b class='id'>resize</b><b class='op'>(</b><b class='id'>n</b><b class='op'>)</b><b class='op'>;</b>
+    <b class='id'>puts</b><b class='op'>(</b><b class='str'>"</b><b class='id'>unterminated</b><b class='op'>)</b><b class='op'>;</b>
+    <b class='kw'>return</b> <b class='id'>result</b><b class='op'>;</b>
+<b class='op'>}</b>
+""",
+[(9, 14, 'template< typename T> std::vector< T> copy(const std::vector< T> &v, int n)')]))
+
+failures = 0
+
+for index, (source, expected_html, expected_contexts) in enumerate(FIXTURES):
+    output = cStringIO.StringIO()
+    contexts = []
+
+    syntaxhighlight.cpp.HighlightCPP()(source, output, contexts)
+
+    if output.getvalue() != expected_html:
+        failures += 1
+        print "fixture %d: unexpected HTML:" % index
+        for line, expected_line in zip(output.getvalue().splitlines(), expected_html.splitlines()):
+            if line != expected_line:
+                print "  expected: %s\n  actual:   %s" % (expected_line, line)
+                break
+        else:
+            print "  (line count differs)"
+
+    if contexts != expected_contexts:
+        failures += 1
+        print "fixture %d: unexpected contexts:\n  expected: %r\n  actual:   %r" % (index, expected_contexts, contexts)
+
+if failures:
+    sys.exit(1)
+
+print "%d fixtures OK" % len(FIXTURES)
@@ -17,6 +17,7 @@
 import gitutils
 import htmlutils
 import diff
+import syntaxhighlight
 
 from operation import Operation, OperationResult
 
@@ -49,8 +50,13 @@ class FetchLines(Operation):
             if row: return row[0]
             else: return None
 
+        if any(line_range["count"] == -1 for line_range in ranges):
+            windows = None
+        else:
+            windows = syntaxhighlight.getWindows([(line_range["offset"], line_range["count"]) for line_range in ranges])
+
         file = diff.File(repository=repository, path=path, new_sha1=sha1)
-        file.loadNewLines(highlighted=True, request_highlight=True)
+        file.loadNewLines(highlighted=True, request_highlight=True, windows=windows)
 
         if tabify:
             tabwidth = file.getTabWidth()
@@ -18,9 +18,10 @@ import dbutils
 import gitutils
 
 import reviewing.mail as review_mail
+import reviewing.utils as review_utils
 import mailutils
 
-from operation import Operation, OperationResult, OperationError, Optional
+from operation import Operation, OperationResult, OperationError, OperationFailure, Optional
 
 class CloseReview(Operation):
     def __init__(self):
@@ -138,3 +139,26 @@ class UpdateReview(Operation):
         db.commit()
 
         return OperationResult()
+
+class RetryReviewUpdates(Operation):
+    def __init__(self):
+        Operation.__init__(self, { "review_id": int })
+
+    def process(self, db, user, review_id):
+        review = dbutils.Review.fromId(db, review_id)
+
+        if user not in review.owners and not user.hasRole(db, "administrator"):
+            raise OperationFailure(code="notallowed", title="Not allowed!", message="Only the review's owners or a system administrator can retry failed updates.")
+
+        cursor = db.cursor()
+        cursor.execute("""UPDATE reviewupdates
+                             SET error=NULL
+                           WHERE review=%s
+                             AND error IS NOT NULL""",
+                       (review.id,))
+
+        db.commit()
+
+        review_utils.wakeReviewUpdater()
+
+        return OperationResult()
@@ -181,10 +181,9 @@ class RevertRebase(Operation):
         cursor.execute("SELECT old_head, new_head, new_upstream FROM reviewrebases WHERE id=%s", (rebase_id,))
         old_head_id, new_head_id, new_upstream_id = cursor.fetchone()
 
-        cursor.execute("SELECT commit FROM previousreachable WHERE rebase=%s", (rebase_id,))
-        reachable = [commit_id for (commit_id,) in cursor]
+        cursor.execute("SELECT 1 FROM previousreachableranges WHERE rebase=%s", (rebase_id,))
 
-        if not reachable:
+        if not cursor.fetchone():
             # Fail if rebase was done before the 'previousreachable' table was
             # added, and we thus don't know what commits the branch contained
             # before the rebase.
@@ -196,8 +195,7 @@ class RevertRebase(Operation):
         old_head = gitutils.Commit.fromId(db, review.repository, old_head_id)
         new_head = gitutils.Commit.fromId(db, review.repository, new_head_id)
 
-        cursor.execute("DELETE FROM reachable WHERE branch=%s", (review.branch.id,))
-        cursor.executemany("INSERT INTO reachable (branch, commit) VALUES (%s, %s)", [(review.branch.id, commit_id) for commit_id in reachable])
+        dbutils.reachable.restorePrevious(db, rebase_id, review.branch.id)
 
         if new_upstream_id:
             new_upstream = gitutils.Commit.fromId(db, review.repository, new_upstream_id)
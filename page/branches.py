@@ -55,12 +55,14 @@ def render(db, target, title, repository, branches, linkToBranch=linkToBranch, e
 
         if isinstance(branches[0], int) or isinstance(branches[0], long):
             for branch_id in branches:
-                cursor.execute("SELECT branches.name, branches.review, bases.name, count(reachable.branch) FROM branches LEFT OUTER JOIN branches AS bases ON (branches.base=bases.id) LEFT OUTER JOIN reachable ON (branches.id=reachable.branch) WHERE branches.id=%s GROUP BY branches.name, branches.review, bases.name", [branch_id])
-                values.append(cursor.fetchone())
+                cursor.execute("SELECT branches.id, branches.name, branches.review, bases.name FROM branches LEFT OUTER JOIN branches AS bases ON (branches.base=bases.id) WHERE branches.id=%s", [branch_id])
+                branch_id, name, review_id, base = cursor.fetchone()
+                values.append((name, review_id, base, dbutils.reachable.countCommits(db, branch_id)))
         else:
             for branch_name in branches:
-                cursor.execute("SELECT branches.name, branches.review, bases.name, count(reachable.branch) FROM branches LEFT OUTER JOIN branches AS bases ON (branches.base=bases.id), reachable WHERE branches.name=%s AND branches.id=reachable.branch GROUP BY branches.name, branches.review, bases.name", [branch_name])
-                values.append(cursor.fetchone())
+                cursor.execute("SELECT branches.id, branches.name, branches.review, bases.name FROM branches LEFT OUTER JOIN branches AS bases ON (branches.base=bases.id) WHERE branches.name=%s", [branch_name])
+                branch_id, name, review_id, base = cursor.fetchone()
+                values.append((name, review_id, base, dbutils.reachable.countCommits(db, branch_id)))
 
         row = table.tr("headings")
         row.td("name").text("Name")
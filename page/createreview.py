@@ -246,13 +246,9 @@ def renderCreateReview(req, db, user):
             try: commit_ids = map(int, commits_arg.split(","))
             except: commit_sha1s = [repository.revparse(ref) for ref in commits_arg.split(",")]
         elif branch_name:
-            cursor.execute("""SELECT commit
-                                FROM reachable
-                                JOIN branches ON (branch=id)
-                               WHERE repository=%s
-                                 AND name=%s""",
-                           (repository.id, branch_name))
-            commit_ids = [commit_id for (commit_id,) in cursor]
+            branch = dbutils.Branch.fromName(db, repository, branch_name)
+            if branch: commit_ids = dbutils.reachable.getCommitIds(db, branch.id)
+            else: commit_ids = []
         else:
             return renderSelectSource(req, db, user)
 
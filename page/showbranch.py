@@ -105,15 +105,14 @@ def renderShowBranch(req, db, user):
                 select.option("base", value=name.split(" ")[0]).text(name)
 
         if not bases and branch.base:
-            cursor.execute("SELECT commit FROM reachable WHERE branch=%s", (branch.id,))
-
-            commit_ids = cursor.fetchall()
+            commit_ids = dbutils.reachable.getCommitIds(db, branch.id)
 
             body.comment(repr(commit_ids))
 
+            base_commit_ids = set(dbutils.reachable.getCommitIds(db, branch.base.id))
+
             for commit_id in commit_ids:
-                cursor.execute("SELECT 1 FROM reachable WHERE branch=%s AND commit=%s", (branch.base.id, commit_id))
-                if cursor.fetchone():
+                if commit_id in base_commit_ids:
                     bases.append("%s (trim)" % branch.base.name)
                     break
 
@@ -123,9 +122,7 @@ def renderShowBranch(req, db, user):
     target = body.div("main")
 
     if branch_type == 'normal':
-        cursor.execute("SELECT COUNT(*) FROM reachable WHERE branch=%s", (branch_id,))
-
-        commit_count = cursor.fetchone()[0]
+        commit_count = dbutils.reachable.countCommits(db, branch_id)
         if commit_count > configuration.limits.MAXIMUM_REACHABLE_COMMITS:
             offset = req.getParameter("offset", default=0, filter=int)
             limit = req.getParameter("limit", default=200, filter=int)
@@ -44,8 +44,9 @@ def renderCommitInfo(db, target, user, repository, review, commit, conflicts=Fal
     def outputBranches(target, commit):
         cursor.execute("""SELECT branches.name, reviews.id
                             FROM branches
-                            JOIN reachable ON (reachable.branch=branches.id)
-                            JOIN commits ON (commits.id=reachable.commit)
+                            JOIN reachableranges ON (reachableranges.branch=branches.id)
+                            JOIN commits ON (commits.id BETWEEN reachableranges.first_commit
+                                                            AND reachableranges.last_commit)
                  LEFT OUTER JOIN reviews ON (reviews.branch=branches.id)
                            WHERE branches.repository=%s
                              AND commits.sha1=%s""",
@@ -265,7 +265,8 @@ def renderShowReview(req, db, user):
         if has_finished_rebases:
             cursor.execute("""SELECT commits.sha1, commits.id
                                 FROM commits
-                                JOIN reachable ON (reachable.commit=commits.id)
+                                JOIN reachableranges ON (commits.id BETWEEN reachableranges.first_commit
+                                                                        AND reachableranges.last_commit)
                                WHERE branch=%s""",
                            (review.branch.id,))
 
@@ -745,6 +746,22 @@ def renderShowReview(req, db, user):
                 if user in review.owners:
                     progress.tr().td('pinging', colspan=3).span().text("Send a message to these users by pinging the review.")
 
+    cursor = db.cursor()
+    cursor.execute("""SELECT COUNT(DISTINCT reviewupdatecommits.commit), COUNT(reviewupdates.error)
+                        FROM reviewupdates
+                        JOIN reviewupdatecommits ON (reviewupdatecommits.reviewupdate=reviewupdates.id)
+                       WHERE reviewupdates.review=%s""",
+                   (review.id,))
+    queued_commits, failed_updates = cursor.fetchone()
+
+    if failed_updates:
+        progress.tr().td('failed', colspan=3).text("Processing of pushed commits failed!  The system administrator has been notified.")
+        if user in review.owners or user.hasRole(db, "administrator"):
+            progress.tr().td('failed', colspan=3).button(onclick="retryReviewUpdates();").text("Retry Processing")
+    elif queued_commits:
+        progress.tr().td('processing', colspan=3).text("%d pushed commit%s being processed; reload the page in a moment."
+                                                       % (queued_commits, " is" if queued_commits == 1 else "s are"))
+
     title_format = user.getPreference(db, 'ui.title.showReview')
 
     try:
@@ -850,12 +867,7 @@ def renderShowReview(req, db, user):
             bottom_right = renderPrepareRebase
 
         if finished_rebases:
-            cursor.execute("""SELECT commit
-                                FROM reachable
-                               WHERE branch=%s""",
-                           (review.branch.id,))
-
-            actual_commits = [gitutils.Commit.fromId(db, repository, commit_id) for (commit_id,) in cursor]
+            actual_commits = [gitutils.Commit.fromId(db, repository, commit_id) for commit_id in dbutils.reachable.getCommitIds(db, review.branch.id)]
         else:
             actual_commits = []
 
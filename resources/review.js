@@ -374,6 +374,16 @@ function reopenReview()
     location.reload();
 }
 
+function retryReviewUpdates()
+{
+  var operation = new Operation({ action: "retry processing of pushed commits",
+                                  url: "retryreviewupdates",
+                                  data: { review_id: review.id }});
+
+  if (operation.execute())
+    location.reload();
+}
+
 function pingReview()
 {
   function resize()
@@ -14,8 +14,12 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import os
+import signal
+
 import dbutils
 import gitutils
+import configuration
 from dbutils import *
 from itertools import izip, repeat, chain
 import htmlutils
@@ -186,7 +190,7 @@ def assignChanges(db, user, review, commits=None, changesets=None, update=False,
         changesets = []
 
         for commit in commits:
-            changesets.extend(changeset_utils.createChangeset(db, user, review.repository, commit))
+            changesets.extend(changeset_utils.createChangeset(db, user, review.repository, commit, priority="push"))
 
     applyfilters = review.applyfilters
     applyparentfilters = review.applyparentfilters
@@ -245,92 +249,117 @@ def assignChanges(db, user, review, commits=None, changesets=None, update=False,
     new_reviewers -= old_reviewers
     new_watchers -= old_reviewers | new_reviewers
 
-    cursor.executemany("INSERT INTO reviewusers (review, uid) VALUES (%s, %s)", reviewusers_values)
-    cursor.executemany("INSERT INTO reviewuserfiles (file, uid) SELECT id, %s FROM reviewfiles WHERE review=%s AND changeset=%s AND file=%s", reviewuserfiles_values)
+    if reviewusers_values:
+        db.bulkInsert("reviewusers", ("review", "uid"), reviewusers_values)
+    if reviewuserfiles_values:
+        db.bulkMerge((("uid", "INTEGER"), ("review", "INTEGER"), ("changeset", "INTEGER"), ("file", "INTEGER")), reviewuserfiles_values,
+                     """INSERT INTO reviewuserfiles (file, uid)
+                             SELECT reviewfiles.id, bulkrows.uid
+                               FROM bulkrows
+                               JOIN reviewfiles ON (reviewfiles.review=bulkrows.review
+                                                AND reviewfiles.changeset=bulkrows.changeset
+                                                AND reviewfiles.file=bulkrows.file)""")
 
     return new_reviewers, new_watchers
 
-def addCommitsToReview(db, user, review, commits, new_review=False, commitset=None, pending_mails=None, silent_if_empty=set(), full_merges=set(), tracked_branch=False):
-    cursor = db.cursor()
+def checkCommitsForReview(db, user, review, commits, commitset=None, tracked_branch=False):
+    """Check that 'commits' can be added to the existing review 'review', and
+       return the list of commits that should actually be added, along with a
+       CommitSet of them.  Raises index.IndexException if merges in 'commits'
+       add merged-in commits that haven't been confirmed."""
 
-    if not new_review:
-        import index
+    import index
 
-        new_commits = log_commitset.CommitSet(commits)
-        old_commits = log_commitset.CommitSet(review.branch.commits)
-        merges = new_commits.getMerges()
+    cursor = db.cursor()
+
+    new_commits = log_commitset.CommitSet(commits)
+    old_commits = log_commitset.CommitSet(review.branch.commits)
+    merges = new_commits.getMerges()
 
-        for merge in merges:
-            # We might have stripped it in a previous pass.
-            if not merge in new_commits: continue
+    for merge in merges:
+        # We might have stripped it in a previous pass.
+        if not merge in new_commits: continue
 
-            tails = filter(lambda sha1: sha1 not in old_commits and sha1 not in merge.parents, new_commits.getTailsFrom(merge))
+        tails = filter(lambda sha1: sha1 not in old_commits and sha1 not in merge.parents, new_commits.getTailsFrom(merge))
 
-            if tails:
-                if tracked_branch:
-                    raise index.IndexException, """\
+        if tails:
+            if tracked_branch:
+                raise index.IndexException, """\
 Merge %s adds merged-in commits.  Please push the merge manually
 and follow the instructions.""" % merge.sha1[:8]
 
-                cursor.execute("SELECT id, confirmed, tail FROM reviewmergeconfirmations WHERE review=%s AND uid=%s AND merge=%s", (review.id, user.id, merge.getId(db)))
+            cursor.execute("SELECT id, confirmed, tail FROM reviewmergeconfirmations WHERE review=%s AND uid=%s AND merge=%s", (review.id, user.id, merge.getId(db)))
 
-                row = cursor.fetchone()
+            row = cursor.fetchone()
 
-                if not row or not row[1]:
-                    if not row:
-                        cursor.execute("INSERT INTO reviewmergeconfirmations (review, uid, merge) VALUES (%s, %s, %s) RETURNING id", (review.id, user.id, merge.getId(db)))
-                        confirmation_id = cursor.fetchone()[0]
+            if not row or not row[1]:
+                if not row:
+                    cursor.execute("INSERT INTO reviewmergeconfirmations (review, uid, merge) VALUES (%s, %s, %s) RETURNING id", (review.id, user.id, merge.getId(db)))
+                    confirmation_id = cursor.fetchone()[0]
 
-                        merged = set()
+                    merged = set()
 
-                        for tail_sha1 in tails:
-                            children = new_commits.getChildren(tail_sha1)
+                    for tail_sha1 in tails:
+                        children = new_commits.getChildren(tail_sha1)
 
-                            while children:
-                                child = children.pop()
-                                if child not in merged and new_commits.isAncestorOf(child, merge):
-                                    merged.add(child)
-                                    children.update(new_commits.getChildren(child) - merged)
+                        while children:
+                            child = children.pop()
+                            if child not in merged and new_commits.isAncestorOf(child, merge):
+                                merged.add(child)
+                                children.update(new_commits.getChildren(child) - merged)
 
-                        merged_values = [(confirmation_id, commit.getId(db)) for commit in merged]
-                        cursor.executemany("INSERT INTO reviewmergecontributions (id, merged) VALUES (%s, %s)", merged_values)
-                        db.commit()
-                    else:
-                        confirmation_id = row[0]
+                    merged_values = [(confirmation_id, commit.getId(db)) for commit in merged]
+                    cursor.executemany("INSERT INTO reviewmergecontributions (id, merged) VALUES (%s, %s)", merged_values)
+                    db.commit()
+                else:
+                    confirmation_id = row[0]
 
-                    message = "Merge %s adds merged-in commits:" % merge.sha1[:8]
+                message = "Merge %s adds merged-in commits:" % merge.sha1[:8]
 
-                    for tail_sha1 in tails:
-                        for parent_sha1 in merge.parents:
-                            if parent_sha1 in new_commits:
-                                parent = new_commits.get(parent_sha1)
-                                if tail_sha1 in new_commits.getTailsFrom(parent):
-                                    message += "\n  %s..%s" % (tail_sha1[:8], parent_sha1[:8])
+                for tail_sha1 in tails:
+                    for parent_sha1 in merge.parents:
+                        if parent_sha1 in new_commits:
+                            parent = new_commits.get(parent_sha1)
+                            if tail_sha1 in new_commits.getTailsFrom(parent):
+                                message += "\n  %s..%s" % (tail_sha1[:8], parent_sha1[:8])
 
-                    message += """
+                message += """
 Please confirm that this is intended by loading:
   %s/confirmmerge?id=%d""" % (dbutils.getURLPrefix(db), confirmation_id)
 
-                    raise index.IndexException, message
-                elif row[2] is not None:
-                    if row[2] == merge.getId(db):
-                        cursor.execute("SELECT merged FROM reviewmergecontributions WHERE id=%s",
-                                       (row[0],))
-
-                        for (merged_id,) in cursor:
-                            merged = gitutils.Commit.fromId(db, review.repository, merged_id)
-                            if merged.sha1 in merge.parents:
-                                new_commits = new_commits.without([merged])
-                                break
-                    else:
-                        tail = gitutils.Commit.fromId(db, review.repository, row[2])
-                        cut = [gitutils.Commit.fromSHA1(db, review.repository, sha1)
-                               for sha1 in tail.parents if sha1 in new_commits]
-                        new_commits = new_commits.without(cut)
+                raise index.IndexException, message
+            elif row[2] is not None:
+                if row[2] == merge.getId(db):
+                    cursor.execute("SELECT merged FROM reviewmergecontributions WHERE id=%s",
+                                   (row[0],))
+
+                    for (merged_id,) in cursor:
+                        merged = gitutils.Commit.fromId(db, review.repository, merged_id)
+                        if merged.sha1 in merge.parents:
+                            new_commits = new_commits.without([merged])
+                            break
+                else:
+                    tail = gitutils.Commit.fromId(db, review.repository, row[2])
+                    cut = [gitutils.Commit.fromSHA1(db, review.repository, sha1)
+                           for sha1 in tail.parents if sha1 in new_commits]
+                    new_commits = new_commits.without(cut)
 
-        if commitset:
-            commitset &= set(new_commits)
-            commits = [commit for commit in commits if commit in commitset]
+    if commitset:
+        commitset &= set(new_commits)
+        commits = [commit for commit in commits if commit in commitset]
+
+    return commits, new_commits
+
+def addCommitsToReview(db, user, review, commits, new_review=False, commitset=None, pending_mails=None, silent_if_empty=set(), full_merges=set(), tracked_branch=False, checked=False):
+    cursor = db.cursor()
+
+    if not new_review:
+        if checked:
+            # Already filtered by checkCommitsForReview() (before the review
+            # branch was updated to include them.)
+            new_commits = log_commitset.CommitSet(commits)
+        else:
+            commits, new_commits = checkCommitsForReview(db, user, review, commits, commitset, tracked_branch)
 
     changesets = []
     silent_changesets = set()
@@ -343,8 +372,10 @@ Please confirm that this is intended by loading:
         changeset_utils.createChangesets(db, review.repository, simple_commits)
 
     for commit in commits:
-        if commit in full_merges: commit_changesets = changeset_utils.createFullMergeChangeset(db, user, review.repository, commit)
-        else: commit_changesets = changeset_utils.createChangeset(db, user, review.repository, commit)
+        # Highlighting is queued by pregenerateChangesets() below instead of
+        # being waited for here.
+        if commit in full_merges: commit_changesets = changeset_utils.createFullMergeChangeset(db, user, review.repository, commit, do_highlight=False, priority="push")
+        else: commit_changesets = changeset_utils.createChangeset(db, user, review.repository, commit, do_highlight=False, priority="push")
 
         if commit in silent_if_empty:
             for commit_changeset in commit_changesets:
@@ -355,6 +386,27 @@ Please confirm that this is intended by loading:
 
         changesets.extend(commit_changesets)
 
+    # Queue the squashed diffs that are most likely to be looked at next --
+    # of the added commits, as linked from the notification mails, and of the
+    # whole review, as displayed by the [pending]/[reviewable] links -- and
+    # highlighting of all touched files.  Those are all the blobs the squashed
+    # diffs can contain, since each is the old or new version of a file in
+    # one of the commits.
+    commitsets = [log_commitset.CommitSet(commits)]
+    if not new_review:
+        commitsets.append(log_commitset.CommitSet(list(review.branch.commits) + list(commits)))
+
+    squashed_ranges = []
+    for commitset in commitsets:
+        heads = commitset.getHeads()
+        tails = commitset.getFilteredTails(review.repository)
+        if len(heads) == 1 and len(tails) == 1:
+            squashed_range = (gitutils.Commit.fromSHA1(db, review.repository, tails.pop()), heads.pop())
+            if squashed_range not in squashed_ranges:
+                squashed_ranges.append(squashed_range)
+
+    changeset_utils.pregenerateChangesets(db, review.repository, squashed_ranges, changeset_utils.getHighlights(changesets))
+
     if not new_review:
         print "Adding %d commit%s to the review at:\n  %s" % (len(commits), len(commits) > 1 and "s" or "", review.getURL(db))
 
@@ -415,6 +467,82 @@ Please confirm that this is intended by loading:
 
     return True
 
+def queueReviewUpdate(db, review, user, old_head, new_head, commits, tracked_branch=False):
+    """Queue the addition of 'commits' to the review for the review updater
+       service.  The commits should be those returned by
+       checkCommitsForReview(), called before the review branch is updated;
+       they are added as-is, without being checked again.  Once the
+       transaction is committed, the service should be woken up using
+       wakeReviewUpdater()."""
+
+    cursor = db.cursor()
+    cursor.execute("""INSERT INTO reviewupdates (review, uid, old_head, new_head, tracked_branch)
+                           VALUES (%s, %s, %s, %s, %s)
+                        RETURNING id""",
+                   (review.id, user.id or None, old_head.getId(db), new_head.getId(db), tracked_branch or None))
+    update_id = cursor.fetchone()[0]
+
+    commit_ids = dbutils.reachable.getCommitIdsFromSHA1s(db, [commit.sha1 for commit in commits])
+    db.bulkInsert("reviewupdatecommits", ("reviewupdate", "commit"), [(update_id, commit_id) for commit_id in commit_ids])
+
+    return update_id
+
+def hasQueuedReviewUpdates(db, review):
+    cursor = db.cursor()
+    cursor.execute("SELECT 1 FROM reviewupdates WHERE review=%s", (review.id,))
+    return cursor.fetchone() is not None
+
+def wakeReviewUpdater():
+    try:
+        pid = int(open(configuration.services.REVIEWUPDATER["pidfile_path"]).read().strip())
+        os.kill(pid, signal.SIGHUP)
+    except:
+        pass
+
+def processReviewUpdate(db, update_id, output):
+    """Process an update queued by queueReviewUpdate(): add the commits to the
+       review and run extensions' ProcessCommits hooks, writing any output to
+       'output'.  The update is removed from the queue, but the transaction is
+       not committed."""
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT review, uid, old_head, new_head, tracked_branch
+                        FROM reviewupdates
+                       WHERE id=%s""",
+                   (update_id,))
+    review_id, user_id, old_head_id, new_head_id, tracked_branch = cursor.fetchone()
+
+    review = dbutils.Review.fromId(db, review_id)
+    if user_id is None:
+        # Pushed by the system user, like index.updateBranch() creates it.
+        user = dbutils.User(0, configuration.base.SYSTEM_USER_NAME, configuration.base.SYSTEM_USER_EMAIL, "Critic System", "current")
+    else:
+        user = dbutils.User.fromId(db, user_id)
+    old_head = gitutils.Commit.fromId(db, review.repository, old_head_id)
+    new_head = gitutils.Commit.fromId(db, review.repository, new_head_id)
+
+    cursor.execute("""SELECT commits.sha1
+                        FROM reviewupdatecommits
+                        JOIN commits ON (commits.id=reviewupdatecommits.commit)
+                       WHERE reviewupdatecommits.reviewupdate=%s""",
+                   (update_id,))
+    sha1s = set(sha1 for (sha1,) in cursor)
+
+    # Parents before children, like index.updateBranch() used to pass them.
+    # The queued commits are those to add to the review; extensions get all
+    # pushed commits, including any merged-in commits excluded from it.
+    all_commits = [gitutils.Commit.fromSHA1(db, review.repository, sha1)
+                   for sha1 in reversed(review.repository.revlist([new_head], [old_head], "--topo-order"))]
+    commits = [commit for commit in all_commits if commit.sha1 in sha1s]
+
+    addCommitsToReview(db, user, review, commits, tracked_branch=tracked_branch or False, checked=True)
+
+    if configuration.extensions.ENABLED:
+        import extensions
+        extensions.executeProcessCommits(db, user, review, all_commits, old_head, new_head, output)
+
+    cursor.execute("DELETE FROM reviewupdates WHERE id=%s", (update_id,))
+
 def createReview(db, user, repository, commits, branch_name, summary, description, from_branch_name=None, via_push=False, reviewfilters=None, applyfilters=True, applyparentfilters=False, recipientfilters=None):
     cursor = db.cursor()
 
@@ -459,9 +587,7 @@ using the command<p>
         cursor.execute("INSERT INTO branches (repository, name, head, tail, type) VALUES (%s, %s, %s, %s, 'review') RETURNING id", [repository.id, branch_name, head.getId(db), tail_id])
 
         branch_id = cursor.fetchone()[0]
-        reachable_values = [(branch_id, commit.getId(db)) for commit in commits]
-
-        cursor.executemany("INSERT INTO reachable (branch, commit) VALUES (%s, %s)", reachable_values)
+        dbutils.reachable.setCommits(db, branch_id, [commit.getId(db) for commit in commits])
 
         cursor.execute("INSERT INTO reviews (type, branch, state, summary, description, applyfilters, applyparentfilters) VALUES ('official', %s, 'open', %s, %s, %s, %s) RETURNING id", (branch_id, summary, description, applyfilters, applyparentfilters))
 
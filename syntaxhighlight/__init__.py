@@ -14,36 +14,118 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-import os
-import os.path
-import bz2
-
 import htmlutils
 import configuration
 
+from syntaxhighlight.store import getStore
+
 LANGUAGES = set()
 
-def generateHighlightPath(sha1, language):
-    return os.path.join(configuration.services.HIGHLIGHT["cache_dir"], sha1[:2], sha1[2:] + "." + language)
+# Very large files are only highlighted in windows around the lines that are
+# actually displayed (see syntaxhighlight.generate.)  Such partially
+# highlighted files are stored under the language with this suffix, with a
+# first line listing the highlighted windows; other lines are plain.
+PARTIAL_SUFFIX = ":partial"
+
+def mergeWindows(windows):
+    """Return the union of 'windows', a list of (first line, last line)
+       tuples, as a sorted list of non-overlapping windows."""
+
+    merged = []
+    for first, last in sorted(windows):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return [(first, last) for first, last in merged]
+
+def getWindows(ranges):
+    """Return the windows to highlight to display the lines in 'ranges', a
+       list of (offset, count) tuples, with some context around them."""
+
+    context = configuration.services.HIGHLIGHT.get("window_context", 100)
+    return mergeWindows([(max(1, offset - context), offset + count + context)
+                         for offset, count in ranges])
+
+def formatWindows(windows):
+    return ",".join("%d-%d" % window for window in windows)
+
+def parseWindows(string):
+    windows = []
+    for window in string.split(","):
+        if window:
+            first, last = window.split("-")
+            windows.append((int(first), int(last)))
+    return windows
+
+def formatChunks(chunks):
+    return ";".join("%d,%d,%d,%d" % chunk for chunk in chunks)
+
+def parseChunks(string):
+    return [tuple(map(int, chunk.split(","))) for chunk in string.split(";") if chunk]
+
+def isCovered(covered, windows):
+    """Return True if every line in 'windows' is in 'covered' (both sorted
+       lists of non-overlapping windows.)"""
+
+    for first, last in windows:
+        for covered_first, covered_last in covered:
+            if covered_first <= first and last <= covered_last:
+                break
+        else:
+            return False
+    return True
+
+def splitPartial(data):
+    """Split stored partially highlighted file into (windows, source)."""
+
+    header, _, source = data.partition("\n")
+    return parseWindows(header), source
+
+def joinPartial(windows, source):
+    return formatWindows(windows) + "\n" + source
+
+def isHighlighted(sha1, language, windows=None):
+    """Return True if the lines in 'windows' (by default all lines) of the
+       file are highlighted."""
+
+    store = getStore()
+
+    if store.contains(sha1, language):
+        return True
+    elif windows is None:
+        return False
+
+    partial = store.get(sha1, language + PARTIAL_SUFFIX)
+
+    if partial is None:
+        return False
+
+    covered, source = splitPartial(partial)
+    return isCovered(covered, windows)
+
+def readHighlight(repository, sha1, path, language, request=False, windows=None, base=None):
+    """Return the highlighted file.  If 'request' is true, and the lines in
+       'windows' (by default all lines) aren't highlighted yet, have them
+       highlighted first, incrementally if 'base' is given (see
+       syntaxhighlight.request.requestHighlights().)"""
+
+    store = getStore()
+    source = store.get(sha1, language)
+
+    if source is None:
+        partial = store.get(sha1, language + PARTIAL_SUFFIX)
 
-def isHighlighted(sha1, language):
-    return os.path.exists(generateHighlightPath(sha1, language))
+        if partial is not None:
+            covered, source = splitPartial(partial)
 
-def readHighlight(repository, sha1, path, language, request=False):
-    path = generateHighlightPath(sha1, language)
+            if request and (windows is None or not isCovered(covered, windows)):
+                source = None
 
-    if os.path.isfile(path):
-        os.utime(path, None)
-        source = open(path).read()
-    elif os.path.isfile(path + ".bz2"):
-        os.utime(path + ".bz2", None)
-        source = bz2.BZ2File(path + ".bz2", "r").read()
-    elif request:
+    if source is None and request:
         import request
-        request.requestHighlights(repository, { sha1: (path, language) })
+        request.requestHighlights(repository, { sha1: (path, language, windows, base) })
         return readHighlight(repository, sha1, path, language)
-    else:
-        source = None
 
     if not source:
         source = htmlutils.htmlify(repository.fetch(sha1)[2])
@@ -42,6 +42,20 @@
 #   whitespace.)  If whitespace preceded the backslash, there will be two
 #   separate whitespace tokens, split where the backslash was.
 #
+# scan(source)
+#
+#   Returns an iterator that returns a (kind, value, offset) tuple for each
+#   token and whitespace sequence in the C/C++ source, in a single pass using
+#   one regular expression, RE_SCAN, whose named groups are the kinds:
+#
+#     "conflict", "identifier", "keyword", "float", "comment", "ppdirective",
+#     "operator", "int", "string", "char", "space" or "other"
+#
+#   The tokens are the same as those returned by split(source); "other" is any
+#   single character that doesn't start another kind of token.  Callers that
+#   need more speed than an iterator gives can use RE_SCAN.finditer() directly
+#   (and check identifiers against KEYWORDS themselves.)
+#
 # tokenize(tokens[, filename="<unknown>"])
 #
 #   Returns an iterator that returns each string returned by the iterable
@@ -207,6 +221,21 @@ SUBPATTERNS = [FLOAT_LITERAL, INT_LITERAL, WIDE_STRING_LITERAL, WIDE_CHARACTER_L
 RE_CTOKENS = re.compile(rejoin([CONFLICT_MARKER, IDENTIFIER, FLOAT_LITERAL, MULTILINE_COMMENT, SINGLELINE_COMMENT, PREPROCESSOR_DIRECTIVE, OPERATOR_OR_PUNCTUATOR, INT_LITERAL, STRING_LITERAL, CHARACTER_LITERAL, "."], escape=False), re.DOTALL | re.MULTILINE)
 RE_CTOKENS_INCLUDE_WS = re.compile(rejoin([CONFLICT_MARKER, IDENTIFIER, FLOAT_LITERAL, MULTILINE_COMMENT, SINGLELINE_COMMENT, PREPROCESSOR_DIRECTIVE, OPERATOR_OR_PUNCTUATOR, INT_LITERAL, STRING_LITERAL, CHARACTER_LITERAL, WHITESPACE, "."], escape=False), re.DOTALL | re.MULTILINE)
 
+# Same alternatives, in the same order, as RE_CTOKENS_INCLUDE_WS, but with the
+# kind of token as the name of the group that matches.
+RE_SCAN = re.compile("|".join("(?P<%s>%s)" % (kind, pattern)
+                              for kind, pattern in [("conflict", CONFLICT_MARKER),
+                                                    ("identifier", IDENTIFIER),
+                                                    ("float", FLOAT_LITERAL),
+                                                    ("comment", MULTILINE_COMMENT + "|" + SINGLELINE_COMMENT),
+                                                    ("ppdirective", PREPROCESSOR_DIRECTIVE),
+                                                    ("operator", OPERATOR_OR_PUNCTUATOR),
+                                                    ("int", INT_LITERAL),
+                                                    ("string", STRING_LITERAL),
+                                                    ("char", CHARACTER_LITERAL),
+                                                    ("space", WHITESPACE),
+                                                    ("other", ".")]), re.DOTALL | re.MULTILINE)
+
 RE_IDENTIFIER = re.compile(IDENTIFIER)
 RE_INT_LITERAL = re.compile("^" + INT_LITERAL + "$")
 RE_FLOAT_LITERAL = re.compile("^" + FLOAT_LITERAL + "$")
@@ -241,6 +270,13 @@ def split(input, include_ws=True, include_comments=True):
     if include_comments: return tokens
     else: return itertools.ifilter(lambda token: not iscomment(token), tokens)
 
+def scan(source):
+    for match in RE_SCAN.finditer(source):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "identifier" and value in KEYWORDS: kind = "keyword"
+        yield kind, value, match.start()
+
 class Token:
     def __init__(self, value, filename="<unknown>", line=0, column=0):
         self.__value = value
@@ -455,6 +491,23 @@ def join(tokens, insertSpaces=True):
 
 # Run regression tests if we're the main script and not being imported as a module.
 if __name__ == "__main__":
+    # scan() returns the same tokens as split(), with their kinds and offsets.
+    def testScan(source, kinds):
+        scanned = list(scan(source))
+        assert [value for kind, value, offset in scanned] == list(split(source))
+        assert [source[offset:offset + len(value)] for kind, value, offset in scanned] == [value for kind, value, offset in scanned]
+        assert [kind for kind, value, offset in scanned if kind != "space"] == kinds
+
+    testScan("int main(int argc, char **argv)\n{\n  return 0;\n}\n",
+             ["keyword", "identifier", "operator", "keyword", "identifier", "operator", "keyword", "operator", "operator", "identifier", "operator",
+              "operator", "keyword", "int", "operator", "operator"])
+    testScan("#include <stdio.h>\n# define X(a) \\\n  (a + 1.5e3f)\n",
+             ["ppdirective", "ppdirective"])
+    testScan("x = 'a' + \"b\\\"c\" /* d\n*/ // e\n;",
+             ["identifier", "operator", "char", "operator", "string", "comment", "comment", "operator"])
+    testScan("<<<<<<< HEAD\na ## b @ 08\n=======\n>>>>>>> other\n",
+             ["conflict", "identifier", "operator", "identifier", "other", "other", "int", "conflict", "conflict"])
+
     # The token expression does not match whitespace.
     assert not RE_CTOKENS.match(" ")
     assert not RE_CTOKENS.match("\t")
@@ -14,33 +14,70 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-import os
-import os.path
-
-import syntaxhighlight
 import configuration
 
-def importCodeContexts(db, sha1, language):
-    codecontexts_path = syntaxhighlight.generateHighlightPath(sha1, language) + ".ctx"
+def storeCodeContexts(db, sha1, contexts, partial=False, reused=None):
+    """Store the code contexts found when highlighting a file, a list of
+       (first line, last line, context) tuples, replacing any previously
+       stored for the file.  If 'partial' is true, only some lines of the file
+       were highlighted, and the contexts are added to those already stored
+       (replacing identical ones) instead.  If 'reused' is given, as
+       (base_sha1, regions), the file was highlighted incrementally, and the
+       contexts within the unchanged regions, (old first line, old last line,
+       new first line) tuples, are copied from the previous version.  Commits,
+       and returns the number of contexts stored."""
 
-    if os.path.isfile(codecontexts_path):
-        contexts_values = []
+    max_context_length = configuration.services.HIGHLIGHT["max_context_length"]
 
-        for line in open(codecontexts_path):
-            line = line.strip()
+    def truncate(context):
+        if len(context) > max_context_length:
+            return context[:max_context_length - 3] + "..."
+        return context
 
-            first_line, last_line, context = line.split(" ", 2)
-            if len(context) > configuration.services.HIGHLIGHT["max_context_length"]:
-                context = context[:configuration.services.HIGHLIGHT["max_context_length"] - 3] + "..."
-            contexts_values.append((sha1, context, int(first_line), int(last_line)))
+    contexts_values = [(sha1, truncate(context), first_line, last_line)
+                       for first_line, last_line, context in contexts]
 
-        cursor = db.cursor()
-        cursor.execute("DELETE FROM codecontexts WHERE sha1=%s", [sha1])
-        cursor.executemany("INSERT INTO codecontexts (sha1, context, first_line, last_line) VALUES (%s, %s, %s, %s)", contexts_values)
-        db.commit()
+    cursor = db.cursor()
+
+    # Workers highlighting the same file concurrently (for different requests,
+    # say with different windows) would otherwise each delete the other's
+    # contexts before either has committed, and then both insert theirs.
+    # There's no row to lock, so lock on (a prefix of) the SHA-1 instead.
+    # (Session-level, since pg_advisory_xact_lock() requires PostgreSQL 9.1.)
+    lock_key = int(sha1[:15], 16)
+
+    cursor.execute("SELECT pg_advisory_lock(%s)", (lock_key,))
+
+    try:
+        if partial:
+            cursor.executemany("DELETE FROM codecontexts WHERE sha1=%s AND first_line=%s AND last_line=%s",
+                               [(sha1, first_line, last_line) for _, _, first_line, last_line in contexts_values])
+        else:
+            cursor.execute("DELETE FROM codecontexts WHERE sha1=%s", [sha1])
+
+        db.bulkInsert("codecontexts", ("sha1", "context", "first_line", "last_line"), contexts_values)
 
-        os.unlink(codecontexts_path)
+        count = len(contexts_values)
+
+        if reused:
+            base_sha1, regions = reused
+
+            for old_first, old_last, new_first in regions:
+                cursor.execute("""INSERT INTO codecontexts (sha1, context, first_line, last_line)
+                                       SELECT %s, context, first_line + %s, last_line + %s
+                                         FROM codecontexts
+                                        WHERE sha1=%s
+                                          AND first_line>=%s
+                                          AND last_line<=%s""",
+                               (sha1, new_first - old_first, new_first - old_first, base_sha1, old_first, old_last))
+                count += cursor.rowcount
+
+        db.commit()
+    except:
+        db.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (lock_key,))
+        db.commit()
 
-        return len(contexts_values)
-    else:
-        return 0
+    return count
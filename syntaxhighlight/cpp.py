@@ -19,142 +19,214 @@ import syntaxhighlight.clexer
 import htmlutils
 import configuration
 
-class HighlightCPP:
-    def highlightToken(self, token):
-        if token.iskeyword():
-            self.output.write("<b class='kw'>" + str(token) + "</b>")
-        elif token.isidentifier():
-            self.output.write("<b class='id'>" + str(token) + "</b>")
-        elif token.iscomment():
-            if str(token)[0:2] == "/*":
-                lines = str(token).splitlines()
-                self.output.write("\n".join(["<b class='com'>" + htmlutils.htmlify(line) + "</b>" for line in lines]))
-            else:
-                self.output.write("<b class='com'>" + htmlutils.htmlify(token) + "</b>")
-        elif token.isppdirective():
-            lines = str(token).split("\n")
-            self.output.write("\n".join(["<b class='pp'>" + htmlutils.htmlify(line) + "</b>" for line in lines]))
-        elif token.isspace():
-            self.output.write(str(token))
-        elif token.isconflictmarker():
-            self.output.write(htmlutils.htmlify(token))
-        else:
-            if str(token)[0] == '"':
-                self.output.write("<b class='str'>" + htmlutils.htmlify(token) + "</b>")
-            elif str(token)[0] == "'":
-                self.output.write("<b class='ch'>" + htmlutils.htmlify(token) + "</b>")
-            elif token.isfloat():
-                self.output.write("<b class='fp'>" + str(token) + "</b>")
-            elif token.isint():
-                self.output.write("<b class='int'>" + str(token) + "</b>")
-            else:
-                self.output.write("<b class='op'>" + htmlutils.htmlify(token) + "</b>")
-
-    def outputContext(self, tokens, terminator):
-        if not self.contexts: return
-
-        def spaceBetween(first, second):
-            # Never insert spaces around the :: operator.
-            if first == '::' or second == '::':
-                return False
-
-            # Always a space after a comma.
-            if first == ',':
-                return True
-
-            # Always a space before a keyword or identifier, unless preceded by *, & or (.
-            if second.iskeyword() or second.isidentifier():
-                return str(first) not in ('*', '&', '(')
+# Keywords that end the declaration that precedes a block (making the block not
+# a context.)
+STATEMENT_KEYWORDS = frozenset(["if", "else", "for", "while", "do", "switch", "return", "break", "continue"])
+
+GROUP_OPENERS = { "(": ")", "{": "}", "[": "]" }
+GROUP_CLOSERS = frozenset(GROUP_OPENERS.values())
+
+# Operators and punctuators are highlighted the same everywhere.  ('#' and '##'
+# outside of preprocessor directives look like preprocessor directives.)
+OPERATORS = dict((operator, "<b class='op'>" + htmlutils.htmlify(operator) + "</b>")
+                 for operator in syntaxhighlight.clexer.OPERATORS_AND_PUNCTUATORS)
+OPERATORS["#"] = "<b class='pp'>#</b>"
+OPERATORS["##"] = "<b class='pp'>##</b>"
+
+def highlightOther(value):
+    # Single characters that don't start any other kind of token: unterminated
+    # string or character literals, stray characters, and digits that aren't
+    # valid integer literals on their own ("0" in "08".)
+    if value[0] == '"':
+        return "<b class='str'>" + htmlutils.htmlify(value) + "</b>"
+    elif value[0] == "'":
+        return "<b class='ch'>" + htmlutils.htmlify(value) + "</b>"
+    elif syntaxhighlight.clexer.isint(value):
+        return "<b class='int'>" + value + "</b>"
+    else:
+        return "<b class='op'>" + htmlutils.htmlify(value) + "</b>"
+
+def spaceBetween(first, second):
+    # Arguments are (kind, value, offset) tuples, as returned by
+    # syntaxhighlight.clexer.scan().
+    first_kind, first = first[:2]
+    second_kind, second = second[:2]
+
+    # Never insert spaces around the :: operator.
+    if first == '::' or second == '::':
+        return False
+
+    # Always a space after a comma.
+    if first == ',':
+        return True
+
+    # Always a space before a keyword or identifier, unless preceded by *, & or (.
+    if second_kind == "keyword" or second_kind == "identifier":
+        return first not in ('*', '&', '(')
+
+    # Always a space before a * or &, unless preceded by (another) *.
+    if (second == '*' or second == '&') and first != '*':
+        return True
+
+    # Always spaces around equal signs.
+    if first == '=' or second == '=':
+        return True
+
+    # No spaces between by default.
+    return False
 
-            # Always a space before a * or &, unless preceded by (another) *.
-            if (second == '*' or second == '&') and first != '*':
-                return True
-
-            # Always spaces around equal signs.
-            if first == '=' or second == '=':
-                return True
-
-            # No spaces between by default.
-            return False
+class HighlightCPP:
+    """C/C++ highlighter.
 
-        first_line = tokens[-1].line() + 1
-        last_line = terminator.line()
+       Highlights the source and finds code contexts (the declarations
+       preceding blocks, such as function bodies and class definitions) in a
+       single pass over the tokens returned by a single regular expression,
+       syntaxhighlight.clexer.RE_SCAN.  Contexts are appended to the list
+       'contexts', if given, as (first line, last line, declaration)
+       tuples."""
 
+    def outputContext(self, tokens, first_line, last_line):
         if last_line - first_line >= configuration.services.HIGHLIGHT["min_context_length"]:
             previous = tokens[0]
-            context = str(previous)
+            context = previous[1]
 
             for token in tokens[1:]:
-                if token.isspace() or token.iscomment(): continue
+                if token[0] == "space" or token[0] == "comment": continue
                 if spaceBetween(previous, token): context += " "
-                context += str(token)
+                context += token[1]
                 previous = token
 
-            self.contexts.write("%d %d %s\n" % (first_line, last_line, context))
-
-    def processTokens(self, tokens):
-        currentContexts = []
-        nextContext = []
-        nextContextClosed = False
+            self.contexts.append((first_line, last_line, context))
+
+    def __call__(self, source, output, contexts):
+        self.contexts = contexts
+        htmlify = htmlutils.htmlify
+        keywords = syntaxhighlight.clexer.KEYWORDS
+        operators = OPERATORS
+
+        html = []
+        append = html.append
+
+        # Line numbers are only needed for the code contexts, so they're
+        # calculated when needed, counting linebreaks from the previous
+        # calculation.  (Offsets are always increasing.)
+        line_offset = [0, 1]
+
+        def lineAt(offset):
+            previous_offset, line = line_offset
+            if offset < previous_offset: previous_offset, line = 0, 1
+            line += source.count("\n", previous_offset, offset)
+            line_offset[:] = [offset, line]
+            return line
+
+        # Code context state: the currently open blocks that have contexts, as
+        # [tokens, level, first line] lists; the tokens of the declaration
+        # that may precede the next block, or None; whether that declaration
+        # is complete; the current block nesting level; and the stack of
+        # expected group closers while inside a parenthesized group in a
+        # declaration (or None.)
+        current_contexts = []
+        next_context = []
+        next_context_closed = False
         level = 0
-
-        for token in tokens:
-            self.highlightToken(token)
-
-            if token.isspace() or token.iscomment() or token.isppdirective() or token.isconflictmarker():
+        group = None
+
+        for match in syntaxhighlight.clexer.RE_SCAN.finditer(source):
+            kind = match.lastgroup
+            value = match.group()
+
+            if kind == "identifier":
+                if value in keywords:
+                    kind = "keyword"
+                    append("<b class='kw'>" + value + "</b>")
+                else:
+                    append("<b class='id'>" + value + "</b>")
+            elif kind == "space":
+                append(value)
+            elif kind == "operator":
+                append(operators[value])
+                if value == "#" or value == "##": kind = "ppdirective"
+            elif kind == "comment":
+                if value[0:2] == "/*":
+                    append("\n".join(["<b class='com'>" + htmlify(line) + "</b>" for line in value.splitlines()]))
+                else:
+                    append("<b class='com'>" + htmlify(value) + "</b>")
+            elif kind == "string":
+                append("<b class='str'>" + htmlify(value) + "</b>")
+            elif kind == "int":
+                append("<b class='int'>" + value + "</b>")
+            elif kind == "ppdirective":
+                append("\n".join(["<b class='pp'>" + htmlify(line) + "</b>" for line in value.split("\n")]))
+            elif kind == "char":
+                append("<b class='ch'>" + htmlify(value) + "</b>")
+            elif kind == "float":
+                append("<b class='fp'>" + value + "</b>")
+            elif kind == "conflict":
+                append(htmlify(value))
+            else:
+                append(highlightOther(value))
+
+            if group is not None:
+                # Inside a parenthesized group (typically a parameter list)
+                # in a declaration: everything up to the matching ')' is part
+                # of the declaration.  A mismatched group closer means it
+                # wasn't a declaration after all.
+                token = (kind, value, match.start())
+                next_context.append(token)
+
+                if value in GROUP_OPENERS:
+                    group.append(GROUP_OPENERS[value])
+                elif not group and value == ')':
+                    group = None
+                elif group and value == group[-1]:
+                    group.pop()
+                elif value in GROUP_CLOSERS:
+                    next_context = []
+                    next_context_closed = False
+                    group = None
+            elif kind == "space" or kind == "comment" or kind == "ppdirective" or kind == "conflict":
                 pass
-            elif token.iskeyword():
-                if str(token) in ("if", "else", "for", "while", "do", "switch", "return", "break", "continue"):
-                    nextContext = None
-                    nextContextClosed = True
-                elif not nextContextClosed:
-                    nextContext.append(token)
-            elif token.isidentifier():
-                if not nextContextClosed:
-                    nextContext.append(token)
-            elif token == '{':
-                if nextContext:
-                    currentContexts.append([nextContext, level])
-                    nextContext = []
-                    nextContextClosed = False
+            elif kind == "keyword":
+                if value in STATEMENT_KEYWORDS:
+                    next_context = None
+                    next_context_closed = True
+                elif not next_context_closed:
+                    next_context.append((kind, value, match.start()))
+            elif kind == "identifier":
+                if not next_context_closed:
+                    next_context.append((kind, value, match.start()))
+            elif value == '{':
+                if next_context:
+                    if contexts is not None: first_line = lineAt(next_context[-1][2]) + 1
+                    else: first_line = None
+                    current_contexts.append([next_context, level, first_line])
+                    next_context = []
+                    next_context_closed = False
                 level += 1
-            elif token == '}':
+            elif value == '}':
                 level -= 1
-                if currentContexts and currentContexts[-1][1] == level:
-                    thisContext = currentContexts.pop()
-                    self.outputContext(thisContext[0], token)
-                nextContext = []
-                nextContextClosed = False
-            elif nextContext:
-                if token == ',' and not nextContextClosed:
-                    nextContext = None
-                    nextContextClosed = True
-                elif token == ':':
-                    nextContextClosed = True
-                elif token == ';':
-                    nextContext = []
-                    nextContextClosed = False
-                elif token == '(':
-                    if not nextContextClosed:
-                        nextContext.append(token)
-                        try:
-                            group, token = syntaxhighlight.clexer.group1(tokens, ')')
-                            group = list(syntaxhighlight.clexer.flatten(group)) + [token]
-                            nextContext.extend(group)
-                            for token in group: self.highlightToken(token)
-                        except syntaxhighlight.clexer.CLexerGroupingException, error:
-                            for token in error.tokens(): self.highlightToken(token)
-                            nextContext = []
-                            nextContextClosed = False
-                elif not nextContextClosed:
-                    nextContext.append(token)
-
-    def __call__(self, source, output, contexts_path):
-        self.output = output
-        if contexts_path: self.contexts = open(contexts_path, "w")
-        else: self.contexts = None
-        self.processTokens(syntaxhighlight.clexer.tokenize(syntaxhighlight.clexer.split(source)))
-        if contexts_path: self.contexts.close()
+                if current_contexts and current_contexts[-1][1] == level:
+                    tokens, _, first_line = current_contexts.pop()
+                    if contexts is not None: self.outputContext(tokens, first_line, lineAt(match.start()))
+                next_context = []
+                next_context_closed = False
+            elif next_context:
+                if value == ',' and not next_context_closed:
+                    next_context = None
+                    next_context_closed = True
+                elif value == ':':
+                    next_context_closed = True
+                elif value == ';':
+                    next_context = []
+                    next_context_closed = False
+                elif value == '(':
+                    if not next_context_closed:
+                        next_context.append((kind, value, match.start()))
+                        group = []
+                elif not next_context_closed:
+                    next_context.append((kind, value, match.start()))
+
+        output.write("".join(html))
 
     @staticmethod
     def create(language):
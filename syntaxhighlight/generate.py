@@ -14,12 +14,21 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-import os
-import os.path
-import errno
+import re
+import cStringIO
 
 import syntaxhighlight
+import syntaxhighlight.store
 import gitutils
+import htmlutils
+import configuration
+
+# Highlighters and repositories used by this process, kept for subsequent
+# files, since highlight workers typically handle many files from the same
+# repository in the same language.  (Highlighters are stateless between files,
+# and repositories keep an object reader running.)
+highlighters = {}
+repositories = {}
 
 def createHighlighter(language):
     import cpp
@@ -30,30 +39,255 @@ def createHighlighter(language):
     highlighter = generic.HighlightGeneric.create(language)
     if highlighter: return highlighter
 
-def generateHighlight(repository_path, sha1, language, output_file=None):
-    highlighter = createHighlighter(language)
+def getHighlighter(language):
+    if language not in highlighters:
+        highlighters[language] = createHighlighter(language)
+    return highlighters[language]
+
+def getRepository(repository_path):
+    if repository_path not in repositories:
+        repositories[repository_path] = gitutils.Repository(path=repository_path)
+    return repositories[repository_path]
+
+# Lines covered by a window that extends to the end of the file.
+MAXIMUM_LINE = 0x7fffffff
+
+# Highlighting of a window is started and stopped at lines that are unlikely
+# to be in the middle of a comment or string: unindented lines that follow an
+# empty line and start with something that can start a declaration, statement,
+# preprocessor directive or comment.  Such lines are looked for at most this
+# many lines before and after the window.
+MAXIMUM_RESTART_DISTANCE = 1000
+
+re_restart = re.compile("[A-Za-z_#@/<]")
+
+def isRestartPoint(lines, index):
+    if index <= 0 or index >= len(lines): return True
+    return not lines[index - 1].strip() and re_restart.match(lines[index]) is not None
+
+def findRestartPoint(lines, index, step):
+    for candidate in xrange(index, index + step * MAXIMUM_RESTART_DISTANCE, step):
+        if isRestartPoint(lines, candidate):
+            return max(0, min(candidate, len(lines)))
+    return max(0, min(index, len(lines)))
+
+def highlightSegment(highlighter, lines, begin, end, contexts):
+    """Highlight lines[begin:end] on their own, and return the highlighted
+       lines, or None if the highlighter didn't produce one line per line.
+       Code contexts are appended to 'contexts' (unless it's None), with line
+       numbers adjusted."""
+
+    output_file = cStringIO.StringIO()
+    segment_contexts = [] if contexts is not None else None
+
+    highlighter("\n".join(lines[begin:end]) + "\n", output_file, segment_contexts)
+
+    if segment_contexts:
+        contexts.extend((first_line + begin, last_line + begin, context)
+                        for first_line, last_line, context in segment_contexts)
+
+    segment_lines = output_file.getvalue()[:-1].split("\n")
+
+    if len(segment_lines) != end - begin: return None
+    else: return segment_lines
+
+def generatePartialHighlight(highlighter, sha1, language, source, windows, contexts):
+    """Highlight the lines in 'windows' of a very large file, and merge them
+       into the stored partially highlighted file."""
+
+    store = syntaxhighlight.store.getStore()
+    partial_language = language + syntaxhighlight.PARTIAL_SUFFIX
+
+    # Line N of the file is lines[N - 1].  (If the file ends with a linebreak,
+    # the last item is an empty string.)
+    lines = source.split("\n")
+
+    current = store.get(sha1, partial_language)
+    if current is not None:
+        covered, current_source = syntaxhighlight.splitPartial(current)
+        windows = [window for window in windows if not syntaxhighlight.isCovered(covered, [window])]
+
+    segments = []
+    for first, last in windows:
+        begin = findRestartPoint(lines, first - 1, -1)
+        end = findRestartPoint(lines, last, 1)
+        if segments and begin <= segments[-1][1]:
+            segments[-1][1] = max(segments[-1][1], end)
+        elif begin < end:
+            segments.append([begin, end])
+
+    highlighted = []
+
+    for begin, end in segments:
+        # If the highlighter produces the wrong number of lines, which
+        # shouldn't happen, the lines are left unhighlighted (and aren't
+        # highlighted again.)
+        highlighted.append((begin, end, highlightSegment(highlighter, lines, begin, end, contexts)))
+
+    def merge(current):
+        if current is not None:
+            covered, current_source = syntaxhighlight.splitPartial(current)
+            result_lines = current_source.split("\n")
+        if current is None or len(result_lines) != len(lines):
+            covered = []
+            result_lines = map(htmlutils.htmlify, lines)
+
+        for begin, end, segment_lines in highlighted:
+            if segment_lines is not None:
+                result_lines[begin:end] = segment_lines
+            covered.append((begin + 1, end if end < len(lines) else MAXIMUM_LINE))
+
+        return syntaxhighlight.joinPartial(syntaxhighlight.mergeWindows(covered), "\n".join(result_lines))
+
+    if highlighted:
+        store.update(sha1, partial_language, merge)
+
+# When a new version of a file is highlighted incrementally, the highlighter
+# must produce the same output as for the previous version for at least this
+# many unchanged lines at the end of each re-highlighted region, for its state
+# to be considered resynchronized.
+RESYNC_LINES = 3
+
+def generateIncrementalHighlight(highlighter, source, base_source, base_highlighted, chunks, contexts, reused):
+    """Highlight a new version of a file by copying the highlighted lines of
+       unchanged regions from the highlighted previous version, and only
+       highlighting the changed regions, widened to restart points.  'chunks'
+       is a list of (delete_offset, delete_count, insert_offset, insert_count)
+       tuples, as in diff.Chunk.
+
+       Returns the highlighted file, or None if the copied lines can't be shown
+       to be highlighted the same in the new version.  The code contexts of the
+       re-highlighted regions are appended to 'contexts', and the copied
+       regions to 'reused', as (old first line, old last line, new first line)
+       tuples."""
+
+    old_lines = base_source.split("\n")
+    new_lines = source.split("\n")
+    old_highlighted = base_highlighted.split("\n")
+
+    # The stored file should have one line per line (and the same trailing
+    # empty string, if the file ends with a linebreak.)
+    if len(old_highlighted) != len(old_lines): return None
+
+    # Re-highlighted regions, as [old begin, old end, new begin, new end]
+    # (0-based, exclusive ends.)
+    segments = []
+
+    for delete_offset, delete_count, insert_offset, insert_count in chunks:
+        delta_before = insert_offset - delete_offset
+        delta_after = (insert_offset + insert_count) - (delete_offset + delete_count)
+
+        new_begin = findRestartPoint(new_lines, insert_offset - 1, -1)
+        new_end = findRestartPoint(new_lines, insert_offset - 1 + insert_count + RESYNC_LINES, 1)
+
+        if segments and new_begin <= segments[-1][3]:
+            segment = segments[-1]
+            segment[3] = max(segment[3], new_end)
+            segment[1] = segment[3] - delta_after
+        else:
+            segments.append([new_begin - delta_before, new_end - delta_after, new_begin, new_end])
+
+    if sum(new_end - new_begin for old_begin, old_end, new_begin, new_end in segments) * 2 > len(new_lines):
+        # Not worth it.
+        return None
+
+    segments.append([len(old_lines), len(old_lines), len(new_lines), len(new_lines)])
+
+    result = []
+    segment_contexts = [] if contexts is not None else None
+    old_position = new_position = 0
+
+    for old_begin, old_end, new_begin, new_end in segments:
+        if not (old_position <= old_begin <= old_end <= len(old_lines)):
+            return None
+
+        # Check that the lines between re-highlighted regions really are
+        # unchanged; the chunks may not cover all differences.
+        if old_lines[old_position:old_begin] != new_lines[new_position:new_begin]:
+            return None
+
+        if old_position < old_begin:
+            result.extend(old_highlighted[old_position:old_begin])
+            reused.append((old_position + 1, old_begin, new_position + 1))
+
+        if new_begin < new_end:
+            # Highlighting the region of the previous version on its own must
+            # reproduce the stored lines, or the highlighter's state at the
+            # start of the region isn't its initial state.
+            if highlightSegment(highlighter, old_lines, old_begin, old_end, None) != old_highlighted[old_begin:old_end]:
+                return None
+
+            segment_lines = highlightSegment(highlighter, new_lines, new_begin, new_end, segment_contexts)
+
+            if segment_lines is None:
+                return None
+
+            # Unless the region extends to the end of the file, its last lines
+            # are unchanged, and must be highlighted as in the previous
+            # version, or the highlighter's state at the end of the region
+            # may differ.
+            if new_end < len(new_lines):
+                if new_end - new_begin < RESYNC_LINES:
+                    return None
+                if new_lines[new_end - RESYNC_LINES:new_end] != old_lines[old_end - RESYNC_LINES:old_end]:
+                    return None
+                if segment_lines[-RESYNC_LINES:] != old_highlighted[old_end - RESYNC_LINES:old_end]:
+                    return None
+
+            result.extend(segment_lines)
+
+        old_position = old_end
+        new_position = new_end
+
+    if segment_contexts:
+        contexts.extend(segment_contexts)
+
+    return "\n".join(result)
+
+def generateHighlight(repository_path, sha1, language, output_file=None, windows=None, base=None, reused=None, contexts=None):
+    """Highlight a file, and store it.  If 'windows' (a list of (first line,
+       last line) tuples) is given, and the file has at least
+       HIGHLIGHT["window_min_lines"] lines, only those lines are highlighted
+       (see generatePartialHighlight().)  Otherwise, if 'base' is given, as
+       (sha1, chunks), and that version of the file is highlighted, the file is
+       highlighted incrementally (see generateIncrementalHighlight().)
+
+       Code contexts found are appended to 'contexts', if given, as (first
+       line, last line, context) tuples."""
+
+    highlighter = getHighlighter(language)
     if not highlighter: return False
 
-    source = gitutils.Repository.readObject(repository_path, "blob", sha1)
+    source = getRepository(repository_path).fetch(sha1).data
 
     if output_file:
         highlighter(source, output_file, None)
     else:
-        output_path = syntaxhighlight.generateHighlightPath(sha1, language)
+        window_min_lines = configuration.services.HIGHLIGHT.get("window_min_lines")
+
+        if windows is not None and window_min_lines and source.count("\n") >= window_min_lines:
+            generatePartialHighlight(highlighter, sha1, language, source, windows, contexts)
+        else:
+            store = syntaxhighlight.store.getStore()
+            data = None
+
+            if base is not None:
+                base_sha1, chunks = base
+                base_highlighted = store.get(base_sha1, language)
 
-        try: os.makedirs(os.path.dirname(output_path), 0750)
-        except OSError, error:
-            if error.errno == errno.EEXIST: pass
-            else: raise
+                if base_highlighted is not None:
+                    if reused is None: reused = []
+                    base_source = getRepository(repository_path).fetch(base_sha1).data
+                    data = generateIncrementalHighlight(highlighter, source, base_source, base_highlighted, chunks, contexts, reused)
+                    if data is None: del reused[:]
 
-        output_file = open(output_path + ".tmp", "w")
-        contexts_path = output_path + ".ctx"
+            if data is None:
+                output_file = cStringIO.StringIO()
 
-        highlighter(source, output_file, contexts_path)
+                highlighter(source, output_file, contexts)
 
-        output_file.close()
+                data = output_file.getvalue()
 
-        os.chmod(output_path + ".tmp", 0660)
-        os.rename(output_path + ".tmp", output_path)
+            store.put(sha1, language, data)
 
     return True
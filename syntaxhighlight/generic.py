@@ -30,43 +30,85 @@ LANGUAGES = { "python": pygments.lexers.PythonLexer,
               "objective-c": pygments.lexers.ObjectiveCLexer,
               "xml": pygments.lexers.XmlLexer }
 
+# Token types and the CSS classes of their tokens, in order of precedence, and
+# whether their tokens can span multiple lines (and are then tagged line by
+# line.)  Other tokens are not tagged.
+TOKEN_TYPES = [(pygments.token.Token.Punctuation, "op", False),
+               (pygments.token.Token.Operator, "op", False),
+               (pygments.token.Token.Name, "id", False),
+               (pygments.token.Token.String.Symbol, "id", False),
+               (pygments.token.Token.Keyword, "kw", False),
+               (pygments.token.Token.String, "str", True),
+               (pygments.token.Token.Comment, "com", True),
+               (pygments.token.Token.Number.Integer, "int", False),
+               (pygments.token.Token.Number.Float, "fp", False)]
+
+# Token type => (CSS class, multi-line), filled in as token types are seen.
+TOKEN_CLASSES = {}
+
+def classifyToken(token):
+    for token_type, cls, multiline in TOKEN_TYPES:
+        if token in token_type:
+            return cls, multiline
+    return None, False
+
+def tagLines(cls, value):
+    if value == "\n": return value
+    else:
+        res = []
+        for line in value.splitlines():
+            if line: res.append("<b class='%s'>%s</b>" % (cls, htmlutils.htmlify(line)))
+            else: res.append(line)
+        if value.endswith("\n"): res.append("")
+        return "\n".join(res)
+
 class HighlightGeneric:
     def __init__(self, lexer):
         self.lexer = lexer
 
-    def highlightToken(self, token, value):
-        def tag(cls, value): return "<b class='%s'>%s</b>" % (cls, htmlutils.htmlify(value))
-        def tagm(cls, value):
-            if value == "\n": return value
-            else:
-                res = []
-                for line in value.splitlines():
-                    if line: res.append(tag(cls, line))
-                    else: res.append(line)
-                if value.endswith("\n"): res.append("")
-                return "\n".join(res)
-
-        value = value.encode("utf-8")
-
-        if token in pygments.token.Token.Punctuation or token in pygments.token.Token.Operator:
-            self.output.write(tag("op", value))
-        elif token in pygments.token.Token.Name or token in pygments.token.Token.String.Symbol:
-            self.output.write(tag("id", value))
-        elif token in pygments.token.Token.Keyword:
-            self.output.write(tag("kw", value))
-        elif token in pygments.token.Token.String:
-            self.output.write(tagm("str", value))
-        elif token in pygments.token.Token.Comment:
-            self.output.write(tagm("com", value))
-        elif token in pygments.token.Token.Number.Integer:
-            self.output.write(tag("int", value))
-        elif token in pygments.token.Token.Number.Float:
-            self.output.write(tag("fp", value))
-        else:
-            self.output.write(htmlutils.htmlify(value))
-
-    def __call__(self, source, output_file, contexts_path):
-        self.output = output_file
+    def highlightTokens(self, tokens):
+        """Return the highlighted tokens as a list of strings.  Consecutive
+           untagged tokens are escaped together, and tagged tokens are only
+           escaped and tagged once per distinct value."""
+
+        output = []
+        plain = []
+        tagged = {}
+
+        for token, value in tokens:
+            try: cls, multiline = TOKEN_CLASSES[token]
+            except KeyError: cls, multiline = TOKEN_CLASSES[token] = classifyToken(token)
+
+            value = value.encode("utf-8")
+
+            if cls is None:
+                plain.append(value)
+                continue
+
+            if plain:
+                output.append(htmlutils.htmlify("".join(plain)))
+                plain = []
+
+            key = (cls, value)
+            html = tagged.get(key)
+
+            if html is None:
+                if multiline and (not value or "\n" in value or "\r" in value):
+                    html = tagLines(cls, value)
+                else:
+                    html = "<b class='%s'>%s</b>" % (cls, htmlutils.htmlify(value))
+
+                # Long values (comments and strings, mostly) rarely repeat.
+                if len(value) < 64: tagged[key] = html
+
+            output.append(html)
+
+        if plain:
+            output.append(htmlutils.htmlify("".join(plain)))
+
+        return output
+
+    def __call__(self, source, output_file, contexts):
         leading = 0
         while leading < len(source) and source[leading] == '\n': leading += 1
         trailing = 0
@@ -74,10 +116,8 @@ class HighlightGeneric:
             while source[-(trailing + 1)] == '\n': trailing += 1
             if trailing != 0: trailing -= 1
         source = source[leading:len(source) - trailing]
-        self.output.write("\n" * leading)
-        for token, value in self.lexer.get_tokens(source):
-            self.highlightToken(token, value)
-        self.output.write("\n" * trailing)
+        output = self.highlightTokens(self.lexer.get_tokens(source))
+        output_file.write("\n" * leading + "".join(output) + "\n" * trailing)
 
     @staticmethod
     def create(language):
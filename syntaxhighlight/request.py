@@ -21,10 +21,37 @@ import socket
 try: from json import dumps as json_encode, loads as json_decode
 except: from cjson import encode as json_encode, decode as json_decode
 
-def requestHighlights(repository, sha1s):
-    requests = [{ "repository_path": repository.path, "sha1": sha1, "path": path, "language": language }
-                for sha1, (path, language) in sha1s.items()
-                if not syntaxhighlight.isHighlighted(sha1, language)]
+def __makeRequests(repository, sha1s, priority):
+    # The values in 'sha1s' are (path, language) tuples, optionally followed by
+    # windows, to highlight only (at least) the lines in 'windows' of very large
+    # files, and a base, a (sha1, chunks) tuple identifying a previous version
+    # of the file and the differences from it, to highlight the file
+    # incrementally if that version is already highlighted.  Chunks are
+    # (delete_offset, delete_count, insert_offset, insert_count) tuples.
+    requests = []
+
+    for sha1, value in sha1s.items():
+        path, language = value[:2]
+        windows = value[2] if len(value) > 2 else None
+        base = value[3] if len(value) > 3 else None
+
+        if syntaxhighlight.isHighlighted(sha1, language, windows):
+            continue
+
+        request = { "repository_path": repository.path, "sha1": sha1, "path": path, "language": language, "priority": priority }
+        if windows is not None:
+            request["windows"] = syntaxhighlight.formatWindows(windows)
+        if base is not None:
+            base_sha1, chunks = base
+            request["base_sha1"] = base_sha1
+            request["base_chunks"] = syntaxhighlight.formatChunks(chunks)
+
+        requests.append(request)
+
+    return requests
+
+def requestHighlights(repository, sha1s, priority="interactive"):
+    requests = __makeRequests(repository, sha1s, priority)
 
     if not requests: return
 
@@ -54,3 +81,36 @@ def requestHighlights(repository, sha1s):
         raise Exception, "Syntax highlighting background service failed: %s" % str(results)
 
     assert len(results) == len(requests)
+
+def enqueueHighlights(repository, sha1s, priority="background"):
+    """Like requestHighlights(), but doesn't wait for the files to be
+       highlighted."""
+
+    requests = __makeRequests(repository, sha1s, priority)
+
+    if not requests: return
+
+    try:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(configuration.services.HIGHLIGHT["address"])
+        connection.send(json_encode({ "command": "enqueue", "requests": requests }))
+        connection.shutdown(socket.SHUT_WR)
+
+        data = ""
+
+        while True:
+            received = connection.recv(4096)
+            if not received: break
+            data += received
+
+        connection.close()
+    except socket.error, error:
+        raise Exception, "Syntax highlighting background service failed: %s" % error[1]
+
+    try:
+        result = json_decode(data)
+    except:
+        raise Exception, "Syntax highlighting background service failed: returned an invalid response (%r)" % data
+
+    if result.get("status") != "ok":
+        raise Exception, "Syntax highlighting background service failed: %s" % str(result)
@@ -0,0 +1,482 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""Store of syntax highlighted files.
+
+   Highlighted files are stored as records in a single append-only pack file,
+   'highlight.<generation>.pack' in HIGHLIGHT["cache_dir"].  Each record is
+
+     <binary SHA-1><length of language (one byte)><language><length of record><zlib compressed data>
+
+   Records are found via the index file 'highlight.idx', an open addressing
+   hash table (with linear probing) that processes map into memory.  The index
+   starts with a header
+
+     "CHLI" <version> <capacity> <count> <generation>
+
+   padded to HEADER_SIZE bytes, followed by 'capacity' slots
+
+     <binary SHA-1><CRC-32 of language><offset><length><access time>
+
+   Empty slots are all zeros.  A slot's access time is updated when the record
+   is read (at most once per TOUCH_INTERVAL), and compact() drops records that
+   haven't been read in a while by copying the other records into a new pack
+   file.
+
+   All modifications are made while holding an exclusive lock on the file
+   'highlight.lock'.  Records are appended to the pack file before the slot
+   referring to them is filled in, and the slot's SHA-1 is written last, so
+   readers, which don't lock, never see incomplete records.  When the index
+   needs to grow, and when compacting, new files are written and renamed into
+   place; other processes notice when they fail to find something, and when
+   they lock.  Stored files can be replaced, by appending a new record and
+   pointing the slot at it."""
+
+import os
+import os.path
+import mmap
+import zlib
+import time
+import errno
+import fcntl
+import struct
+import binascii
+
+import configuration
+
+MAGIC = "CHLI"
+VERSION = 1
+
+HEADER = struct.Struct(">4sIIII")
+HEADER_SIZE = 32
+
+SLOT = struct.Struct(">20sIQII")
+SLOT_ACCESS_TIME_OFFSET = 36
+EMPTY = "\0" * 20
+
+INITIAL_CAPACITY = 1 << 16
+
+# The index is grown (doubled) before more than this fraction of its slots are
+# used.  Linear probing degrades quickly as the table fills up.
+MAXIMUM_LOAD = 0.6
+
+# Don't bother updating a slot's access time if it was updated more recently
+# than this.
+TOUCH_INTERVAL = 60 * 60
+
+def getLanguageCRC(language):
+    return binascii.crc32(language) & 0xffffffff
+
+def findSlot(index, capacity, binary_sha1, language_crc):
+    """Return (position, found) where 'position' is the offset in 'index' of
+       the slot of the record, or of the empty slot where it would go."""
+
+    slot = (struct.unpack_from(">I", binary_sha1)[0] ^ language_crc) & (capacity - 1)
+
+    while True:
+        position = HEADER_SIZE + slot * SLOT.size
+        slot_sha1 = index[position:position + 20]
+        if slot_sha1 == EMPTY:
+            return position, False
+        elif slot_sha1 == binary_sha1 and struct.unpack_from(">I", index, position + 20)[0] == language_crc:
+            return position, True
+        slot = (slot + 1) & (capacity - 1)
+
+def writeIndex(path, capacity, generation, slots):
+    """Write a new index file with the slots 'slots', an iterable of tuples
+       (binary SHA-1, language CRC, offset, length, access time), to 'path'."""
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0660)
+    try:
+        # The file is sparse until slots are filled in.
+        os.ftruncate(fd, HEADER_SIZE + capacity * SLOT.size)
+        index = mmap.mmap(fd, 0, access=mmap.ACCESS_WRITE)
+    finally:
+        os.close(fd)
+
+    count = 0
+
+    try:
+        for slot in slots:
+            position, found = findSlot(index, capacity, slot[0], slot[1])
+            if not found:
+                SLOT.pack_into(index, position, *slot)
+                count += 1
+
+        HEADER.pack_into(index, 0, MAGIC, VERSION, capacity, count, generation)
+    finally:
+        index.close()
+
+    os.chmod(path, 0660)
+
+class Store(object):
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "highlight.idx")
+        self.lock_path = os.path.join(cache_dir, "highlight.lock")
+
+        self.__index = None
+        self.__identity = None
+        self.__writable = False
+        self.__capacity = 0
+        self.__generation = 0
+        self.__pack = None
+        self.__lock_fd = None
+
+    def __generatePackPath(self, generation):
+        return os.path.join(self.cache_dir, "highlight.%d.pack" % generation)
+
+    def __close(self):
+        if self.__index is not None:
+            self.__index.close()
+            self.__index = None
+            self.__identity = None
+        if self.__pack is not None:
+            self.__pack.close()
+            self.__pack = None
+
+    def __open(self):
+        self.__close()
+
+        try:
+            fd = os.open(self.index_path, os.O_RDWR)
+            writable = True
+        except OSError, error:
+            if error.errno == errno.ENOENT:
+                return False
+            elif error.errno == errno.EACCES:
+                fd = os.open(self.index_path, os.O_RDONLY)
+                writable = False
+            else:
+                raise
+
+        try:
+            status = os.fstat(fd)
+            if status.st_size < HEADER_SIZE:
+                return False
+            index = mmap.mmap(fd, 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        magic, version, capacity, count, generation = HEADER.unpack_from(index, 0)
+
+        if magic != MAGIC or version != VERSION or len(index) != HEADER_SIZE + capacity * SLOT.size:
+            # Incompletely written or from an incompatible version; treated as
+            # missing, and replaced by the next writer.
+            index.close()
+            return False
+
+        self.__index = index
+        self.__identity = (status.st_dev, status.st_ino)
+        self.__writable = writable
+        self.__capacity = capacity
+        self.__generation = generation
+        return True
+
+    def __refresh(self):
+        """Reopen the index if it has been replaced since it was opened.
+           Returns True if it was reopened."""
+
+        try:
+            status = os.stat(self.index_path)
+        except OSError, error:
+            if error.errno == errno.ENOENT:
+                self.__close()
+                return False
+            raise
+
+        if (status.st_dev, status.st_ino) == self.__identity:
+            return False
+
+        return self.__open()
+
+    def __lock(self):
+        try: os.makedirs(self.cache_dir, 0750)
+        except OSError, error:
+            if error.errno != errno.EEXIST: raise
+
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0660)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except:
+            os.close(fd)
+            raise
+        self.__lock_fd = fd
+
+        # Another process may have replaced the index while we waited.
+        self.__refresh()
+
+        if self.__index is None:
+            self.__create()
+
+    def __unlock(self):
+        os.close(self.__lock_fd)
+        self.__lock_fd = None
+
+    def __create(self):
+        """Create a new empty index, and start a new pack file.  Called with
+           the lock held, when there's no usable index."""
+
+        generation = max([0] + [generation for generation, path in self.__listPacks()]) + 1
+
+        writeIndex(self.index_path + ".tmp", INITIAL_CAPACITY, generation, [])
+        os.rename(self.index_path + ".tmp", self.index_path)
+
+        self.__open()
+
+    def __listPacks(self):
+        packs = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith("highlight.") and filename.endswith(".pack"):
+                try: packs.append((int(filename[10:-5]), os.path.join(self.cache_dir, filename)))
+                except ValueError: pass
+        return packs
+
+    def __slots(self):
+        """Generate the used slots of the index as (binary SHA-1, language
+           CRC, offset, length, access time) tuples."""
+
+        index = self.__index
+        for slot in xrange(self.__capacity):
+            position = HEADER_SIZE + slot * SLOT.size
+            if index[position:position + 20] != EMPTY:
+                yield SLOT.unpack_from(index, position)
+
+    def __lookup(self, binary_sha1, language_crc):
+        if self.__index is None:
+            return None
+
+        position, found = findSlot(self.__index, self.__capacity, binary_sha1, language_crc)
+
+        if found: return position
+        else: return None
+
+    def __find(self, binary_sha1, language_crc):
+        position = self.__lookup(binary_sha1, language_crc)
+        if position is None and self.__refresh():
+            position = self.__lookup(binary_sha1, language_crc)
+        return position
+
+    def __readRecord(self, offset, length):
+        if self.__pack is None or offset + length > len(self.__pack):
+            if self.__pack is not None:
+                self.__pack.close()
+                self.__pack = None
+            with open(self.__generatePackPath(self.__generation), "rb") as pack_file:
+                self.__pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if offset + length > len(self.__pack):
+                return None
+        return self.__pack[offset:offset + length]
+
+    def contains(self, sha1, language):
+        return self.__find(binascii.unhexlify(sha1), getLanguageCRC(language)) is not None
+
+    def __readData(self, position, binary_sha1, language):
+        slot_sha1, slot_crc, offset, length, access_time = SLOT.unpack_from(self.__index, position)
+
+        record = self.__readRecord(offset, length)
+        header_length = 25 + len(language)
+
+        # A record's length is stored in it, so that a slot that's read while
+        # being updated (see update()) is detected.
+        if (record is None or len(record) < header_length or
+            record[:20] != binary_sha1 or
+            ord(record[20]) != len(language) or
+            record[21:21 + len(language)] != language or
+            struct.unpack_from(">I", record, 21 + len(language))[0] != length):
+            return None
+
+        try:
+            return zlib.decompress(record[header_length:])
+        except zlib.error:
+            return None
+
+    def get(self, sha1, language):
+        """Return the highlighted file, or None if it isn't stored."""
+
+        binary_sha1 = binascii.unhexlify(sha1)
+        language_crc = getLanguageCRC(language)
+
+        position = self.__find(binary_sha1, language_crc)
+        if position is None:
+            return None
+
+        try:
+            data = self.__readData(position, binary_sha1, language)
+            if data is None:
+                # Possibly a slot being updated; look again.
+                data = self.__readData(position, binary_sha1, language)
+        except IOError, error:
+            if error.errno != errno.ENOENT: raise
+            # The store was compacted after we opened the index; try again
+            # with the new index.
+            if not self.__refresh(): return None
+            return self.get(sha1, language)
+
+        if data is None:
+            return None
+
+        now = int(time.time())
+        access_time = struct.unpack_from(">I", self.__index, position + SLOT_ACCESS_TIME_OFFSET)[0]
+
+        if self.__writable and now - access_time > TOUCH_INTERVAL:
+            struct.pack_into(">I", self.__index, position + SLOT_ACCESS_TIME_OFFSET, now)
+
+        return data
+
+    def __append(self, binary_sha1, language_crc, language, data, position, access_time):
+        """Append a record to the pack file, and fill in the slot at
+           'position', or a new slot if 'position' is None.  Called with the
+           lock held."""
+
+        if position is None:
+            magic, version, capacity, count, generation = HEADER.unpack_from(self.__index, 0)
+
+            if count + 1 > capacity * MAXIMUM_LOAD:
+                writeIndex(self.index_path + ".tmp", capacity * 2, generation, self.__slots())
+                os.rename(self.index_path + ".tmp", self.index_path)
+                self.__open()
+
+        compressed = zlib.compress(data)
+        length = 25 + len(language) + len(compressed)
+        record = binary_sha1 + chr(len(language)) + language + struct.pack(">I", length) + compressed
+
+        fd = os.open(self.__generatePackPath(self.__generation), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0660)
+        try:
+            offset = os.lseek(fd, 0, os.SEEK_END)
+            try:
+                written = 0
+                while written < len(record):
+                    written += os.write(fd, record[written:])
+            except:
+                # Don't leave a partial record behind.
+                os.ftruncate(fd, offset)
+                raise
+        finally:
+            os.close(fd)
+
+        if position is None:
+            position, found = findSlot(self.__index, self.__capacity, binary_sha1, language_crc)
+
+            # Fill in the SHA-1 last; until then, readers see an empty slot.
+            struct.pack_into(">IQII", self.__index, position + 20, language_crc, offset, length, access_time)
+            self.__index[position:position + 20] = binary_sha1
+
+            magic, version, capacity, count, generation = HEADER.unpack_from(self.__index, 0)
+            HEADER.pack_into(self.__index, 0, MAGIC, VERSION, capacity, count + 1, generation)
+        else:
+            struct.pack_into(">QII", self.__index, position + 24, offset, length, access_time)
+
+    def put(self, sha1, language, data, access_time=None):
+        """Add a highlighted file to the store, unless it's already stored."""
+
+        binary_sha1 = binascii.unhexlify(sha1)
+        language_crc = getLanguageCRC(language)
+
+        self.__lock()
+        try:
+            if self.__lookup(binary_sha1, language_crc) is None:
+                self.__append(binary_sha1, language_crc, language, data, None, access_time or int(time.time()))
+        finally:
+            self.__unlock()
+
+    def update(self, sha1, language, function):
+        """Replace the stored file (if any) with function(stored file or
+           None), unless that returns None.  Other writers are locked out while
+           'function' runs."""
+
+        binary_sha1 = binascii.unhexlify(sha1)
+        language_crc = getLanguageCRC(language)
+
+        self.__lock()
+        try:
+            position = self.__lookup(binary_sha1, language_crc)
+
+            if position is not None:
+                current = self.__readData(position, binary_sha1, language)
+            else:
+                current = None
+
+            data = function(current)
+
+            if data is not None:
+                self.__append(binary_sha1, language_crc, language, data, position, int(time.time()))
+        finally:
+            self.__unlock()
+
+    def sha1s(self):
+        """Generate the SHA-1s of all stored files."""
+
+        self.__refresh()
+
+        if self.__index is not None:
+            for slot in self.__slots():
+                yield binascii.hexlify(slot[0])
+
+    def compact(self, max_age):
+        """Drop records that haven't been read in 'max_age' seconds, by copying
+           the other records into a new pack file.  Returns a tuple (number of
+           kept records, number of dropped records.)"""
+
+        self.__lock()
+        try:
+            now = time.time()
+            slots = sorted(self.__slots(), key=lambda slot: slot[2])
+            kept = []
+
+            generation = self.__generation + 1
+            pack_path = self.__generatePackPath(generation)
+
+            with open(pack_path, "wb") as pack_file:
+                offset = 0
+                for binary_sha1, language_crc, old_offset, length, access_time in slots:
+                    if now - access_time > max_age:
+                        continue
+                    record = self.__readRecord(old_offset, length)
+                    if record is None:
+                        continue
+                    pack_file.write(record)
+                    kept.append((binary_sha1, language_crc, offset, length, access_time))
+                    offset += length
+
+            os.chmod(pack_path, 0660)
+
+            capacity = INITIAL_CAPACITY
+            while len(kept) * 2 > capacity * MAXIMUM_LOAD:
+                capacity *= 2
+
+            writeIndex(self.index_path + ".tmp", capacity, generation, kept)
+            os.rename(self.index_path + ".tmp", self.index_path)
+
+            self.__open()
+
+            # Processes that still have the old pack file open can keep reading
+            # from it; others will find the new index.
+            for old_generation, old_pack_path in self.__listPacks():
+                if old_generation != generation:
+                    os.unlink(old_pack_path)
+
+            return len(kept), len(slots) - len(kept)
+        finally:
+            self.__unlock()
+
+store = None
+
+def getStore():
+    global store
+    if store is None:
+        store = Store(configuration.services.HIGHLIGHT["cache_dir"])
+    return store